@@ -2,14 +2,44 @@ from flask_sqlalchemy import SQLAlchemy
 from flask import Flask
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
+from attendance import database
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = '59d4e34a8c7c47b529b7e73b461982c4'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
+app.config['FACENET_MODEL_DIR'] = 'attendance/facenet/src/20180402-114759/'
+app.config['FACENET_CLASSIFIER'] = 'attendance/facenet/src/20180402-114759/my_classifier.pkl'
+app.config['FACENET_TRAIN_IMG'] = 'attendance/facenet/dataset/raw'
+# my_classifier.pkl se entreno con recortes de la caja; activarlo exige
+# regenerar el dataset con align_dataset_mtcnn --align_landmarks y reentrenar
+app.config['FACENET_ALIGN_LANDMARKS'] = False
+app.config['EMBEDDING_MODEL_VERSION'] = 'dlib_resnet_v1'
+app.config['EMBEDDING_DTYPE'] = 'float32'
+app.config['GALLERY_REFRESH_SECONDS'] = 30.0
+app.config['GALLERY_INDEX'] = 'brute'
+app.config['GALLERY_INDEX_PARAMS'] = {}
+app.config['RECOGNITION_TOLERANCE'] = {'detect': 0.45, 'mark': 0.6}
+app.config['FACENET_MIN_PROBABILITY'] = 0.43
+app.config['MTCNN_THRESHOLD'] = [0.6, 0.7, 0.7]
+app.config['CALIBRATION_FILE'] = None
+app.config['RECOGNITION_CACHE_SIZE'] = 256
+app.config['RECOGNITION_CACHE_TTL'] = 2.0
+app.config['RECOGNITION_CACHE_MAX_DISTANCE'] = 8
+app.config['MOTION_GATE'] = True
+app.config['MOTION_THRESHOLD'] = 25
+app.config['MOTION_MIN_AREA'] = 0.002
+app.config['MOTION_ALPHA'] = 0.05
+app.config['MOTION_REGION_MARGIN'] = 0.5
+app.config['PRESENCE_FLUSH_INTERVAL'] = 5.0
+app.config['PRESENCE_FLUSH_COUNT'] = 50
+app.config['REPORTS_TTL'] = 24 * 3600
+app.config['REPORTS_MAX_DAYS'] = 366
+database.configure(app)
 db = SQLAlchemy(app)
+database.init_engine(app, db)
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'
 
-from attendance import routes
\ No newline at end of file
+from attendance import routes
@@ -0,0 +1,394 @@
+"""
+Indices de vecino mas cercano para la galeria de embeddings.
+
+Todos los indices comparten la misma interfaz (add, remove, search, save y
+load_index) y trabajan con identificadores propios (el id de la fila de
+face_embedding), de modo que la galeria puede anadir o quitar embeddings sin
+reconstruir el indice:
+
+    brute  Busqueda exacta con BLAS: |x - q|^2 = |x|^2 - 2 x.q + |q|^2
+    ivf    Inverted file en NumPy: k-means sobre la galeria y busqueda exacta
+           solo en las nprobe listas mas cercanas a la consulta
+    hnsw   Grafo HNSW de hnswlib (opcional, solo si esta instalado)
+
+Con unos pocos miles de estudiantes brute es suficiente; ivf y hnsw tienen
+sentido a partir de ~100k caras enroladas.
+"""
+import json
+import os
+import uuid
+
+import numpy as np
+
+INDEX_KINDS = ('brute', 'ivf', 'hnsw')
+
+
+def _as_matrix(vectors, dim=None):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    if dim is not None and vectors.shape[1] != dim:
+        raise ValueError('Dimension %d distinta a la del indice (%d)' % (vectors.shape[1], dim))
+    return vectors
+
+
+def _top_k(sq_dists, k):
+    """Indices de las k menores distancias de cada fila, ordenadas."""
+    k = min(k, sq_dists.shape[1])
+    if k < sq_dists.shape[1]:
+        part = np.argpartition(sq_dists, k - 1, axis=1)[:, :k]
+    else:
+        part = np.tile(np.arange(sq_dists.shape[1]), (sq_dists.shape[0], 1))
+    order = np.take_along_axis(sq_dists, part, axis=1).argsort(axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+def _replace(path, write):
+    """Escribe path con write(f) en un temporal y lo renombra con os.replace.
+
+    Un proceso que carga el indice a la vez ve el fichero anterior o el
+    nuevo, nunca uno a medias.
+    """
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
+
+
+def _pad(dists, ids, k):
+    # Menos candidatos que k: se completa con id -1 y distancia infinita
+    if dists.shape[1] < k:
+        extra = k - dists.shape[1]
+        dists = np.pad(dists, ((0, 0), (0, extra)), constant_values=np.inf)
+        ids = np.pad(ids, ((0, 0), (0, extra)), constant_values=-1)
+    return dists, ids
+
+
+class BruteForceIndex:
+    """Busqueda exacta sobre la matriz completa."""
+
+    kind = 'brute'
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.ids = np.zeros((0,), np.int64)
+        self.vectors = np.zeros((0, dim), np.float32)
+        self.sq_norms = np.zeros((0,), np.float32)
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    def add(self, ids, vectors):
+        vectors = _as_matrix(vectors, self.dim)
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        if ids.shape[0] != vectors.shape[0]:
+            raise ValueError('Se esperaban %d ids y hay %d' % (vectors.shape[0], ids.shape[0]))
+        sq_norms = np.einsum('ij,ij->i', vectors, vectors)
+        if len(self) == 0:
+            # Indice vacio: se comparte la matriz de la galeria sin copiarla
+            self.ids, self.vectors, self.sq_norms = ids, vectors, sq_norms
+            return
+        self.ids = np.concatenate([self.ids, ids])
+        self.vectors = np.concatenate([self.vectors, vectors])
+        self.sq_norms = np.concatenate([self.sq_norms, sq_norms])
+
+    def remove(self, ids):
+        """Quita las filas con esos ids. Devuelve cuantas se han quitado."""
+        keep = ~np.isin(self.ids, np.asarray(ids, dtype=np.int64))
+        removed = int(keep.shape[0] - keep.sum())
+        if removed:
+            self.ids, self.vectors, self.sq_norms = self.ids[keep], self.vectors[keep], self.sq_norms[keep]
+        return removed
+
+    def _search_rows(self, queries, rows, k):
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        sq_norms = self.sq_norms if rows is None else self.sq_norms[rows]
+        ids = self.ids if rows is None else self.ids[rows]
+        # Una sola multiplicacion de matrices para todas las consultas
+        sq_dists = sq_norms[None, :] - 2.0 * (queries @ vectors.T)
+        sq_dists += np.einsum('ij,ij->i', queries, queries)[:, None]
+        best = _top_k(sq_dists, k)
+        dists = np.sqrt(np.maximum(np.take_along_axis(sq_dists, best, axis=1), 0.0))
+        return _pad(dists, ids[best], k)
+
+    def search(self, queries, k=1):
+        """Los k vecinos mas cercanos de cada consulta.
+
+        Returns:
+            tuple: (distancias euclideas (q, k), ids (q, k)); id -1 si no hay vecino
+        """
+        queries = _as_matrix(queries, self.dim)
+        if len(self) == 0:
+            return (np.full((queries.shape[0], k), np.inf, np.float32),
+                    np.full((queries.shape[0], k), -1, np.int64))
+        return self._search_rows(queries, None, k)
+
+    def _state(self):
+        return {'ids': self.ids, 'vectors': self.vectors}
+
+    def save(self, path):
+        """Guarda el indice en un .npz (ver load_index)."""
+        meta = {'kind': self.kind, 'dim': self.dim, 'params': self.params()}
+        return _replace(path, lambda f: np.savez(
+            f, meta=np.frombuffer(json.dumps(meta).encode('utf-8'), np.uint8), **self._state()))
+
+    def params(self):
+        return {}
+
+    def _restore(self, data):
+        self.ids = data['ids'].astype(np.int64)
+        self.vectors = data['vectors'].astype(np.float32)
+        self.sq_norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+
+
+class IVFIndex(BruteForceIndex):
+    """Inverted file: k-means con nlist centroides y busqueda en nprobe listas.
+
+    Las filas se guardan agrupadas por lista (como CSR) para que cada lista
+    sea un bloque contiguo. Las altas y bajas posteriores al entrenamiento se
+    asignan al centroide mas cercano y el agrupado se rehace en la siguiente
+    busqueda.
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, dim, nlist=None, nprobe=8, niter=10, seed=0):
+        BruteForceIndex.__init__(self, dim)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.niter = niter
+        self.seed = seed
+        self.centroids = None
+        self.assign = np.zeros((0,), np.int32)
+        self._offsets = None
+
+    def params(self):
+        return {'nlist': self.nlist, 'nprobe': self.nprobe, 'niter': self.niter, 'seed': self.seed}
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def train(self, vectors, max_samples=50000):
+        """k-means (Lloyd) sobre una muestra de vectors."""
+        vectors = _as_matrix(vectors, self.dim)
+        rng = np.random.RandomState(self.seed)
+        if vectors.shape[0] > max_samples:
+            vectors = vectors[rng.choice(vectors.shape[0], max_samples, replace=False)]
+        nlist = self.nlist or max(1, int(4 * np.sqrt(vectors.shape[0])))
+        nlist = min(nlist, vectors.shape[0])
+        centroids = vectors[rng.choice(vectors.shape[0], nlist, replace=False)].copy()
+        for _ in range(self.niter):
+            assign = self._nearest_centroid(vectors, centroids)
+            counts = np.bincount(assign, minlength=nlist)
+            filled = np.flatnonzero(counts)
+            order = np.argsort(assign, kind='stable')
+            starts = np.concatenate([[0], np.cumsum(counts)])[filled]
+            # Las listas vacias conservan su centroide anterior
+            sums = np.add.reduceat(vectors[order], starts, axis=0)
+            centroids[filled] = sums / counts[filled, None]
+        self.nlist = nlist
+        self.centroids = centroids
+        self.assign = self._nearest_centroid(self.vectors, centroids) if len(self) else self.assign
+        self._offsets = None
+
+    @staticmethod
+    def _nearest_centroid(vectors, centroids, chunk=8192):
+        c_norms = np.einsum('ij,ij->i', centroids, centroids)
+        out = np.empty((vectors.shape[0],), np.int32)
+        for start in range(0, vectors.shape[0], chunk):
+            block = vectors[start:start + chunk]
+            out[start:start + chunk] = np.argmin(c_norms[None, :] - 2.0 * (block @ centroids.T), axis=1)
+        return out
+
+    def add(self, ids, vectors):
+        vectors = _as_matrix(vectors, self.dim)
+        BruteForceIndex.add(self, ids, vectors)
+        if self.is_trained:
+            self.assign = np.concatenate([self.assign, self._nearest_centroid(vectors, self.centroids)])
+        self._offsets = None
+
+    def remove(self, ids):
+        keep = ~np.isin(self.ids, np.asarray(ids, dtype=np.int64))
+        removed = int(keep.shape[0] - keep.sum())
+        if removed:
+            self.ids, self.vectors, self.sq_norms = self.ids[keep], self.vectors[keep], self.sq_norms[keep]
+            if self.is_trained:
+                self.assign = self.assign[keep]
+            self._offsets = None
+        return removed
+
+    def _group(self):
+        # Reordena las filas por lista; _offsets[l]:_offsets[l+1] es la lista l
+        order = np.argsort(self.assign, kind='stable')
+        self.ids, self.vectors = self.ids[order], self.vectors[order]
+        self.sq_norms, self.assign = self.sq_norms[order], self.assign[order]
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(self.assign, minlength=self.nlist))])
+
+    def search(self, queries, k=1, nprobe=None):
+        queries = _as_matrix(queries, self.dim)
+        if not self.is_trained or len(self) == 0:
+            return BruteForceIndex.search(self, queries, k)
+        if self._offsets is None:
+            self._group()
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        c_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        probes = _top_k(c_norms[None, :] - 2.0 * (queries @ self.centroids.T), nprobe)
+
+        all_dists = np.full((queries.shape[0], k), np.inf, np.float32)
+        all_ids = np.full((queries.shape[0], k), -1, np.int64)
+        for qi in range(queries.shape[0]):
+            rows = np.concatenate([np.arange(self._offsets[l], self._offsets[l + 1]) for l in probes[qi]])
+            if rows.shape[0] == 0:
+                continue
+            dists, ids = self._search_rows(queries[qi:qi + 1], rows, k)
+            all_dists[qi], all_ids[qi] = dists[0], ids[0]
+        return all_dists, all_ids
+
+    def _state(self):
+        state = BruteForceIndex._state(self)
+        if self.is_trained:
+            state.update(centroids=self.centroids, assign=self.assign)
+        return state
+
+    def _restore(self, data):
+        BruteForceIndex._restore(self, data)
+        if 'centroids' in data:
+            self.centroids = data['centroids'].astype(np.float32)
+            self.assign = data['assign'].astype(np.int32)
+        self._offsets = None
+
+
+class HNSWIndex:
+    """Envoltorio de hnswlib con la misma interfaz que los indices NumPy."""
+
+    kind = 'hnsw'
+
+    def __init__(self, dim, M=16, ef_construction=200, ef=64, max_elements=1024):
+        try:
+            import hnswlib
+        except ImportError:
+            raise ValueError('El indice hnsw necesita el paquete hnswlib (pip install hnswlib)')
+        self.dim = dim
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef = ef
+        self._index = hnswlib.Index(space='l2', dim=dim)
+        self._index.init_index(max_elements=max_elements, ef_construction=ef_construction, M=M,
+                               allow_replace_deleted=True)
+        self._index.set_ef(ef)
+        self._ids = set()
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def ids(self):
+        return np.asarray(sorted(self._ids), dtype=np.int64)
+
+    def params(self):
+        return {'M': self.M, 'ef_construction': self.ef_construction, 'ef': self.ef}
+
+    def add(self, ids, vectors):
+        vectors = _as_matrix(vectors, self.dim)
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        needed = len(self._ids) + ids.shape[0]
+        if needed > self._index.get_max_elements():
+            self._index.resize_index(max(needed, 2 * self._index.get_max_elements()))
+        self._index.add_items(vectors, ids, replace_deleted=True)
+        self._ids.update(int(i) for i in ids)
+
+    def remove(self, ids):
+        removed = 0
+        for i in np.asarray(ids, dtype=np.int64).reshape(-1):
+            if int(i) in self._ids:
+                self._index.mark_deleted(int(i))
+                self._ids.discard(int(i))
+                removed += 1
+        return removed
+
+    def search(self, queries, k=1):
+        queries = _as_matrix(queries, self.dim)
+        n = min(k, len(self))
+        if n == 0:
+            return (np.full((queries.shape[0], k), np.inf, np.float32),
+                    np.full((queries.shape[0], k), -1, np.int64))
+        self._index.set_ef(max(self.ef, n))
+        ids, sq_dists = self._index.knn_query(queries, k=n)
+        dists = np.sqrt(np.maximum(sq_dists, 0.0)).astype(np.float32)
+        return _pad(dists, ids.astype(np.int64), k)
+
+    def save(self, path):
+        # El grafo va a un fichero con nombre propio y el JSON que lo nombra se
+        # reemplaza al final: quien carga ve el par anterior o el nuevo
+        directory = os.path.dirname(path)
+        graph = '%s.%s.bin' % (os.path.basename(path), uuid.uuid4().hex[:8])
+        self._index.save_index(os.path.join(directory, graph))
+        previous = None
+        try:
+            with open(path) as f:
+                previous = json.load(f).get('graph')
+        except (OSError, ValueError):
+            pass
+        meta = {'kind': self.kind, 'dim': self.dim, 'params': self.params(), 'ids': sorted(self._ids),
+                'graph': graph}
+        _replace(path, lambda f: f.write(json.dumps(meta).encode('utf-8')))
+        if previous and previous != graph:
+            try:
+                os.remove(os.path.join(directory, previous))
+            except OSError:
+                pass
+        return path
+
+    def _load(self, path, meta):
+        graph = os.path.join(os.path.dirname(path), meta.get('graph') or os.path.basename(path) + '.bin')
+        self._index.load_index(graph, allow_replace_deleted=True)
+        self._index.set_ef(self.ef)
+        self._ids = set(meta['ids'])
+
+
+def make_index(kind, dim, **params):
+    """Crea un indice vacio de tipo kind ('brute', 'ivf' o 'hnsw')."""
+    if kind == 'brute':
+        return BruteForceIndex(dim)
+    if kind == 'ivf':
+        return IVFIndex(dim, **params)
+    if kind == 'hnsw':
+        return HNSWIndex(dim, **params)
+    raise ValueError('Tipo de indice desconocido: %s (opciones: %s)' % (kind, ', '.join(INDEX_KINDS)))
+
+
+def build_index(kind, ids, vectors, **params):
+    """Crea un indice, lo entrena si hace falta y anade todos los vectores."""
+    vectors = _as_matrix(vectors)
+    index = make_index(kind, vectors.shape[1], **params)
+    if kind == 'ivf' and vectors.shape[0]:
+        index.train(vectors)
+    index.add(ids, vectors)
+    return index
+
+
+def load_index(path):
+    """Carga un indice guardado con save()."""
+    with open(path, 'rb') as f:
+        head = f.read(2)
+    if head != b'PK':
+        # hnsw: metadatos en JSON y el grafo en el fichero .bin que nombra
+        with open(path) as f:
+            meta = json.load(f)
+        index = make_index(meta['kind'], meta['dim'], **meta['params'])
+        index._load(path, meta)
+        return index
+    with np.load(path) as data:
+        meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+        index = make_index(meta['kind'], meta['dim'], **meta['params'])
+        index._restore(data)
+    return index
+
+
+def index_path(directory, model_version, kind):
+    return os.path.join(directory, 'gallery_%s_%s.idx' % (model_version, kind))
@@ -0,0 +1,338 @@
+"""
+Calibracion de los umbrales de reconocimiento con los datos enrolados.
+
+Los umbrales fijos (tolerancia 0.45 de /detect, 0.6 de /attendance_mark y
+probabilidad 0.43 del clasificador FaceNet) no dependen de nuestras camaras
+ni de nuestros estudiantes. Este modulo toma los embeddings ya enrolados,
+calcula de una vez las distancias de todos los pares (genuinos: mismo
+estudiante; impostores: estudiantes distintos) y elige para cada ruta el
+umbral que da la FAR objetivo. El resultado se guarda en CALIBRATION_FILE y
+las rutas lo leen con thresholds.get(); sin fichero se usan los valores de
+RECOGNITION_TOLERANCE y FACENET_MIN_PROBABILITY.
+
+Los embeddings dlib ya estan en la galeria. Con --facenet tambien se
+calibra la probabilidad minima del clasificador; los embeddings FaceNet de
+FACENET_TRAIN_IMG se guardan en un .npz y solo se recalculan las fotos
+nuevas o modificadas.
+
+Uso:
+    python -m attendance.calibration [--detect_far 1e-4] [--mark_far 1e-3] [--facenet]
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+
+from attendance import app
+
+FAR_TARGETS = (1e-5, 1e-4, 1e-3, 1e-2)
+FRR_TARGETS = (0.001, 0.01, 0.05)
+
+
+def pair_distances(embeddings, labels, max_impostors=20000000, chunk_size=256, seed=0):
+    """Distancias euclideas de los pares genuinos e impostores, ordenadas.
+
+    La matriz de distancias se calcula por bloques de filas con
+    |a|^2 + |b|^2 - 2 a.b y solo se usa el triangulo superior. Si hay mas de
+    max_impostors pares impostores se toma una muestra aleatoria uniforme.
+
+    Args:
+        embeddings: Matriz (n, dim)
+        labels: Identidad de cada fila (n,)
+        max_impostors: Maximo de distancias impostoras que se guardan
+
+    Returns:
+        tuple: (genuinas, impostoras), arrays float32 ordenados
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    labels = np.asarray(labels)
+    n = embeddings.shape[0]
+    nrof_impostors = (n * (n - 1) - int(np.sum(np.unique(labels, return_counts=True)[1].astype(np.int64) ** 2)) + n) // 2
+    keep = min(1.0, max_impostors / float(max(nrof_impostors, 1)))
+    rng = np.random.RandomState(seed)
+
+    sq_norms = np.einsum('ij,ij->i', embeddings, embeddings)
+    genuine, impostor = [], []
+    for start in range(0, n, chunk_size):
+        end = min(n, start + chunk_size)
+        # Filas start:end contra las columnas posteriores a cada fila
+        d2 = sq_norms[start:end, None] + sq_norms[None, start + 1:] - 2.0 * embeddings[start:end].dot(embeddings[start + 1:].T)
+        upper = np.arange(start + 1, n)[None, :] > np.arange(start, end)[:, None]
+        same = labels[start:end, None] == labels[None, start + 1:]
+        dist = np.sqrt(np.maximum(d2, 0.0))
+        genuine.append(dist[upper & same])
+        other = upper & ~same
+        if keep < 1.0:
+            other &= rng.random_sample(other.shape) < keep
+        impostor.append(dist[other])
+    genuine = np.sort(np.concatenate(genuine)) if genuine else np.zeros(0, np.float32)
+    impostor = np.sort(np.concatenate(impostor)) if impostor else np.zeros(0, np.float32)
+    return genuine, impostor
+
+
+def threshold_at_far(genuine, impostor, far):
+    """Mayor tolerancia (se acepta dist <= t) con una FAR no mayor que far.
+
+    Returns:
+        tuple: (umbral, FAR obtenida, FRR obtenida)
+    """
+    nrof_accepted = int(np.floor(far * impostor.size))
+    if nrof_accepted >= impostor.size:
+        threshold = float(genuine[-1]) if genuine.size else float('inf')
+    else:
+        # Justo por debajo de la primera distancia impostora que no se acepta
+        threshold = float(np.nextafter(np.float32(impostor[nrof_accepted]), np.float32(0)))
+    return threshold, _far(impostor, threshold), _frr(genuine, threshold)
+
+
+def threshold_at_frr(genuine, impostor, frr):
+    """Menor tolerancia con una FRR no mayor que frr: (umbral, FAR, FRR)."""
+    nrof_accepted = int(np.ceil((1.0 - frr) * genuine.size))
+    threshold = float(genuine[nrof_accepted - 1]) if nrof_accepted > 0 else 0.0
+    return threshold, _far(impostor, threshold), _frr(genuine, threshold)
+
+
+def _far(impostor, threshold):
+    return np.searchsorted(impostor, threshold, side='right') / float(max(impostor.size, 1))
+
+
+def _frr(genuine, threshold):
+    return 1.0 - np.searchsorted(genuine, threshold, side='right') / float(max(genuine.size, 1))
+
+
+def probability_at_far(genuine, impostor, far):
+    """Probabilidad minima (se acepta p > t) con una FAR no mayor que far.
+
+    genuine e impostor son probabilidades ordenadas de menor a mayor.
+
+    Returns:
+        tuple: (umbral, FAR obtenida, FRR obtenida)
+    """
+    nrof_accepted = int(np.floor(far * impostor.size))
+    threshold = float(impostor[impostor.size - nrof_accepted - 1]) if nrof_accepted < impostor.size else 0.0
+    far = 1.0 - np.searchsorted(impostor, threshold, side='right') / float(max(impostor.size, 1))
+    frr = np.searchsorted(genuine, threshold, side='right') / float(max(genuine.size, 1))
+    return threshold, far, frr
+
+
+def report(genuine, impostor):
+    """Tabla de umbrales para las FAR y FRR objetivo habituales."""
+    return {
+        'nrof_genuine': int(genuine.size),
+        'nrof_impostor': int(impostor.size),
+        'far': [dict(zip(('target', 'threshold', 'far', 'frr'), (t,) + threshold_at_far(genuine, impostor, t)))
+                for t in FAR_TARGETS],
+        'frr': [dict(zip(('target', 'threshold', 'far', 'frr'), (t,) + threshold_at_frr(genuine, impostor, t)))
+                for t in FRR_TARGETS],
+    }
+
+
+def calibrate_gallery(model_version=None, detect_far=1e-4, mark_far=1e-3):
+    """Tolerancias de /detect y /attendance_mark con la galeria de model_version."""
+    from attendance.gallery import load_gallery
+
+    gallery = load_gallery(model_version or app.config['EMBEDDING_MODEL_VERSION'])
+    genuine, impostor = pair_distances(gallery.embeddings, gallery.student_ids)
+    if genuine.size == 0 or impostor.size == 0:
+        raise ValueError('Hacen falta al menos dos estudiantes con dos embeddings cada uno')
+    return {
+        'model_version': gallery.model_version,
+        'detect': threshold_at_far(genuine, impostor, detect_far)[0],
+        'mark': threshold_at_far(genuine, impostor, mark_far)[0],
+        'targets': {'detect': detect_far, 'mark': mark_far},
+        'report': report(genuine, impostor),
+    }
+
+
+def facenet_embeddings(recognizer, train_img, cache_path):
+    """Embeddings FaceNet de las fotos con una sola cara de train_img.
+
+    Se reutilizan los del .npz de cache_path cuyas fotos no han cambiado
+    (misma ruta y mtime) y solo se calculan los nuevos.
+
+    Returns:
+        tuple: (embeddings (n, dim), indice de recognizer.human_names de cada fila)
+    """
+    import cv2
+
+    cached = {}
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            for path, mtime, emb in zip(data['paths'], data['mtimes'], data['embeddings']):
+                cached[(str(path), float(mtime))] = emb
+
+    paths, mtimes, vectors, labels = [], [], [], []
+    for label, name in enumerate(recognizer.human_names):
+        folder = os.path.join(train_img, name)
+        if not os.path.isdir(folder):
+            continue
+        for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+            key = (entry.path, entry.stat().st_mtime)
+            emb = cached.get(key)
+            if emb is None:
+                img = cv2.imread(entry.path)
+                if img is None:
+                    continue
+                _, embs = recognizer.embed(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+                if len(embs) != 1:
+                    continue
+                emb = embs[0]
+            paths.append(key[0])
+            mtimes.append(key[1])
+            vectors.append(emb)
+            labels.append(label)
+
+    embeddings = np.array(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    np.savez(cache_path, paths=np.array(paths), mtimes=np.array(mtimes, dtype=np.float64), embeddings=embeddings)
+    return embeddings, np.array(labels, dtype=np.int64)
+
+
+def calibrate_facenet(far=1e-3):
+    """Probabilidad minima del clasificador FaceNet para la FAR far.
+
+    Genuina es la probabilidad de la clase correcta de cada foto; impostora,
+    la mayor probabilidad de las demas clases (lo que veria el clasificador
+    si esa persona no estuviera enrolada). El SVM se entreno con estas mismas
+    fotos, asi que el umbral es algo optimista.
+    """
+    from attendance import recognition
+
+    recognizer = recognition.get_recognizer()
+    # Recortes y caras alineadas dan embeddings distintos: cada modo su cache
+    name = 'facenet_embeddings_aligned.npz' if recognizer.align_landmarks else 'facenet_embeddings.npz'
+    cache_path = os.path.join(_calibration_dir(), name)
+    embeddings, labels = facenet_embeddings(recognizer, app.config['FACENET_TRAIN_IMG'], cache_path)
+    if embeddings.shape[0] == 0:
+        raise ValueError('No hay fotos con una sola cara en %s' % app.config['FACENET_TRAIN_IMG'])
+
+    predictions = recognizer.model.predict_proba(embeddings)
+    rows = np.arange(labels.shape[0])
+    in_model = labels < predictions.shape[1]
+    rows, labels = rows[in_model], labels[in_model]
+    genuine = np.sort(predictions[rows, labels])
+    others = predictions[rows].copy()
+    others[np.arange(rows.shape[0]), labels] = -1.0
+    impostor = np.sort(others.max(axis=1))
+    threshold, achieved_far, frr = probability_at_far(genuine, impostor, far)
+    distances = pair_distances(embeddings, labels)
+    return {
+        'min_probability': threshold,
+        'targets': {'min_probability': far},
+        'report': {'probability': {'far': achieved_far, 'frr': frr,
+                                   'nrof_genuine': int(genuine.size), 'nrof_impostor': int(impostor.size)},
+                   'distance': report(*distances)},
+    }
+
+
+def _calibration_dir():
+    return os.path.join(app.instance_path, 'calibration')
+
+
+def calibration_file():
+    return app.config.get('CALIBRATION_FILE') or os.path.join(app.instance_path, 'calibration.json')
+
+
+class Thresholds:
+    """Umbrales calibrados, releidos cuando cambia CALIBRATION_FILE."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._values = {}
+
+    def _defaults(self):
+        values = dict(app.config.get('RECOGNITION_TOLERANCE', {'detect': 0.45, 'mark': 0.6}))
+        values['min_probability'] = app.config.get('FACENET_MIN_PROBABILITY', 0.43)
+        return values
+
+    def get(self, name):
+        """Umbral name ('detect', 'mark' o 'min_probability')."""
+        path = calibration_file()
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        with self._lock:
+            if mtime != self._mtime or not self._values:
+                values = self._defaults()
+                if mtime is not None:
+                    try:
+                        with open(path) as f:
+                            calibrated = json.load(f)
+                    except (OSError, ValueError) as e:
+                        # Fichero a medio escribir o corrupto: se mantienen los
+                        # ultimos umbrales hasta que vuelva a cambiar
+                        app.logger.warning('No se pudo leer %s: %s', path, e)
+                        calibrated = None
+                    if calibrated is None:
+                        values = self._values or values
+                    else:
+                        # Una calibracion de otro modelo de embeddings no sirve
+                        if calibrated.get('model_version') in (None, app.config['EMBEDDING_MODEL_VERSION']):
+                            values.update({k: calibrated[k] for k in ('detect', 'mark') if k in calibrated})
+                        if 'min_probability' in calibrated:
+                            values['min_probability'] = calibrated['min_probability']
+                self._values, self._mtime = values, mtime
+            return self._values[name]
+
+
+thresholds = Thresholds()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m attendance.calibration')
+    parser.add_argument('--detect_far', type=float, default=1e-4,
+                        help='FAR objetivo de /detect (marca sin confirmacion)')
+    parser.add_argument('--mark_far', type=float, default=1e-3,
+                        help='FAR objetivo de /attendance_mark')
+    parser.add_argument('--facenet', action='store_true',
+                        help='Calibra tambien la probabilidad minima del clasificador FaceNet')
+    parser.add_argument('--facenet_far', type=float, default=1e-3,
+                        help='FAR objetivo del clasificador FaceNet')
+    parser.add_argument('--output', type=str, help='Por defecto CALIBRATION_FILE')
+    args = parser.parse_args(argv)
+
+    output = args.output or calibration_file()
+    with app.app_context():
+        result = {}
+        if os.path.exists(output):
+            with open(output) as f:
+                result = json.load(f)
+        targets = result.setdefault('targets', {})
+        reports = result.setdefault('report', {})
+
+        gallery = calibrate_gallery(detect_far=args.detect_far, mark_far=args.mark_far)
+        result.update({k: gallery[k] for k in ('model_version', 'detect', 'mark')})
+        targets.update(gallery['targets'])
+        reports['gallery'] = gallery['report']
+        print('%s: %d pares genuinos, %d impostores' % (gallery['model_version'],
+              gallery['report']['nrof_genuine'], gallery['report']['nrof_impostor']))
+        for row in gallery['report']['far'] + gallery['report']['frr']:
+            print('  umbral %.4f  FAR %.2e  FRR %.4f' % (row['threshold'], row['far'], row['frr']))
+        print('detect: %.4f  mark: %.4f' % (gallery['detect'], gallery['mark']))
+
+        if args.facenet:
+            facenet = calibrate_facenet(args.facenet_far)
+            result['min_probability'] = facenet['min_probability']
+            targets.update(facenet['targets'])
+            reports['facenet'] = facenet['report']
+            print('min_probability: %.4f' % facenet['min_probability'])
+
+        result['created'] = datetime.datetime.now().isoformat(timespec='seconds')
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        # Se escribe en un temporal y se renombra: thresholds.get() nunca lee
+        # un fichero a medias
+        tmp = output + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(result, f, indent=2)
+        os.replace(tmp, output)
+        print('Umbrales guardados en %s' % output)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -34,6 +34,7 @@ import numpy as np
 import facenet.src.facenet as facenet
 import facenet.src.align as align
 import facenet.src.align.detect_face as detect_face
+import facenet.src.align.landmarks as landmarks
 import random
 from time import sleep
 
@@ -45,7 +46,7 @@ def main(args):
     # Store some git revision info in a text file in the log directory
     src_path,_ = os.path.split(os.path.realpath(__file__))
     facenet.store_revision_info(src_path, output_dir, ' '.join(sys.argv))
-    dataset = facenet.get_dataset(args.input_dir)
+    dataset = facenet.get_dataset(args.input_dir, manifest_file=args.manifest_file)
 
     print('Creating networks and loading parameters')
 
@@ -94,25 +95,24 @@ def main(args):
                             img = facenet.to_rgb(img)
                         img = img[:,:,0:3]
 
-                        bounding_boxes, _ = align.detect_face.detect_face(img, minsize, pnet, rnet, onet, threshold, factor)
+                        bounding_boxes, points = align.detect_face.detect_face(img, minsize, pnet, rnet, onet, threshold, factor)
                         nrof_faces = bounding_boxes.shape[0]
                         if nrof_faces>0:
                             det = bounding_boxes[:,0:4]
-                            det_arr = []
                             img_size = np.asarray(img.shape)[0:2]
-                            if nrof_faces>1:
-                                if args.detect_multiple_faces:
-                                    for i in range(nrof_faces):
-                                        det_arr.append(np.squeeze(det[i]))
-                                else:
-                                    bounding_box_size = (det[:,2]-det[:,0])*(det[:,3]-det[:,1])
-                                    img_center = img_size / 2
-                                    offsets = np.vstack([ (det[:,0]+det[:,2])/2-img_center[1], (det[:,1]+det[:,3])/2-img_center[0] ])
-                                    offset_dist_squared = np.sum(np.power(offsets,2.0),0)
-                                    index = np.argmax(bounding_box_size-offset_dist_squared*2.0) # some extra weight on the centering
-                                    det_arr.append(det[index,:])
+                            if nrof_faces>1 and not args.detect_multiple_faces:
+                                bounding_box_size = (det[:,2]-det[:,0])*(det[:,3]-det[:,1])
+                                img_center = img_size / 2
+                                offsets = np.vstack([ (det[:,0]+det[:,2])/2-img_center[1], (det[:,1]+det[:,3])/2-img_center[0] ])
+                                offset_dist_squared = np.sum(np.power(offsets,2.0),0)
+                                index = np.argmax(bounding_box_size-offset_dist_squared*2.0) # some extra weight on the centering
+                                face_indices = [index]
                             else:
-                                det_arr.append(np.squeeze(det))
+                                face_indices = list(range(nrof_faces))
+                            det_arr = [det[index,:] for index in face_indices]
+                            if args.align_landmarks:
+                                # Similarity transform from the five landmarks, all faces in one call
+                                aligned = landmarks.align_faces(img, points[:, face_indices], args.image_size, args.margin)
 
                             for i, det in enumerate(det_arr):
                                 det = np.squeeze(det)
@@ -121,8 +121,11 @@ def main(args):
                                 bb[1] = np.maximum(det[1]-args.margin/2, 0)
                                 bb[2] = np.minimum(det[2]+args.margin/2, img_size[1])
                                 bb[3] = np.minimum(det[3]+args.margin/2, img_size[0])
-                                cropped = img[bb[1]:bb[3],bb[0]:bb[2],:]
-                                scaled = misc.imresize(cropped, (args.image_size, args.image_size), interp='bilinear')
+                                if args.align_landmarks:
+                                    scaled = aligned[i]
+                                else:
+                                    cropped = img[bb[1]:bb[3],bb[0]:bb[2],:]
+                                    scaled = misc.imresize(cropped, (args.image_size, args.image_size), interp='bilinear')
                                 nrof_successfully_aligned += 1
                                 filename_base, file_extension = os.path.splitext(output_filename)
                                 if args.detect_multiple_faces:
@@ -144,16 +147,22 @@ def parse_arguments(argv):
 
     parser.add_argument('input_dir', type=str, help='Directory with unaligned images.')
     parser.add_argument('output_dir', type=str, help='Directory with aligned face thumbnails.')
+    parser.add_argument('--manifest_file', type=str,
+        help='Keep the dataset listing in this manifest and only list the class directories that changed '
+        '(see dataset_manifest.py; images rewritten in place need dataset_manifest.py --rescan).', default=None)
     parser.add_argument('--image_size', type=int,
         help='Image size (height, width) in pixels.', default=182)
     parser.add_argument('--margin', type=int,
-        help='Margin for the crop around the bounding box (height, width) in pixels.', default=44)
+        help='Margin for the crop around the bounding box (or the aligned face with --align_landmarks) in pixels.', default=44)
     parser.add_argument('--random_order',
         help='Shuffles the order of images to enable alignment using multiple processes.', action='store_true')
     parser.add_argument('--gpu_memory_fraction', type=float,
         help='Upper bound on the amount of GPU memory that will be used by the process.', default=1.0)
     parser.add_argument('--detect_multiple_faces', type=bool,
                         help='Detect and align multiple faces per image.', default=False)
+    parser.add_argument('--align_landmarks',
+        help='Align the face with its five landmarks instead of cropping the bounding box. '
+        'The shipped classifier was trained on crops; retrain it on the aligned dataset.', action='store_true')
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
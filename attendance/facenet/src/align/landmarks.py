@@ -0,0 +1,148 @@
+"""Face alignment from the five MTCNN landmarks.
+
+detect_face() returns, besides the bounding boxes, a (10, n) array with the
+five ONet landmarks of every face (rows 0-4 are x, rows 5-9 are y; left eye,
+right eye, nose, left and right mouth corner). Instead of cropping the box
+and resizing it, estimate_similarity() fits a similarity transform (rotation,
+uniform scale and translation) from each face's landmarks to a reference
+template, and warp_faces() samples every output pixel straight from the
+source frame (with cv2.warpAffine into the output size when OpenCV is
+available, otherwise for all faces in one vectorized NumPy pass). No
+full-frame rotation and no intermediate crop are needed.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+# Reference positions of the five landmarks in a 112x112 face crop (the
+# template used by ArcFace/InsightFace).
+REFERENCE_LANDMARKS_112 = np.array([
+    [38.2946, 51.6963],
+    [73.5318, 51.5014],
+    [56.0252, 71.7366],
+    [41.5493, 92.3655],
+    [70.7299, 92.2041]], dtype=np.float32)
+
+
+def reference_landmarks(image_size=160, margin=0):
+    """Template scaled to an image_size output with margin pixels of context in total."""
+    return REFERENCE_LANDMARKS_112 / 112.0 * (image_size - margin) + margin / 2.0
+
+
+def points_to_landmarks(points):
+    """Converts the (10, n) points of detect_face() to an (n, 5, 2) array of (x, y)."""
+    points = np.asarray(points, dtype=np.float32)
+    if points.size == 0:
+        return np.zeros((0, 5, 2), np.float32)
+    return np.stack([points[0:5, :].T, points[5:10, :].T], axis=2)
+
+
+def estimate_similarity(src, dst):
+    """Least-squares similarity transforms mapping src landmarks onto dst.
+
+    Args:
+        src: (n, k, 2) landmarks of n faces
+        dst: (k, 2) reference landmarks
+
+    Returns:
+        (n, 2, 3) affine matrices [[a, -b, tx], [b, a, ty]]
+    """
+    src = np.asarray(src, dtype=np.float64)
+    dst = np.asarray(dst, dtype=np.float64)
+    src_mean = src.mean(axis=1, keepdims=True)
+    dst_mean = dst.mean(axis=0)
+    s = src - src_mean
+    d = dst - dst_mean
+    # Closed form of the 2D Umeyama solution (no reflection)
+    norm = np.maximum(np.sum(s ** 2, axis=(1, 2)), 1e-12)
+    a = np.sum(s[:, :, 0] * d[:, 0] + s[:, :, 1] * d[:, 1], axis=1) / norm
+    b = np.sum(s[:, :, 0] * d[:, 1] - s[:, :, 1] * d[:, 0], axis=1) / norm
+    tx = dst_mean[0] - (a * src_mean[:, 0, 0] - b * src_mean[:, 0, 1])
+    ty = dst_mean[1] - (b * src_mean[:, 0, 0] + a * src_mean[:, 0, 1])
+    return np.stack([np.stack([a, -b, tx], axis=1), np.stack([b, a, ty], axis=1)], axis=1)
+
+
+def invert_similarity(matrices):
+    """Inverse of (n, 2, 3) similarity matrices (output -> source coordinates)."""
+    a, b = matrices[:, 0, 0], matrices[:, 1, 0]
+    tx, ty = matrices[:, 0, 2], matrices[:, 1, 2]
+    det = np.maximum(a * a + b * b, 1e-12)
+    ia, ib = a / det, -b / det
+    itx = -(ia * tx - ib * ty)
+    ity = -(ib * tx + ia * ty)
+    return np.stack([np.stack([ia, -ib, itx], axis=1), np.stack([ib, ia, ity], axis=1)], axis=1)
+
+
+def warp_faces(img, landmarks, image_size=160, margin=0):
+    """Aligned image_size x image_size crops of all faces in img.
+
+    Args:
+        img: (h, w, c) or (h, w) source frame
+        landmarks: (n, 5, 2) landmarks (see points_to_landmarks)
+        image_size: Output size in pixels
+        margin: Context around the reference face, in output pixels
+
+    Returns:
+        (n, image_size, image_size, c) array with the dtype of img. Pixels
+        that fall outside the frame are zero.
+    """
+    landmarks = np.asarray(landmarks, dtype=np.float32)
+    matrices = estimate_similarity(landmarks, reference_landmarks(image_size, margin))
+    try:
+        import cv2
+    except ImportError:
+        return _warp_numpy(img, matrices, image_size)
+    # One small warp per face straight into the output size; cv2 is several
+    # times faster than the gather in _warp_numpy
+    out = np.zeros((landmarks.shape[0], image_size, image_size) + img.shape[2:], dtype=img.dtype)
+    for i in range(landmarks.shape[0]):
+        out[i] = cv2.warpAffine(img, matrices[i], (image_size, image_size), flags=cv2.INTER_LINEAR,
+                                borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    return out
+
+
+def _warp_numpy(img, matrices, image_size):
+    """Bilinear warp of all faces at once with NumPy gathers."""
+    squeeze = img.ndim == 2
+    if squeeze:
+        img = img[:, :, np.newaxis]
+    nrof_faces = matrices.shape[0]
+    height, width, channels = img.shape
+    out = np.zeros((nrof_faces, image_size, image_size, channels), dtype=img.dtype)
+    if nrof_faces == 0:
+        return out[..., 0] if squeeze else out
+
+    inverse = invert_similarity(matrices)
+    grid_y, grid_x = np.mgrid[0:image_size, 0:image_size].astype(np.float64)
+    # Source coordinates of every output pixel of every face: (n, size, size)
+    src_x = (inverse[:, 0, 0, None, None] * grid_x + inverse[:, 0, 1, None, None] * grid_y
+             + inverse[:, 0, 2, None, None])
+    src_y = (inverse[:, 1, 0, None, None] * grid_x + inverse[:, 1, 1, None, None] * grid_y
+             + inverse[:, 1, 2, None, None])
+
+    x0 = np.floor(src_x).astype(np.int64)
+    y0 = np.floor(src_y).astype(np.int64)
+    fx = (src_x - x0)[..., None]
+    fy = (src_y - y0)[..., None]
+    inside = (x0 >= 0) & (y0 >= 0) & (x0 < width - 1) & (y0 < height - 1)
+    x0 = np.clip(x0, 0, width - 2)
+    y0 = np.clip(y0, 0, height - 2)
+
+    def gather(y, x):
+        return img[y, x].astype(np.float32)
+
+    top = gather(y0, x0) * (1.0 - fx) + gather(y0, x0 + 1) * fx
+    bottom = gather(y0 + 1, x0) * (1.0 - fx) + gather(y0 + 1, x0 + 1) * fx
+    warped = top * (1.0 - fy) + bottom * fy
+    warped[~inside] = 0
+    if np.issubdtype(img.dtype, np.integer):
+        warped = np.clip(np.rint(warped), np.iinfo(img.dtype).min, np.iinfo(img.dtype).max)
+    out[:] = warped.astype(img.dtype)
+    return out[..., 0] if squeeze else out
+
+
+def align_faces(img, points, image_size=160, margin=0):
+    """warp_faces() for the points returned by detect_face()."""
+    return warp_faces(img, points_to_landmarks(points), image_size, margin)
@@ -30,81 +30,95 @@ import tensorflow as tf
 import numpy as np
 import argparse
 import facenet
+import shards
 import os
 import sys
 import time
 import h5py
 import math
-from tensorflow.python.platform import gfile
+import threading
+from class_statistics import ClassStatistics
+from tensorflow.python.ops import data_flow_ops
 from six import iteritems
 
 def main(args):
-    dataset = facenet.get_dataset(args.dataset_dir)
+    dataset = facenet.get_dataset(args.dataset_dir, manifest_file=args.manifest_file)
   
     with tf.Graph().as_default():
       
-        # Get a list of image paths and their labels
+        # Get a list of image paths and their labels. The images are enqueued
+        # sorted by class, so a class is complete soon after its first batch
+        # and ClassStatistics only holds the embeddings of a few classes
         image_list, label_list = facenet.get_image_paths_and_labels(dataset)
         nrof_images = len(image_list)
-        image_indices = range(nrof_images)
+        class_names = [cls.name for cls in dataset]
 
-        image_batch, label_batch = facenet.read_and_augment_data(image_list,
-            image_indices, args.image_size, args.batch_size, None, 
-            False, False, False, nrof_preprocess_threads=4, shuffle=False)
-        
-        model_exp = os.path.expanduser(args.model_file)
-        with gfile.FastGFile(model_exp,'rb') as f:
-            graph_def = tf.GraphDef()
-            graph_def.ParseFromString(f.read())
-            input_map={'input':image_batch, 'phase_train':False}
-            tf.import_graph_def(graph_def, input_map=input_map, name='net')
-        
-        embeddings = tf.get_default_graph().get_tensor_by_name("net/embeddings:0")
+        image_paths_placeholder = tf.placeholder(tf.string, shape=(None,1), name='image_paths')
+        labels_placeholder = tf.placeholder(tf.int32, shape=(None,1), name='labels')
+        batch_size_placeholder = tf.placeholder(tf.int32, name='batch_size')
+        control_placeholder = tf.placeholder(tf.int32, shape=(None,1), name='control')
+        phase_train_placeholder = tf.placeholder(tf.bool, name='phase_train')
+
+        nrof_preprocess_threads = 4
+        image_size = (args.image_size, args.image_size)
+        input_queue = data_flow_ops.FIFOQueue(capacity=max(nrof_images, 1),
+                                    dtypes=[tf.string, tf.int32, tf.int32],
+                                    shapes=[(1,), (1,), (1,)],
+                                    shared_name=None, name=None)
+        enqueue_op = input_queue.enqueue_many([image_paths_placeholder, labels_placeholder, control_placeholder], name='enqueue_op')
+        image_batch, label_batch = facenet.create_input_pipeline(input_queue, image_size, nrof_preprocess_threads,
+            batch_size_placeholder, shards.is_shard_dir(args.dataset_dir))
 
         with tf.Session() as sess:
-            tf.train.start_queue_runners(sess=sess)
-                
+            input_map = {'image_batch': image_batch, 'label_batch': label_batch, 'phase_train': phase_train_placeholder}
+            facenet.load_model(args.model_file, input_map=input_map)
+            embeddings = tf.get_default_graph().get_tensor_by_name("embeddings:0")
+
+            coord = tf.train.Coordinator()
+            tf.train.start_queue_runners(coord=coord, sess=sess)
+
+            # The label of every queue entry is its image index
+            labels_array = np.expand_dims(np.arange(nrof_images), 1)
+            control_array = np.zeros_like(labels_array, np.int32)
+            if args.use_fixed_image_standardization:
+                control_array += facenet.FIXED_STANDARDIZATION
+            sess.run(enqueue_op, {image_paths_placeholder: np.expand_dims(np.array(image_list), 1),
+                labels_placeholder: labels_array, control_placeholder: control_array})
+
             embedding_size = int(embeddings.get_shape()[1])
+            stats = ClassStatistics(label_list, embedding_size)
             nrof_batches = int(math.ceil(nrof_images / args.batch_size))
-            nrof_classes = len(dataset)
-            label_array = np.array(label_list)
-            class_names = [cls.name for cls in dataset]
-            nrof_examples_per_class = [ len(cls.image_paths) for cls in dataset ]
-            class_variance = np.zeros((nrof_classes,))
-            class_center = np.zeros((nrof_classes,embedding_size))
-            distance_to_center = np.ones((len(label_list),))*np.NaN
-            emb_array = np.zeros((0,embedding_size))
-            idx_array = np.zeros((0,), dtype=np.int32)
-            lab_array = np.zeros((0,), dtype=np.int32)
-            index_arr = np.append(0, np.cumsum(nrof_examples_per_class))
-            for i in range(nrof_batches):
-                t = time.time()
-                emb, idx = sess.run([embeddings, label_batch])
-                emb_array = np.append(emb_array, emb, axis=0)
-                idx_array = np.append(idx_array, idx, axis=0)
-                lab_array = np.append(lab_array, label_array[idx], axis=0)
-                for cls in set(lab_array):
-                    cls_idx = np.where(lab_array==cls)[0]
-                    if cls_idx.shape[0]==nrof_examples_per_class[cls]:
-                        # We have calculated all the embeddings for this class
-                        i2 = np.argsort(idx_array[cls_idx])
-                        emb_class = emb_array[cls_idx,:]
-                        emb_sort = emb_class[i2,:]
-                        center = np.mean(emb_sort, axis=0)
-                        diffs = emb_sort - center
-                        dists_sqr = np.sum(np.square(diffs), axis=1)
-                        class_variance[cls] = np.mean(dists_sqr)
-                        class_center[cls,:] = center
-                        distance_to_center[index_arr[cls]:index_arr[cls+1]] = np.sqrt(dists_sqr)
-                        emb_array = np.delete(emb_array, cls_idx, axis=0)
-                        idx_array = np.delete(idx_array, cls_idx, axis=0)
-                        lab_array = np.delete(lab_array, cls_idx, axis=0)
+            batch_counter = iter(range(nrof_batches))
+            counter_lock = threading.Lock()
+
+            def worker():
+                # Session.run is thread safe: the workers run the model
+                # concurrently and each dequeues its own batches
+                while True:
+                    with counter_lock:
+                        i = next(batch_counter, None)
+                    if i is None:
+                        return
+                    t = time.time()
+                    batch_size = min(args.batch_size, nrof_images - i*args.batch_size)
+                    emb, idx = sess.run([embeddings, label_batch],
+                        feed_dict={phase_train_placeholder: False, batch_size_placeholder: batch_size})
+                    stats.update(emb, idx)
+                    print('Batch %d in %.3f seconds' % (i, time.time()-t))
+
+            workers = [threading.Thread(target=worker) for _ in range(args.nrof_workers)]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            assert stats.is_complete(), 'Embeddings are missing for some images'
 
-                        
-                print('Batch %d in %.3f seconds' % (i, time.time()-t))
-                
             print('Writing filtering data to %s' % args.data_file_name)
-            mdict = {'class_names':class_names, 'image_list':image_list, 'label_list':label_list, 'distance_to_center':distance_to_center }
+            string_dtype = h5py.special_dtype(vlen=str)
+            mdict = {'class_names':np.array(class_names, dtype=string_dtype),
+                     'image_list':np.array(image_list, dtype=string_dtype), 'label_list':label_list,
+                     'distance_to_center':stats.distance_to_center, 'class_center':stats.class_center,
+                     'class_variance':stats.class_variance }
             with h5py.File(args.data_file_name, 'w') as f:
                 for key, value in iteritems(mdict):
                     f.create_dataset(key, data=value)
@@ -114,14 +128,21 @@ def parse_arguments(argv):
     
     parser.add_argument('dataset_dir', type=str,
         help='Path to the directory containing aligned dataset.')
+    parser.add_argument('--manifest_file', type=str,
+        help='Keep the dataset listing in this manifest and only list the class directories that changed '
+        '(see dataset_manifest.py; images rewritten in place need dataset_manifest.py --rescan).', default=None)
     parser.add_argument('model_file', type=str,
-        help='File containing the frozen model in protobuf (.pb) format to use for feature extraction.')
+        help='Could be either a directory containing the meta_file and ckpt_file or a model protobuf (.pb) file')
     parser.add_argument('data_file_name', type=str,
         help='The name of the file to store filtering data in.')
     parser.add_argument('--image_size', type=int,
         help='Image size.', default=160)
     parser.add_argument('--batch_size', type=int,
         help='Number of images to process in a batch.', default=90)
+    parser.add_argument('--nrof_workers', type=int,
+        help='Number of threads running the model concurrently.', default=2)
+    parser.add_argument('--use_fixed_image_standardization',
+        help='Performs fixed standardization of images.', action='store_true')
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
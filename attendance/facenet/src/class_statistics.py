@@ -0,0 +1,95 @@
+"""Streaming per-class embedding statistics for calculate_filtering_metrics.py.
+
+Embeddings arrive in batches, in any order, tagged with their image index.
+ClassStatistics keeps the count, center and sum of squared distances to the
+center of every class in preallocated arrays and merges each batch into them
+with the parallel form of Welford's algorithm (Chan et al.), vectorized over
+the classes of the batch. The distance of an image to its class center needs
+the final center, so the embeddings of a class are held only until its last
+image arrives; with the images sorted by class that is a few classes per
+worker, whatever the size of the dataset.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+
+import numpy as np
+
+
+class ClassStatistics(object):
+    """Center, variance and distance to center of every class of a dataset."""
+
+    def __init__(self, labels, embedding_size):
+        """
+        Args:
+            labels: (nrof_images,) class of every image index
+            embedding_size: Size of the embeddings
+        """
+        self.labels = np.asarray(labels, dtype=np.int64)
+        nrof_classes = int(self.labels.max()) + 1 if self.labels.size else 0
+        self.nrof_examples_per_class = np.bincount(self.labels, minlength=nrof_classes)
+        self.count = np.zeros((nrof_classes,), dtype=np.int64)
+        self.class_center = np.zeros((nrof_classes, embedding_size))
+        self.sum_sqr = np.zeros((nrof_classes,))
+        self.distance_to_center = np.full((self.labels.shape[0],), np.nan)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @property
+    def class_variance(self):
+        """Mean squared distance to the center of every class."""
+        return self.sum_sqr / np.maximum(self.count, 1)
+
+    @property
+    def nrof_pending(self):
+        """Number of embeddings held for classes that are not complete yet."""
+        return sum(idx.shape[0] for chunks in self._pending.values() for idx, _ in chunks)
+
+    def update(self, embeddings, indices):
+        """Adds a batch of embeddings of the images indices. Safe to call from several threads."""
+        embeddings = np.asarray(embeddings, dtype=np.float64)
+        indices = np.asarray(indices, dtype=np.int64).ravel()
+        if indices.shape[0] == 0:
+            return
+        labels = self.labels[indices]
+
+        # Rows of the batch grouped by class (already sorted when the images
+        # are enqueued by class), then the mean and sum of squared deviations
+        # of every group
+        order = np.argsort(labels, kind='stable')
+        indices, embeddings, labels = indices[order], embeddings[order], labels[order]
+        starts = np.flatnonzero(np.concatenate([[True], labels[1:] != labels[:-1]]))
+        classes = labels[starts]
+        batch_count = np.diff(np.append(starts, labels.shape[0]))
+        batch_mean = np.add.reduceat(embeddings, starts, axis=0) / batch_count[:, None]
+        sqr = np.sum(np.square(embeddings - np.repeat(batch_mean, batch_count, axis=0)), axis=1)
+        batch_sum_sqr = np.add.reduceat(sqr, starts)
+
+        with self._lock:
+            # Chan et al. merge of (count, center, sum_sqr) with the batch statistics
+            count = self.count[classes]
+            total = count + batch_count
+            delta = batch_mean - self.class_center[classes]
+            self.class_center[classes] += delta * (batch_count / total)[:, None]
+            self.sum_sqr[classes] += batch_sum_sqr + np.sum(np.square(delta), axis=1) * count * batch_count / total
+            self.count[classes] = total
+
+            complete = total == self.nrof_examples_per_class[classes]
+            bounds = np.append(starts, labels.shape[0])
+            for i, cls in enumerate(classes):
+                rows = slice(bounds[i], bounds[i + 1])
+                chunk = (indices[rows], embeddings[rows])
+                if not complete[i]:
+                    self._pending.setdefault(cls, []).append(chunk)
+                    continue
+                # Last images of the class: the center is final
+                chunks = self._pending.pop(cls, []) + [chunk]
+                cls_indices = np.concatenate([idx for idx, _ in chunks])
+                cls_embeddings = np.concatenate([emb for _, emb in chunks])
+                self.distance_to_center[cls_indices] = np.sqrt(
+                    np.sum(np.square(cls_embeddings - self.class_center[cls]), axis=1))
+
+    def is_complete(self):
+        return not self._pending and bool(np.all(self.count == self.nrof_examples_per_class))
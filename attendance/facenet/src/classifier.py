@@ -45,14 +45,14 @@ def main(args):
             np.random.seed(seed=args.seed)
             
             if args.use_split_dataset:
-                dataset_tmp = facenet.get_dataset(args.data_dir)
+                dataset_tmp = facenet.get_dataset(args.data_dir, manifest_file=args.manifest_file)
                 train_set, test_set = split_dataset(dataset_tmp, args.min_nrof_images_per_class, args.nrof_train_images_per_class)
                 if (args.mode=='TRAIN'):
                     dataset = train_set
                 elif (args.mode=='CLASSIFY'):
                     dataset = test_set
             else:
-                dataset = facenet.get_dataset(args.data_dir)
+                dataset = facenet.get_dataset(args.data_dir, manifest_file=args.manifest_file)
 
             # Check that there are at least one training image per class
             for cls in dataset:
@@ -143,6 +143,9 @@ def parse_arguments(argv):
         'model should be used for classification', default='CLASSIFY')
     parser.add_argument('data_dir', type=str,
         help='Path to the data directory containing aligned LFW face patches.')
+    parser.add_argument('--manifest_file', type=str,
+        help='Keep the dataset listing in this manifest and only list the class directories that changed '
+        '(see dataset_manifest.py; images rewritten in place need dataset_manifest.py --rescan).', default=None)
     parser.add_argument('model', type=str, 
         help='Could be either a directory containing the meta_file and ckpt_file or a model protobuf (.pb) file')
     parser.add_argument('classifier_filename', 
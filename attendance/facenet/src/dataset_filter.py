@@ -0,0 +1,143 @@
+"""Outlier filtering of a training dataset for train_softmax.py.
+
+calculate_filtering_metrics.py stores the distance of every image to its
+class center. filter_dataset drops the images at or above a percentile of
+those distances, and the classes they leave with too few images, working on
+arrays: the dataset is flattened into a path array and a label array, every
+image of the metrics file is located in it with one searchsorted over the
+sorted paths, and a boolean keep mask gives the filtered classes in one pass.
+
+The result is cached in an .npz next to the metrics file, keyed by the
+metrics file (path, size and mtime), the percentile, the minimum number of
+images per class and the class names and number of images of the dataset,
+so later runs skip reading the metrics file altogether.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import zlib
+
+import h5py
+import numpy as np
+
+
+def find_threshold(var, percentile):
+    hist, bin_edges = np.histogram(var, 100)
+    cdf = np.float32(np.cumsum(hist)) / np.sum(hist)
+    bin_centers = (bin_edges[:-1]+bin_edges[1:])/2
+    #plt.plot(bin_centers, cdf)
+    threshold = np.interp(percentile*0.01, cdf, bin_centers)
+    return threshold
+
+
+def _as_str(values):
+    # h5py 3 returns variable length strings as bytes objects
+    values = np.asarray(values)
+    if values.dtype.kind == 'O':
+        values = values.astype(bytes if values.size and isinstance(values.flat[0], bytes) else str)
+    if values.dtype.kind == 'S':
+        values = np.char.decode(values, 'utf-8')
+    return values
+
+
+def read_metrics(data_filename):
+    """(distance_to_center, label_list, image_list) of a calculate_filtering_metrics file."""
+    with h5py.File(data_filename, 'r') as f:
+        distance_to_center = np.array(f.get('distance_to_center'))
+        label_list = np.array(f.get('label_list'), dtype=np.int64)
+        image_list = _as_str(f['image_list'][()])
+    return distance_to_center, label_list, image_list
+
+
+def keep_mask(paths, labels, nrof_classes, distance_to_center, label_list, image_list, percentile, min_nrof_images_per_class):
+    """Boolean masks of the images and classes that survive the filtering.
+
+    Args:
+        paths, labels: (n,) image paths of the dataset and the class of each
+        nrof_classes: Number of classes of the dataset
+        distance_to_center, label_list, image_list: Contents of the metrics file
+        percentile: Images at or above this percentile of distance_to_center are dropped
+        min_nrof_images_per_class: Classes that lose images and are left with
+            fewer than this are dropped
+
+    Returns:
+        (keep_image (n,), keep_class (nrof_classes,))
+    """
+    threshold = find_threshold(distance_to_center, percentile)
+    # NaN distances (images without an embedding) are never outliers
+    with np.errstate(invalid='ignore'):
+        outliers = np.flatnonzero(distance_to_center >= threshold)
+    outlier_labels = label_list[outliers]
+    outliers = outliers[outlier_labels < nrof_classes]
+    outlier_labels = label_list[outliers]
+
+    # Locate the outliers in the dataset; an image is removed only from the
+    # class the metrics file assigns it to
+    order = np.argsort(paths, kind='stable')
+    sorted_paths = paths[order]
+    pos = np.minimum(np.searchsorted(sorted_paths, image_list[outliers]), max(len(paths) - 1, 0))
+    found = (sorted_paths[pos] == image_list[outliers]) if len(paths) else np.zeros(outliers.shape, bool)
+    found &= labels[order[pos]] == outlier_labels
+
+    keep_image = np.ones(len(paths), dtype=bool)
+    keep_image[order[pos[found]]] = False
+    counts = np.bincount(labels[keep_image], minlength=nrof_classes)
+    touched = np.zeros(nrof_classes, dtype=bool)
+    touched[outlier_labels] = True
+    keep_class = ~(touched & (counts < min_nrof_images_per_class))
+    keep_image &= keep_class[labels]
+    return keep_image, keep_class
+
+
+def _cache_key(data_filename, percentile, min_nrof_images_per_class, class_names, nrof_images):
+    st = os.stat(data_filename)
+    classes_crc = zlib.crc32('\n'.join(class_names).encode('utf-8')) & 0xffffffff
+    return json.dumps([os.path.abspath(data_filename), st.st_size, st.st_mtime, float(percentile),
+                       int(min_nrof_images_per_class), nrof_images, classes_crc])
+
+
+def cache_filename(data_filename, percentile, min_nrof_images_per_class):
+    return '%s_filtered_%g_%d.npz' % (os.path.splitext(data_filename)[0], percentile, min_nrof_images_per_class)
+
+
+def filter_dataset(dataset, data_filename, percentile, min_nrof_images_per_class, image_class, use_cache=True):
+    """Dataset without the outliers of data_filename, as a new list of image_class(name, paths)."""
+    class_names = [cls.name for cls in dataset]
+    sizes = [len(cls.image_paths) for cls in dataset]
+    paths = np.array([path for cls in dataset for path in cls.image_paths])
+    labels = np.repeat(np.arange(len(dataset)), sizes)
+    key = _cache_key(data_filename, percentile, min_nrof_images_per_class, class_names, len(paths))
+    cache_path = cache_filename(data_filename, percentile, min_nrof_images_per_class)
+
+    keep_image = keep_class = None
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as data:
+                if str(data['key']) == key:
+                    keep_image, keep_class = data['keep_image'], data['keep_class']
+        except Exception as e:
+            # A cache torn by an interrupted run is just recomputed
+            print('Ignoring the filtered dataset cache %s: %s' % (cache_path, e))
+    if keep_image is None:
+        distance_to_center, label_list, image_list = read_metrics(data_filename)
+        keep_image, keep_class = keep_mask(paths, labels, len(dataset), distance_to_center, label_list, image_list,
+                                           percentile, min_nrof_images_per_class)
+        if use_cache:
+            try:
+                # Written to a temporary file and renamed: readers never see half a cache
+                tmp = cache_path + '.tmp'
+                with open(tmp, 'wb') as f:
+                    np.savez(f, key=np.array(key), keep_image=keep_image, keep_class=keep_class)
+                os.replace(tmp, cache_path)
+            except (IOError, OSError) as e:
+                print('Unable to write the filtered dataset cache %s: %s' % (cache_path, e))
+
+    # The images of a class are contiguous: split the kept paths by class
+    kept_counts = np.bincount(labels[keep_image], minlength=len(dataset))
+    bounds = np.concatenate([[0], np.cumsum(kept_counts)])
+    kept_paths = paths[keep_image].tolist()
+    return [image_class(class_names[i], kept_paths[bounds[i]:bounds[i + 1]])
+            for i in np.flatnonzero(keep_class)]
@@ -0,0 +1,238 @@
+"""Cached manifest of a dataset directory (one subdirectory per class).
+
+facenet.get_dataset used to os.listdir the dataset and every class directory
+on every run. The manifest stores the class names and, for every image, its
+file name, size, mtime and optionally a SHA-1 of its content, in one .npz
+(by default .dataset_manifest.npz inside the dataset directory).
+
+Updating it is incremental: the dataset directory is scanned once with
+os.scandir and only the class directories whose mtime changed (files added,
+removed or renamed) are listed again; the entries of unchanged files keep
+their hash. Files rewritten in place do not change the mtime of their
+directory; rescan=True (--rescan) lists every class directory again and
+still reuses the hashes of the files whose size and mtime did not change.
+A manifest file can also be passed instead of the directory, in which case
+it is loaded as is, without touching the dataset.
+
+Because of that the manifest can be stale: images rewritten in place are
+only noticed with --rescan, and a manifest file passed instead of the
+directory ignores every later change. facenet.get_dataset therefore only
+uses a manifest when asked to (manifest_file, --manifest_file in the
+training scripts) and otherwise lists the directory without writing to it.
+
+Usage:
+    python dataset_manifest.py ~/datasets/casia/casia_maxpy_mtcnnalign_182_160 --hashes
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import hashlib
+import os
+import sys
+
+import numpy as np
+
+MANIFEST_FILE = '.dataset_manifest.npz'
+MANIFEST_VERSION = 1
+
+
+def is_manifest_file(path):
+    path = os.path.expanduser(path)
+    return path.endswith('.npz') and os.path.isfile(path)
+
+
+def file_hash(path, block_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.digest()
+
+
+class DatasetManifest(object):
+    """Class names and image files of a dataset, as flat arrays."""
+
+    def __init__(self, root, class_names, class_mtimes, class_offsets, files, sizes, mtimes, hashes):
+        self.root = root
+        self.class_names = class_names
+        self.class_mtimes = class_mtimes
+        self.class_offsets = class_offsets
+        self.files = files
+        self.sizes = sizes
+        self.mtimes = mtimes
+        self.hashes = hashes
+
+    def __len__(self):
+        return self.class_names.shape[0]
+
+    @property
+    def class_sizes(self):
+        return np.diff(self.class_offsets)
+
+    @property
+    def labels(self):
+        return np.repeat(np.arange(len(self)), self.class_sizes)
+
+    def image_paths(self, label=None):
+        """Full paths of the images of class label, or of all images in class order."""
+        if label is None:
+            return [path for paths in self._class_paths() for path in paths]
+        prefix = os.path.join(self.root, str(self.class_names[label]), '')
+        return [prefix + filename for filename in
+                self.files[self.class_offsets[label]:self.class_offsets[label + 1]].tolist()]
+
+    def _class_paths(self):
+        # tolist() and one prefix per class: much faster than os.path.join per image
+        files = self.files.tolist()
+        offsets = self.class_offsets.tolist()
+        for i, name in enumerate(self.class_names.tolist()):
+            prefix = os.path.join(self.root, name, '')
+            yield [prefix + filename for filename in files[offsets[i]:offsets[i + 1]]]
+
+    def dataset(self, image_class):
+        """List of image_class(name, image_paths), one per class, like facenet.get_dataset."""
+        return [image_class(name, paths) for name, paths in zip(self.class_names.tolist(), self._class_paths())]
+
+    def save(self, filename):
+        # Written to a temporary file and renamed: readers never see half a manifest
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, version=MANIFEST_VERSION, root=np.array(self.root), class_names=self.class_names,
+                     class_mtimes=self.class_mtimes, class_offsets=self.class_offsets, files=self.files,
+                     sizes=self.sizes, mtimes=self.mtimes, hashes=self.hashes)
+        os.replace(tmp, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(os.path.expanduser(filename)) as data:
+            if int(data['version']) != MANIFEST_VERSION:
+                raise ValueError('Unsupported manifest version in "%s"' % filename)
+            return cls(str(data['root']), data['class_names'], data['class_mtimes'], data['class_offsets'],
+                       data['files'], data['sizes'], data['mtimes'], data['hashes'])
+
+
+def _scan_class(path, previous, hashes):
+    """(files, sizes, mtimes, hashes) of a class directory, reusing the entries of unchanged files."""
+    entries = sorted((entry.name, entry.stat()) for entry in os.scandir(path) if entry.is_file())
+    files = [name for name, _ in entries]
+    sizes = [st.st_size for _, st in entries]
+    mtimes = [st.st_mtime_ns for _, st in entries]
+    digests = []
+    for name, size, mtime in zip(files, sizes, mtimes):
+        old = previous.get(name)
+        if old is not None and old[0] == size and old[1] == mtime and (old[2] or not hashes):
+            digests.append(old[2])
+        else:
+            digests.append(file_hash(os.path.join(path, name)) if hashes else b'')
+    return files, sizes, mtimes, digests
+
+
+def scan(root, previous=None, hashes=False, rescan=False):
+    """Manifest of the dataset directory root.
+
+    Args:
+        root: Dataset directory with one subdirectory per class
+        previous: Manifest of an earlier scan; the classes whose directory
+            mtime did not change are copied from it
+        hashes: Compute the SHA-1 of new and changed files
+        rescan: List every class directory, whatever its mtime
+
+    Returns:
+        (manifest, number of class directories listed); manifest is
+        previous itself when nothing changed
+    """
+    root = os.path.abspath(os.path.expanduser(root))
+    classes = sorted((entry.name, entry.stat().st_mtime_ns) for entry in os.scandir(root) if entry.is_dir())
+    if previous is not None and previous.root == root and not rescan:
+        unchanged = (len(previous) == len(classes) and
+                     all(str(a) == b for a, b in zip(previous.class_names, (name for name, _ in classes))) and
+                     np.array_equal(previous.class_mtimes, [mtime for _, mtime in classes]))
+        if unchanged and (not hashes or all(previous.hashes)):
+            return previous, 0
+
+    old_classes = {}
+    if previous is not None and previous.root == root:
+        for i, (name, mtime) in enumerate(zip(previous.class_names, previous.class_mtimes)):
+            old_classes[str(name)] = (int(mtime), previous.class_offsets[i], previous.class_offsets[i + 1])
+
+    files, sizes, mtimes, digests, offsets = [], [], [], [], [0]
+    nrof_listed = 0
+    for name, mtime in classes:
+        old = old_classes.get(name)
+        if not rescan and old is not None and old[0] == mtime and (not hashes or all(previous.hashes[old[1]:old[2]])):
+            start, end = old[1], old[2]
+            files.extend(previous.files[start:end].tolist())
+            sizes.extend(previous.sizes[start:end].tolist())
+            mtimes.extend(previous.mtimes[start:end].tolist())
+            digests.extend(previous.hashes[start:end].tolist())
+        else:
+            known = {}
+            if old is not None:
+                for k in range(old[1], old[2]):
+                    known[str(previous.files[k])] = (int(previous.sizes[k]), int(previous.mtimes[k]),
+                                                     bytes(previous.hashes[k]))
+            c_files, c_sizes, c_mtimes, c_digests = _scan_class(os.path.join(root, name), known, hashes)
+            files.extend(c_files)
+            sizes.extend(c_sizes)
+            mtimes.extend(c_mtimes)
+            digests.extend(c_digests)
+            nrof_listed += 1
+        offsets.append(len(files))
+
+    manifest = DatasetManifest(root, np.array([name for name, _ in classes], dtype=str),
+                               np.array([mtime for _, mtime in classes], dtype=np.int64),
+                               np.array(offsets, dtype=np.int64), np.array(files, dtype=str),
+                               np.array(sizes, dtype=np.int64), np.array(mtimes, dtype=np.int64),
+                               np.array(digests, dtype='S20'))
+    return manifest, nrof_listed
+
+
+def open_manifest(path, manifest_file=None, hashes=False, rescan=False):
+    """Up to date manifest of a dataset directory, or the manifest file path as is.
+
+    The manifest of a directory is read from manifest_file (by default
+    MANIFEST_FILE inside the directory), updated with scan() and written back
+    when something changed.
+    """
+    path = os.path.expanduser(path)
+    if is_manifest_file(path):
+        return DatasetManifest.load(path)
+    if manifest_file is None:
+        manifest_file = os.path.join(path, MANIFEST_FILE)
+    previous = None
+    if os.path.isfile(manifest_file):
+        try:
+            previous = DatasetManifest.load(manifest_file)
+        except (IOError, OSError, ValueError, KeyError) as e:
+            print('Ignoring the dataset manifest %s: %s' % (manifest_file, e))
+    manifest, nrof_listed = scan(path, previous, hashes, rescan)
+    if manifest is not previous:
+        try:
+            manifest.save(manifest_file)
+        except (IOError, OSError) as e:
+            print('Unable to write the dataset manifest %s: %s' % (manifest_file, e))
+    return manifest
+
+
+def main(args):
+    manifest = open_manifest(args.dataset_dir, args.manifest_file, args.hashes, args.rescan)
+    print('%d classes, %d images' % (len(manifest), manifest.files.shape[0]))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dataset_dir', type=str,
+        help='Directory with one subdirectory per class.')
+    parser.add_argument('--manifest_file', type=str,
+        help='Where the manifest is kept (default: %s in dataset_dir).' % MANIFEST_FILE, default=None)
+    parser.add_argument('--hashes',
+        help='Store the SHA-1 of every image (computed only for new and changed files).', action='store_true')
+    parser.add_argument('--rescan',
+        help='List every class directory, not only those whose mtime changed.', action='store_true')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
@@ -1,5 +1,15 @@
 """Decode the MsCelebV1 dataset in TSV (tab separated values) format downloaded from
 https://www.microsoft.com/en-us/research/project/ms-celeb-1m-challenge-recognizing-one-million-celebrities-real-world/
+
+The TSV files are split into chunks of --chunk_size MB at line boundaries and
+a pool of --nrof_workers processes reads, base64-decodes, decodes and resizes
+the images of one chunk each. The images go either to one file per image
+(--output files, as before) or straight into uint8 training shards
+(--output shards, see shards.py). For the shards the workers stream the
+decoded images of a chunk to a spool file on disk and return only their
+names, so memory does not grow with --chunk_size. Finished chunks are
+recorded in decode_progress.json in the output directory, so an interrupted
+run picks up where it stopped.
 """
 # MIT License
 # 
@@ -27,14 +37,17 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from scipy import misc
 import numpy as np
 import base64
 import sys
 import os
 import cv2
+import json
+import time
 import argparse
-import facenet
+import multiprocessing
+from collections import deque
+import shards
 
 
 # File format: text files, each line is an image record containing 6 columns, delimited by TAB.
@@ -45,43 +58,223 @@ import facenet
 # Column5: PageURL
 # Column6: ImageData_Base64Encoded
 
+PROGRESS_FILE = 'decode_progress.json'
+SPOOL_DIR = '.decode_spool'
+
+def tsv_chunks(tsv_files, chunk_size):
+    """(path, start, end) byte ranges of about chunk_size bytes covering the TSV files."""
+    chunks = []
+    for path in tsv_files:
+        file_size = os.path.getsize(path)
+        for start in range(0, file_size, chunk_size):
+            chunks.append((path, start, min(start + chunk_size, file_size)))
+    return chunks
+
+def read_chunk(path, start, end):
+    """Yields the lines of path that start in [start, end)."""
+    with open(path, 'rb') as f:
+        if start > 0:
+            # The line running across start belongs to the previous chunk
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line
+
+def decode_record(line, size, output_format):
+    """(class_dir, img_name, BGR image) of a TSV line, or None if it cannot be decoded."""
+    fields = line.rstrip(b'\r\n').split(b'\t')
+    if len(fields) < 6:
+        return None
+    class_dir = fields[0].decode('utf-8', 'replace')
+    img_name = (fields[1] + b'-' + fields[4]).decode('utf-8', 'replace') + '.' + output_format
+    try:
+        img_data = np.frombuffer(base64.b64decode(fields[5]), dtype=np.uint8)
+    except ValueError:
+        return None
+    img = cv2.imdecode(img_data, cv2.IMREAD_COLOR) #pylint: disable=maybe-no-member
+    if img is None:
+        return None
+    if size:
+        img = cv2.resize(img, (size, size), interpolation=cv2.INTER_LINEAR) #pylint: disable=maybe-no-member
+    return class_dir, img_name.replace('/','_'), img
+
+def init_worker():
+    # One process per core already: keep OpenCV from starting threads of its own
+    cv2.setNumThreads(1) #pylint: disable=maybe-no-member
+
+def decode_chunk(task):
+    """Decodes the images of one chunk.
+
+    Returns:
+        (nrof_images, nrof_failed, batch): batch is None when the images are
+        written to output_dir, or (class names, image names) of the RGB
+        images written one after the other to spool_file for the shards
+    """
+    path, start, end, size, output_format, output_dir, spool_file = task
+    nrof_images = nrof_failed = 0
+    class_names, img_names = [], []
+    # A chunk holds thousands of images: they go to disk as they are decoded
+    # instead of being kept in memory and pickled back to the parent
+    spool = open(spool_file, 'wb') if output_dir is None else None
+    try:
+        for line in read_chunk(path, start, end):
+            record = decode_record(line, size, output_format)
+            if record is None:
+                nrof_failed += 1
+                continue
+            class_dir, img_name, img = record
+            nrof_images += 1
+            if spool is not None:
+                spool.write(np.ascontiguousarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)).data) #pylint: disable=maybe-no-member
+                class_names.append(class_dir)
+                img_names.append(img_name)
+            else:
+                full_class_dir = os.path.join(output_dir, class_dir)
+                if not os.path.exists(full_class_dir):
+                    os.makedirs(full_class_dir, exist_ok=True)
+                cv2.imwrite(os.path.join(full_class_dir, img_name), img) #pylint: disable=maybe-no-member
+    finally:
+        if spool is not None:
+            spool.close()
+    if output_dir is not None:
+        return nrof_images, nrof_failed, None
+    return nrof_images, nrof_failed, (class_names, img_names)
+
+def new_progress(settings):
+    return {'settings': settings, 'next_chunk': 0, 'nrof_images': 0, 'nrof_failed': 0, 'shards': None, 'done': False}
+
+def load_progress(filename, settings):
+    if os.path.exists(filename):
+        with open(filename) as f:
+            progress = json.load(f)
+        if progress['settings'] == settings:
+            return progress
+        print('Ignoring %s: it was written with other settings' % filename)
+    return new_progress(settings)
+
+def save_progress(filename, progress):
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(progress, f)
+    os.replace(tmp, filename)
+
+def decode_tsv(tsv_files, output_dir, size=None, output_format='png', output='files', images_per_shard=10000,
+               nrof_workers=4, chunk_size=64, restart=False):
+    """Decodes the TSV files into output_dir, resuming a previous run unless restart.
+
+    Returns:
+        (nrof_images, nrof_failed) decoded in total, including previous runs
+    """
+    output_dir = os.path.expanduser(output_dir)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    tsv_files = [os.path.abspath(os.path.expanduser(path)) for path in tsv_files]
+    chunk_size = chunk_size * 1024 * 1024
+    chunks = tsv_chunks(tsv_files, chunk_size)
+    settings = {'tsv_files': tsv_files, 'sizes': [os.path.getsize(path) for path in tsv_files],
+                'chunk_size': chunk_size, 'size': size, 'output': output,
+                'output_format': output_format, 'images_per_shard': images_per_shard}
+    progress_file = os.path.join(output_dir, PROGRESS_FILE)
+    progress = new_progress(settings) if restart else load_progress(progress_file, settings)
+    if progress['done']:
+        print('%s is complete: %d images' % (output_dir, progress['nrof_images']))
+        return progress['nrof_images'], progress['nrof_failed']
+    if progress['next_chunk'] > 0:
+        print('Resuming at chunk %d of %d' % (progress['next_chunk'], len(chunks)))
+
+    writer = spool_dir = None
+    if output == 'shards':
+        writer = shards.ShardWriter(output_dir, (size, size, 3), images_per_shard, progress['shards'])
+        # Spool files of an interrupted run: their chunks are decoded again
+        spool_dir = os.path.join(output_dir, SPOOL_DIR)
+        if os.path.exists(spool_dir):
+            for name in os.listdir(spool_dir):
+                os.remove(os.path.join(spool_dir, name))
+        else:
+            os.makedirs(spool_dir)
+    files_dir = output_dir if output == 'files' else None
+
+    # Chunks are decoded out of order but recorded in order; at most
+    # 2 * nrof_workers are in flight. Their decoded images wait in the spool
+    # files on disk (up to 2 * nrof_workers chunks of them), not in memory
+    pool = multiprocessing.Pool(nrof_workers, init_worker)
+    pending = deque()
+    next_submit = progress['next_chunk']
+    start_time = time.time()
+    nrof_bytes = 0
+    try:
+        while pending or next_submit < len(chunks):
+            while next_submit < len(chunks) and len(pending) < 2 * nrof_workers:
+                path, start, end = chunks[next_submit]
+                spool_file = os.path.join(spool_dir, 'chunk_%06d.raw' % next_submit) if spool_dir else None
+                task = (path, start, end, size, output_format, files_dir, spool_file)
+                pending.append((next_submit, pool.apply_async(decode_chunk, (task,))))
+                next_submit += 1
+            i, result = pending.popleft()
+            nrof_images, nrof_failed, batch = result.get()
+            if writer is not None:
+                class_names, img_names = batch
+                spool_file = os.path.join(spool_dir, 'chunk_%06d.raw' % i)
+                if class_names:
+                    # Memory-mapped: the pages are copied to the shard without loading the chunk
+                    images = np.memmap(spool_file, dtype=np.uint8, mode='r', shape=(len(class_names), size, size, 3))
+                    writer.append(images, class_names, img_names)
+                    del images
+                os.remove(spool_file)
+                progress['shards'] = writer.state()
+            progress['next_chunk'] = i + 1
+            progress['nrof_images'] += nrof_images
+            progress['nrof_failed'] += nrof_failed
+            save_progress(progress_file, progress)
+            nrof_bytes += chunks[i][2] - chunks[i][1]
+            print('Chunk %d/%d: %d images (%d failed), %.1f MB/s' % (i + 1, len(chunks), nrof_images, nrof_failed,
+                nrof_bytes / 1024 / 1024 / max(time.time() - start_time, 1e-6)))
+    finally:
+        pool.terminate()
+        pool.join()
+
+    if writer is not None:
+        writer.close()
+        os.rmdir(spool_dir)
+    progress['done'] = True
+    save_progress(progress_file, progress)
+    return progress['nrof_images'], progress['nrof_failed']
+
 def main(args):
     output_dir = os.path.expanduser(args.output_dir)
   
     if not os.path.exists(output_dir):
-        os.mkdir(output_dir)
+        os.makedirs(output_dir)
   
     # Store some git revision info in a text file in the output directory
+    import facenet  # TensorFlow is only needed here
     src_path,_ = os.path.split(os.path.realpath(__file__))
     facenet.store_revision_info(src_path, output_dir, ' '.join(sys.argv))
-    
-    i = 0
-    for f in args.tsv_files:
-        for line in f:
-            fields = line.split('\t')
-            class_dir = fields[0]
-            img_name = fields[1] + '-' + fields[4] + '.' + args.output_format
-            img_string = fields[5]
-            img_dec_string = base64.b64decode(img_string)
-            img_data = np.fromstring(img_dec_string, dtype=np.uint8)
-            img = cv2.imdecode(img_data, cv2.IMREAD_COLOR) #pylint: disable=maybe-no-member
-            if args.size:
-                img = misc.imresize(img, (args.size, args.size), interp='bilinear')
-            full_class_dir = os.path.join(output_dir, class_dir)
-            if not os.path.exists(full_class_dir):
-                os.mkdir(full_class_dir)
-            full_path = os.path.join(full_class_dir, img_name.replace('/','_'))
-            cv2.imwrite(full_path, img) #pylint: disable=maybe-no-member
-            print('%8d: %s' % (i, full_path))
-            i += 1
+
+    nrof_images, nrof_failed = decode_tsv(args.tsv_files, output_dir, args.size, args.output_format, args.output,
+        args.images_per_shard, args.nrof_workers, args.chunk_size, args.restart)
+    print('Decoded %d images (%d failed) into %s' % (nrof_images, nrof_failed, output_dir))
   
-if __name__ == '__main__':
+def parse_arguments(argv):
     parser = argparse.ArgumentParser()
 
     parser.add_argument('output_dir', type=str, help='Output base directory for the image dataset')
-    parser.add_argument('tsv_files', type=argparse.FileType('r'), nargs='+', help='Input TSV file name(s)')
+    parser.add_argument('tsv_files', type=str, nargs='+', help='Input TSV file name(s)')
     parser.add_argument('--size', type=int, help='Images are resized to the given size')
     parser.add_argument('--output_format', type=str, help='Format of the output images', default='png', choices=['png', 'jpg'])
+    parser.add_argument('--output', type=str, choices=['files', 'shards'],
+        help='One file per image, or uint8 training shards (needs --size)', default='files')
+    parser.add_argument('--images_per_shard', type=int, help='Number of images in each shard file', default=10000)
+    parser.add_argument('--nrof_workers', type=int, help='Number of decoding processes', default=multiprocessing.cpu_count())
+    parser.add_argument('--chunk_size', type=int, help='Size in MB of the TSV chunk decoded by a worker at a time', default=64)
+    parser.add_argument('--restart', action='store_true', help='Ignore the progress of a previous run')
+    args = parser.parse_args(argv)
+    if args.output == 'shards' and not args.size:
+        parser.error('--output shards needs --size: all the images of the shards have the same size')
+    return args
 
-    main(parser.parse_args())
-
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
@@ -0,0 +1,95 @@
+"""Memory bank of the embeddings of every training image, for train_tripletloss.py.
+
+train_tripletloss used to run a forward pass over every sampled batch
+(people_per_batch x images_per_person images) only to mine its triplets,
+and threw those embeddings away. EmbeddingBank keeps the last embedding of
+every image of the dataset with the training step it was computed at:
+
+- a sampled batch is embedded again only for the images whose embedding is
+  older than max_age steps (or missing);
+- the embeddings computed by the training steps themselves (the anchors,
+  positives and negatives of the triplets) are stored as well, so they
+  come for free;
+- the negatives are searched in the batch and in nrof_candidates fresh
+  embeddings drawn from the whole dataset, not only in the batch.
+
+The bank takes nrof_images * embedding_size * 4 bytes (256 MB for 500k
+images of 128 floats). Mining holds a batch_size x nrof_candidates distance
+matrix, so nrof_candidates has to stay bounded: searching the whole bank of
+a large dataset does not fit in memory.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+try:
+    import triplet_selection
+except ImportError:
+    # Imported as a package (attendance.facenet.src.embedding_bank)
+    from . import triplet_selection
+
+
+class EmbeddingBank(object):
+    """Last embedding of every image of a dataset and the step it was computed at."""
+
+    def __init__(self, labels, embedding_size, max_age):
+        """
+        Args:
+            labels: (nrof_images,) class of every image, as flattened by PKSampler
+            embedding_size: Dimensionality of the embeddings
+            max_age: Embeddings older than this many training steps are stale
+        """
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.max_age = max_age
+        self.embeddings = np.zeros((self.labels.shape[0], embedding_size), dtype=np.float32)
+        self.updated_at = np.full(self.labels.shape[0], -1, dtype=np.int64)
+
+    def __len__(self):
+        return self.labels.shape[0]
+
+    def update(self, indices, embeddings, step):
+        self.embeddings[indices] = embeddings
+        self.updated_at[indices] = step
+
+    def is_fresh(self, indices, step):
+        updated_at = self.updated_at[indices]
+        return (updated_at >= 0) & (step - updated_at <= self.max_age)
+
+    def stale_indices(self, indices, step):
+        """The images of indices that have to be embedded again, without duplicates."""
+        indices = np.asarray(indices)
+        return np.unique(indices[~self.is_fresh(indices, step)])
+
+    def candidates(self, exclude, nrof_candidates, step, rng=np.random):
+        """Up to nrof_candidates random images with a fresh embedding, outside exclude."""
+        if nrof_candidates < 1:
+            raise ValueError('nrof_candidates must be at least 1, got %d' % nrof_candidates)
+        fresh = self.is_fresh(slice(None), step)
+        fresh[exclude] = False
+        candidates = np.flatnonzero(fresh)
+        if nrof_candidates < candidates.shape[0]:
+            candidates = rng.choice(candidates, nrof_candidates, replace=False)
+        return candidates
+
+    def select_triplet_indices(self, indices, step, alpha, mode='vgg', nrof_candidates=10000, rng=np.random):
+        """Triplets of a batch with the negatives mined in the batch and in the bank.
+
+        Args:
+            indices: Images of the batch, the images of each class contiguous;
+                their embeddings must be fresh
+            step: Current training step
+            alpha, mode: See triplet_selection.select_triplet_indices
+            nrof_candidates: Fresh embeddings from outside the batch that are
+                searched for negatives as well (at least 1)
+
+        Returns:
+            (anchors, positives, negatives, nrof_pairs) as image indices
+        """
+        indices = np.asarray(indices)
+        candidates = np.concatenate([indices, self.candidates(indices, nrof_candidates, step, rng)])
+        anchors, positives, negatives, nrof_pairs = triplet_selection.select_triplet_indices(
+            self.embeddings[indices], self.labels[indices], alpha, mode, rng,
+            self.embeddings[candidates], self.labels[candidates])
+        return indices[anchors], indices[positives], candidates[negatives], nrof_pairs
@@ -2,6 +2,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import json
 import os
 import pickle
 import time
@@ -9,16 +10,17 @@ import sys
 import cv2
 import numpy as np
 import tensorflow as tf
-from scipy import misc
 
 import facenet
 from align import detect_face
+from align import landmarks
 
 input_video=sys.argv[1]
 modeldir = 'facenet/src/20180402-114759/'
 classifier_filename = 'facenet/src/20180402-114759/my_classifier.pkl'
 npy=''
 train_img="facenet/dataset/raw"
+calibration_file='../instance/calibration.json'  # written by python -m attendance.calibration --facenet
 
 with tf.Graph().as_default():
     gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=0.0)
@@ -29,14 +31,22 @@ with tf.Graph().as_default():
         minsize = 20  # minimum size of face
         threshold = [0.8, 0.8, 0.8]  # three steps's threshold
         factor = 0.709  # scale factor
-        margin = 32
+        # The classifier was trained on box crops; set to True only with a
+        # classifier trained on align_dataset_mtcnn --align_landmarks output
+        align_landmarks = False
+        margin = 22  # aligned faces: same framing as align_dataset_mtcnn (182 px, margin 44) after the 160 px center crop
         frame_interval = 3
         batch_size = 1000
         image_size = 160
         input_image_size = 160
 
-        HumanNames = os.listdir(train_img)
-        HumanNames.sort()
+        # Class directories in sorted order (stray files in train_img are skipped)
+        HumanNames = sorted(name for name in os.listdir(train_img) if os.path.isdir(os.path.join(train_img, name)))
+
+        min_probability = 0.43
+        if os.path.exists(calibration_file):
+            with open(calibration_file) as f:
+                min_probability = json.load(f).get('min_probability', min_probability)
 
         print('Loading Modal')
         facenet.load_model(modeldir)
@@ -74,62 +84,44 @@ with tf.Graph().as_default():
                 if frame.ndim == 2:
                     frame = facenet.to_rgb(frame)
                 frame = frame[:, :, 0:3]
-                bounding_boxes, _ = detect_face.detect_face(frame, minsize, pnet, rnet, onet, threshold, factor)
+                bounding_boxes, points = detect_face.detect_face(frame, minsize, pnet, rnet, onet, threshold, factor)
                 nrof_faces = bounding_boxes.shape[0]
                 print('Detected_FaceNum: %d' % nrof_faces)
 
                 if nrof_faces > 0:
-                    det = bounding_boxes[:, 0:4]
-                    img_size = np.asarray(frame.shape)[0:2]
-
-                    cropped = []
-                    scaled = []
-                    scaled_reshape = []
-                    bb = np.zeros((nrof_faces,4), dtype=np.int32)
-
-                    for i in range(nrof_faces):
-                        emb_array = np.zeros((1, embedding_size))
-
-                        bb[i][0] = det[i][0]
-                        bb[i][1] = det[i][1]
-                        bb[i][2] = det[i][2]
-                        bb[i][3] = det[i][3]
-
-                        # inner exception
-                        if bb[i][0] <= 0 or bb[i][1] <= 0 or bb[i][2] >= len(frame[0]) or bb[i][3] >= len(frame):
-                            print('Face is very close!')
-                            continue
-
-                        cropped.append(frame[bb[i][1]:bb[i][3], bb[i][0]:bb[i][2], :])
-                        cropped[i] = facenet.flip(cropped[i], False)
-                        scaled.append(misc.imresize(cropped[i], (image_size, image_size), interp='bilinear'))
-                        scaled[i] = cv2.resize(scaled[i], (input_image_size,input_image_size),
-                                               interpolation=cv2.INTER_CUBIC)
-                        scaled[i] = facenet.prewhiten(scaled[i])
-                        scaled_reshape.append(scaled[i].reshape(-1,input_image_size,input_image_size,3))
-                        feed_dict = {images_placeholder: scaled_reshape[i], phase_train_placeholder: False}
-                        emb_array[0, :] = sess.run(embeddings, feed_dict=feed_dict)
+                    bb = bounding_boxes[:, 0:4].astype(np.int32)
+
+                    # inner exception
+                    keep = (bb[:, 0] > 0) & (bb[:, 1] > 0) & (bb[:, 2] < len(frame[0])) & (bb[:, 3] < len(frame))
+                    if not keep.all():
+                        print('Face is very close!')
+                    bb = bb[keep]
+
+                    if len(bb) > 0:
+                        # Crop (or align) every face straight to input_image_size
+                        # and embed them all in one batch
+                        if align_landmarks:
+                            scaled = landmarks.align_faces(frame, points[:, keep], input_image_size, margin)
+                        else:
+                            scaled = [cv2.resize(frame[y1:y2, x1:x2], (input_image_size, input_image_size),
+                                                 interpolation=cv2.INTER_LINEAR) for x1, y1, x2, y2 in bb]
+                        scaled_reshape = np.stack([facenet.prewhiten(face) for face in scaled])
+                        feed_dict = {images_placeholder: scaled_reshape, phase_train_placeholder: False}
+                        emb_array = sess.run(embeddings, feed_dict=feed_dict)
                         predictions = model.predict_proba(emb_array)
-                        #print(predictions)
                         best_class_indices = np.argmax(predictions, axis=1)
                         best_class_probabilities = predictions[np.arange(len(best_class_indices)), best_class_indices]
-                        # no print("predictions")
-                        #print(best_class_indices,' with accuracy ',best_class_probabilities)
 
+                    for i in range(len(bb)):
                         cv2.rectangle(frame, (bb[i][0], bb[i][1]), (bb[i][2], bb[i][3]), (0, 255, 0), 2)    #boxing face
-                        # no print(best_class_probabilities)
-                        if best_class_probabilities>0.43:
+                        if best_class_probabilities[i]>min_probability:
 
                             #plot result idx under box
                             text_x = bb[i][0]
                             text_y = bb[i][3] + 20
-                            #print('Result Indices: ', best_class_indices[0])
-                            #print(HumanNames)
-                            for H_i in HumanNames:
-                                if HumanNames[best_class_indices[0]] == H_i:
-                                    result_names = HumanNames[best_class_indices[0]]
-                                    cv2.putText(frame, result_names, (text_x, text_y), cv2.FONT_HERSHEY_COMPLEX_SMALL,
-                                                2, (0, 0, 255), thickness=2, lineType=2)
+                            result_names = HumanNames[best_class_indices[i]]
+                            cv2.putText(frame, result_names, (text_x, text_y), cv2.FONT_HERSHEY_COMPLEX_SMALL,
+                                        2, (0, 0, 255), thickness=2, lineType=2)
                 else:
                     print('Alignment Failure')
             # c+=1
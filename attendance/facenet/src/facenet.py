@@ -32,14 +32,21 @@ from subprocess import Popen, PIPE
 import tensorflow as tf
 import numpy as np
 from scipy import misc
-from sklearn.model_selection import KFold
-from scipy import interpolate
 from tensorflow.python.training import training
 import random
 import re
 from tensorflow.python.platform import gfile
 import math
 from six import iteritems
+try:
+    import verification
+    import shards
+    import dataset_manifest
+except ImportError:
+    # Imported as a package (attendance.facenet.src.facenet)
+    from . import verification
+    from . import shards
+    from . import dataset_manifest
 
 def triplet_loss(anchor, positive, negative, alpha):
     """Calculate the triplet loss according to the FaceNet paper
@@ -94,20 +101,28 @@ def random_rotate_image(image):
     angle = np.random.uniform(low=-10.0, high=10.0)
     return misc.imrotate(image, angle, 'bicubic')
   
+def read_image_op(filename, from_shards=False):
+    if from_shards:
+        # Shard keys (and plain files) are read in Python, see shards.py
+        image = tf.py_func(shards.read_image, [filename], tf.uint8, stateful=False)
+        image.set_shape((None, None, 3))
+        return image
+    file_contents = tf.read_file(filename)
+    return tf.image.decode_image(file_contents, 3)
+  
 # 1: Random rotate 2: Random crop  4: Random flip  8:  Fixed image standardization  16: Flip
 RANDOM_ROTATE = 1
 RANDOM_CROP = 2
 RANDOM_FLIP = 4
 FIXED_STANDARDIZATION = 8
 FLIP = 16
-def create_input_pipeline(input_queue, image_size, nrof_preprocess_threads, batch_size_placeholder):
+def create_input_pipeline(input_queue, image_size, nrof_preprocess_threads, batch_size_placeholder, from_shards=False):
     images_and_labels_list = []
     for _ in range(nrof_preprocess_threads):
         filenames, label, control = input_queue.dequeue()
         images = []
         for filename in tf.unstack(filenames):
-            file_contents = tf.read_file(filename)
-            image = tf.image.decode_image(file_contents, 3)
+            image = read_image_op(filename, from_shards)
             image = tf.cond(get_control_flag(control[0], RANDOM_ROTATE),
                             lambda:tf.py_func(random_rotate_image, [image], tf.uint8), 
                             lambda:tf.identity(image))
@@ -210,6 +225,41 @@ def train(total_loss, global_step, optimizer, learning_rate, moving_average_deca
   
     return train_op
 
+def cpu_supports_bfloat16():
+    """True if the CPU has native bfloat16 instructions, None if it cannot be told (no /proc/cpuinfo)."""
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = set(' '.join(line for line in f if line.startswith('flags')).split())
+    except (IOError, OSError):
+        return None
+    return bool(flags & {'avx512_bf16', 'amx_bf16'})
+
+def session_config(gpu_memory_fraction=1.0, intra_op_threads=0, inter_op_threads=0, precision='float32'):
+    """ConfigProto with the GPU memory bound, the CPU thread pools and the precision of the training graph.
+
+    Zero threads lets TensorFlow choose (one per core). With precision
+    'bfloat16' Grappler's oneDNN auto mixed precision pass runs the
+    convolutions and matmuls in bfloat16 while the variables, the loss and
+    the gradient updates stay in float32.
+    """
+    from tensorflow.core.protobuf import rewriter_config_pb2
+    gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=gpu_memory_fraction)
+    config = tf.ConfigProto(gpu_options=gpu_options, log_device_placement=False,
+        intra_op_parallelism_threads=intra_op_threads, inter_op_parallelism_threads=inter_op_threads)
+    if precision == 'bfloat16':
+        rewrite_options = config.graph_options.rewrite_options
+        fields = rewrite_options.DESCRIPTOR.fields_by_name
+        # Renamed in TensorFlow 2.9
+        field = [name for name in ('auto_mixed_precision_onednn_bfloat16', 'auto_mixed_precision_mkl') if name in fields]
+        if not field:
+            raise ValueError('This version of TensorFlow has no bfloat16 auto mixed precision')
+        setattr(rewrite_options, field[0], rewriter_config_pb2.RewriterConfig.ON)
+        if cpu_supports_bfloat16() is False:
+            print('Warning: this CPU has no native bfloat16 instructions, bfloat16 training will likely be slower')
+    elif precision != 'float32':
+        raise ValueError('Invalid precision: %s' % precision)
+    return config
+
 def prewhiten(x):
     mean = np.mean(x)
     std = np.std(x)
@@ -244,7 +294,10 @@ def load_data(image_paths, do_random_crop, do_random_flip, image_size, do_prewhi
     nrof_samples = len(image_paths)
     images = np.zeros((nrof_samples, image_size, image_size, 3))
     for i in range(nrof_samples):
-        img = misc.imread(image_paths[i])
+        if shards.is_key(image_paths[i]):
+            img = shards.read_image(image_paths[i])
+        else:
+            img = misc.imread(image_paths[i])
         if img.ndim == 2:
             img = to_rgb(img)
         if do_prewhiten:
@@ -314,20 +367,19 @@ class ImageClass():
     def __len__(self):
         return len(self.image_paths)
   
-def get_dataset(path, has_class_directories=True):
-    dataset = []
-    path_exp = os.path.expanduser(path)
-    classes = [path for path in os.listdir(path_exp) \
-                    if os.path.isdir(os.path.join(path_exp, path))]
-    classes.sort()
-    nrof_classes = len(classes)
-    for i in range(nrof_classes):
-        class_name = classes[i]
-        facedir = os.path.join(path_exp, class_name)
-        image_paths = get_image_paths(facedir)
-        dataset.append(ImageClass(class_name, image_paths))
-  
-    return dataset
+def get_dataset(path, has_class_directories=True, manifest_file=None):
+    if shards.is_shard_dir(path):
+        # Packed by shards.py: image paths are keys into the memory-mapped shards
+        return shards.open_shards(path).dataset(ImageClass)
+    if manifest_file is None and not dataset_manifest.is_manifest_file(path):
+        # Names only, without a stat per image, and nothing written next to the dataset
+        path_exp = os.path.expanduser(path)
+        classes = sorted(name for name in os.listdir(path_exp) if os.path.isdir(os.path.join(path_exp, name)))
+        return [ImageClass(name, get_image_paths(os.path.join(path_exp, name))) for name in classes]
+    # Opt-in: the listing is kept in manifest_file and updated incrementally,
+    # see dataset_manifest.py for when it can go stale. A manifest file is
+    # accepted in place of the dataset directory and loaded as is
+    return dataset_manifest.open_manifest(path, manifest_file).dataset(ImageClass)
 
 def get_image_paths(facedir):
     image_paths = []
@@ -422,37 +474,9 @@ def distance(embeddings1, embeddings2, distance_metric=0):
     return dist
 
 def calculate_roc(thresholds, embeddings1, embeddings2, actual_issame, nrof_folds=10, distance_metric=0, subtract_mean=False):
-    assert(embeddings1.shape[0] == embeddings2.shape[0])
-    assert(embeddings1.shape[1] == embeddings2.shape[1])
-    nrof_pairs = min(len(actual_issame), embeddings1.shape[0])
-    nrof_thresholds = len(thresholds)
-    k_fold = KFold(n_splits=nrof_folds, shuffle=False)
-    
-    tprs = np.zeros((nrof_folds,nrof_thresholds))
-    fprs = np.zeros((nrof_folds,nrof_thresholds))
-    accuracy = np.zeros((nrof_folds))
-    
-    indices = np.arange(nrof_pairs)
-    
-    for fold_idx, (train_set, test_set) in enumerate(k_fold.split(indices)):
-        if subtract_mean:
-            mean = np.mean(np.concatenate([embeddings1[train_set], embeddings2[train_set]]), axis=0)
-        else:
-          mean = 0.0
-        dist = distance(embeddings1-mean, embeddings2-mean, distance_metric)
-        
-        # Find the best threshold for the fold
-        acc_train = np.zeros((nrof_thresholds))
-        for threshold_idx, threshold in enumerate(thresholds):
-            _, _, acc_train[threshold_idx] = calculate_accuracy(threshold, dist[train_set], actual_issame[train_set])
-        best_threshold_index = np.argmax(acc_train)
-        for threshold_idx, threshold in enumerate(thresholds):
-            tprs[fold_idx,threshold_idx], fprs[fold_idx,threshold_idx], _ = calculate_accuracy(threshold, dist[test_set], actual_issame[test_set])
-        _, _, accuracy[fold_idx] = calculate_accuracy(thresholds[best_threshold_index], dist[test_set], actual_issame[test_set])
-          
-        tpr = np.mean(tprs,0)
-        fpr = np.mean(fprs,0)
-    return tpr, fpr, accuracy
+    # Vectorized over thresholds and folds, see verification.py
+    return verification.calculate_roc(thresholds, embeddings1, embeddings2, actual_issame,
+        nrof_folds=nrof_folds, distance_metric=distance_metric, subtract_mean=subtract_mean)
 
 def calculate_accuracy(threshold, dist, actual_issame):
     predict_issame = np.less(dist, threshold)
@@ -469,40 +493,9 @@ def calculate_accuracy(threshold, dist, actual_issame):
 
   
 def calculate_val(thresholds, embeddings1, embeddings2, actual_issame, far_target, nrof_folds=10, distance_metric=0, subtract_mean=False):
-    assert(embeddings1.shape[0] == embeddings2.shape[0])
-    assert(embeddings1.shape[1] == embeddings2.shape[1])
-    nrof_pairs = min(len(actual_issame), embeddings1.shape[0])
-    nrof_thresholds = len(thresholds)
-    k_fold = KFold(n_splits=nrof_folds, shuffle=False)
-    
-    val = np.zeros(nrof_folds)
-    far = np.zeros(nrof_folds)
-    
-    indices = np.arange(nrof_pairs)
-    
-    for fold_idx, (train_set, test_set) in enumerate(k_fold.split(indices)):
-        if subtract_mean:
-            mean = np.mean(np.concatenate([embeddings1[train_set], embeddings2[train_set]]), axis=0)
-        else:
-          mean = 0.0
-        dist = distance(embeddings1-mean, embeddings2-mean, distance_metric)
-      
-        # Find the threshold that gives FAR = far_target
-        far_train = np.zeros(nrof_thresholds)
-        for threshold_idx, threshold in enumerate(thresholds):
-            _, far_train[threshold_idx] = calculate_val_far(threshold, dist[train_set], actual_issame[train_set])
-        if np.max(far_train)>=far_target:
-            f = interpolate.interp1d(far_train, thresholds, kind='slinear')
-            threshold = f(far_target)
-        else:
-            threshold = 0.0
-    
-        val[fold_idx], far[fold_idx] = calculate_val_far(threshold, dist[test_set], actual_issame[test_set])
-  
-    val_mean = np.mean(val)
-    far_mean = np.mean(far)
-    val_std = np.std(val)
-    return val_mean, val_std, far_mean
+    # Vectorized over thresholds and folds, see verification.py
+    return verification.calculate_val(thresholds, embeddings1, embeddings2, actual_issame, far_target,
+        nrof_folds=nrof_folds, distance_metric=distance_metric, subtract_mean=subtract_mean)
 
 
 def calculate_val_far(threshold, dist, actual_issame):
@@ -30,6 +30,7 @@ from __future__ import print_function
 import os
 import numpy as np
 import facenet
+import shards
 
 def evaluate(embeddings, actual_issame, nrof_folds=10, distance_metric=0, subtract_mean=False):
     # Calculate evaluation metrics
@@ -44,26 +45,41 @@ def evaluate(embeddings, actual_issame, nrof_folds=10, distance_metric=0, subtra
     return tpr, fpr, accuracy, val, val_std, far
 
 def get_paths(lfw_dir, pairs):
-    nrof_skipped_pairs = 0
+    # Each person directory is listed once instead of stat'ing every file of
+    # every pair (up to six os.path.exists calls per pair)
+    listings = {}
+    keys = None
+    if shards.is_shard_dir(lfw_dir):
+        # Packed by shards.py: look the images up in the shard index
+        keys = shards.open_shards(lfw_dir).key_of()
+        for rel in keys:
+            name, filename = os.path.split(rel)
+            listings.setdefault(name, set()).add(filename)
+    def resolve(name, number):
+        files = listings.get(name)
+        if files is None:
+            try:
+                files = set(os.listdir(os.path.join(lfw_dir, name)))
+            except OSError:
+                files = set()
+            listings[name] = files
+        base = name + '_' + '%04d' % int(number)
+        for ext in ('.jpg', '.png'):
+            if base + ext in files:
+                if keys is not None:
+                    return keys[os.path.join(name, base + ext)]
+                return os.path.join(lfw_dir, name, base + ext)
+        raise RuntimeError('No file "%s" with extension png or jpg.' % os.path.join(lfw_dir, name, base))
+
     path_list = []
     issame_list = []
     for pair in pairs:
         if len(pair) == 3:
-            path0 = add_extension(os.path.join(lfw_dir, pair[0], pair[0] + '_' + '%04d' % int(pair[1])))
-            path1 = add_extension(os.path.join(lfw_dir, pair[0], pair[0] + '_' + '%04d' % int(pair[2])))
-            issame = True
+            path_list += (resolve(pair[0], pair[1]), resolve(pair[0], pair[2]))
+            issame_list.append(True)
         elif len(pair) == 4:
-            path0 = add_extension(os.path.join(lfw_dir, pair[0], pair[0] + '_' + '%04d' % int(pair[1])))
-            path1 = add_extension(os.path.join(lfw_dir, pair[2], pair[2] + '_' + '%04d' % int(pair[3])))
-            issame = False
-        if os.path.exists(path0) and os.path.exists(path1):    # Only add the pair if both paths exist
-            path_list += (path0,path1)
-            issame_list.append(issame)
-        else:
-            nrof_skipped_pairs += 1
-    if nrof_skipped_pairs>0:
-        print('Skipped %d image pairs' % nrof_skipped_pairs)
-    
+            path_list += (resolve(pair[0], pair[1]), resolve(pair[2], pair[3]))
+            issame_list.append(False)
     return path_list, issame_list
   
 def add_extension(path):
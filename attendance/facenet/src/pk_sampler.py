@@ -0,0 +1,110 @@
+"""Class-balanced P x K batch sampler for metric learning.
+
+PKSampler flattens a facenet dataset (a list of ImageClass) once into one
+array of image paths with the start offset and size of every class. A batch
+is then drawn with a few vectorized operations: a random permutation of the
+classes, min(size, K) images from each class until the batch holds P * K
+images (classes with fewer than K images contribute all of them and more
+classes are added, as sample_people did), and a per-class shuffle done by
+sorting random keys offset by the class number.
+
+Batch b of a sampler with a seed is drawn from np.random.default_rng([seed, b]),
+so it does not depend on which worker draws it or in which order: batches()
+can spread the work over several threads and still yield the same sequence.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class PKSampler(object):
+    """Draws batches of people_per_batch people x images_per_person images."""
+
+    def __init__(self, dataset, people_per_batch, images_per_person, seed=None):
+        """
+        Args:
+            dataset: List of facenet.ImageClass
+            people_per_batch: P, number of people per batch
+            images_per_person: K, maximum number of images per person
+            seed: Makes every batch reproducible; None draws fresh entropy
+        """
+        self.people_per_batch = people_per_batch
+        self.images_per_person = images_per_person
+        self.batch_size = people_per_batch * images_per_person
+        self.seed = seed
+        self.class_sizes = np.array([len(cls) for cls in dataset], dtype=np.int64)
+        self.class_offsets = np.concatenate([[0], np.cumsum(self.class_sizes)[:-1]]).astype(np.int64)
+        self.image_paths = np.array([path for cls in dataset for path in cls.image_paths], dtype=object)
+        available = int(np.sum(np.minimum(self.class_sizes, images_per_person)))
+        if available < self.batch_size:
+            raise ValueError('The dataset has %d usable images, a batch needs %d (%d people x %d images)' %
+                             (available, self.batch_size, people_per_batch, images_per_person))
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.class_sizes.shape[0]
+
+    def _batch_rng(self, batch_index):
+        if self.seed is None:
+            with self._lock:
+                return np.random.default_rng(self._rng.integers(2**63))
+        return np.random.default_rng([self.seed, batch_index])
+
+    def sample_indices(self, batch_index=None):
+        """Indices into image_paths of one batch, and the number of images of each class.
+
+        Args:
+            batch_index: Batch number; the next one of this sampler if None
+
+        Returns:
+            (indices (P*K,), num_per_class, class_indices) with the images of
+            each sampled class contiguous
+        """
+        if batch_index is None:
+            batch_index = next(self._counter)
+        rng = self._batch_rng(batch_index)
+
+        # Classes in random order until the batch is full
+        classes = rng.permutation(self.class_sizes.shape[0])
+        takes = np.minimum(self.class_sizes[classes], self.images_per_person)
+        filled = np.cumsum(takes)
+        nrof_classes = int(np.searchsorted(filled, self.batch_size)) + 1
+        classes = classes[:nrof_classes]
+        takes = takes[:nrof_classes].copy()
+        takes[-1] -= filled[nrof_classes - 1] - self.batch_size
+
+        # Shuffle the images of every sampled class at once: random keys in
+        # [c, c + 1) for class c keep the classes apart after sorting
+        sizes = self.class_sizes[classes]
+        owner = np.repeat(np.arange(nrof_classes), sizes)
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        within = np.arange(owner.shape[0]) - starts[owner]
+        order = np.argsort(owner + rng.random(owner.shape[0]))
+        keep = within < takes[owner]
+        # Slot k of the sorted order holds image order[k] of class owner[k]
+        indices = (self.class_offsets[classes][owner] + order - starts[owner])[keep]
+        return indices, takes.tolist(), classes
+
+    def sample(self, batch_index=None):
+        """Image paths of one batch and the number of images of each class, like sample_people."""
+        indices, num_per_class, _ = self.sample_indices(batch_index)
+        return self.image_paths[indices].tolist(), num_per_class
+
+    def batches(self, nrof_batches, start=0, nrof_workers=1):
+        """Yields batches start .. start + nrof_batches - 1 in order, drawn by nrof_workers threads."""
+        batch_indices = range(start, start + nrof_batches)
+        if nrof_workers <= 1:
+            for batch_index in batch_indices:
+                yield self.sample(batch_index)
+            return
+        with ThreadPoolExecutor(nrof_workers) as executor:
+            for batch in executor.map(self.sample, batch_indices):
+                yield batch
@@ -0,0 +1,324 @@
+"""Pre-decoded, memory-mapped training shards.
+
+An aligned dataset (one directory per class, as written by
+align_dataset_mtcnn.py) is decoded once and packed into large raw uint8
+files of shape (count, height, width, 3):
+
+    output_dir/
+        shards.json         image shape and the file and count of every shard
+        index.npz           label, shard and row of every image, its original
+                            relative path and the class names
+        shard_00000.u8 ...
+
+ShardReader opens the shards with np.memmap, so reading a batch is a gather
+from the page cache instead of one file open and one JPEG/PNG decode per
+image. Images are addressed by keys 'shard:<dir>#<index>' that take the place
+of the file paths in facenet.get_dataset(), load_data() and
+create_input_pipeline(), so the training, classifier and evaluation scripts
+accept a shard directory wherever they accept an aligned dataset.
+
+write_shards packs an existing aligned dataset; producers that generate the
+images as they go (decode_msceleb_dataset.py) append them to a ShardWriter.
+
+Usage:
+    python shards.py ~/datasets/casia/casia_maxpy_mtcnnalign_182_160 ~/datasets/casia/shards_182
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+META_FILE = 'shards.json'
+INDEX_FILE = 'index.npz'
+PENDING_INDEX_FILE = 'index.tsv'
+KEY_PREFIX = 'shard:'
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def is_shard_dir(path):
+    return os.path.isfile(os.path.join(os.path.expanduser(path), META_FILE))
+
+
+def is_key(path):
+    if isinstance(path, bytes):
+        path = path.decode('utf-8')
+    return path.startswith(KEY_PREFIX)
+
+
+def make_key(directory, index):
+    return '%s%s#%d' % (KEY_PREFIX, directory, index)
+
+
+def parse_key(key):
+    if isinstance(key, bytes):
+        key = key.decode('utf-8')
+    directory, index = key[len(KEY_PREFIX):].rsplit('#', 1)
+    return directory, int(index)
+
+
+def imread(path):
+    """RGB uint8 image of a file (always three channels)."""
+    import cv2
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        raise IOError('Unable to read image "%s"' % path)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def list_dataset(path):
+    """(class names, [(relative path, label)]) with the class order of facenet.get_dataset."""
+    classes = sorted(entry.name for entry in os.scandir(path) if entry.is_dir())
+    images = []
+    for label, name in enumerate(classes):
+        files = sorted(entry.name for entry in os.scandir(os.path.join(path, name)) if entry.is_file())
+        images.extend((os.path.join(name, filename), label) for filename in files)
+    return classes, images
+
+
+def write_shards(input_dir, output_dir, images_per_shard=10000, nrof_workers=8, batch_size=1000):
+    """Decodes every image of input_dir once and packs them into uint8 shards.
+
+    All images must have the same size (align_dataset_mtcnn.py writes
+    image_size x image_size faces).
+
+    Returns:
+        Number of images written
+    """
+    input_dir = os.path.expanduser(input_dir)
+    class_names, images = list_dataset(input_dir)
+    if not images:
+        raise ValueError('No images found in "%s"' % input_dir)
+
+    image_shape = imread(os.path.join(input_dir, images[0][0])).shape
+    writer = ShardWriter(output_dir, image_shape, images_per_shard)
+    with ThreadPoolExecutor(nrof_workers) as executor:
+        for start in range(0, len(images), batch_size):
+            chunk = images[start:start + batch_size]
+            # cv2 releases the GIL while decoding: the threads decode in parallel
+            batch = list(executor.map(imread, [os.path.join(input_dir, rel) for rel, _ in chunk]))
+            for (rel, _), img in zip(chunk, batch):
+                if img.shape != image_shape:
+                    raise ValueError('Image "%s" is %s, expected %s' % (rel, img.shape, image_shape))
+            writer.append(np.stack(batch), [class_names[label] for _, label in chunk],
+                          [os.path.basename(rel) for rel, _ in chunk])
+    # Empty class directories keep their label, as in facenet.get_dataset
+    return writer.close(class_names)
+
+
+class ShardWriter(object):
+    """Appends images to the shards of output_dir, for producers that stream them.
+
+    The class and file name of every image go to a pending index
+    (index.tsv) until close() writes index.npz and shards.json. state()
+    flushes what was written and returns a checkpoint; a ShardWriter created
+    with that state drops anything written after it and continues from there,
+    so a producer that saves the state along with its own progress can resume.
+    """
+
+    def __init__(self, output_dir, image_shape, images_per_shard=10000, state=None):
+        self.output_dir = os.path.expanduser(output_dir)
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        self.image_shape = tuple(image_shape)
+        self.images_per_shard = images_per_shard
+        self.shards = [dict(shard) for shard in state['shards']] if state else []
+        # Not a shard directory until close()
+        if os.path.exists(os.path.join(self.output_dir, META_FILE)):
+            os.remove(os.path.join(self.output_dir, META_FILE))
+        self._index = open(os.path.join(self.output_dir, PENDING_INDEX_FILE), 'ab')
+        self._index.truncate(state['index_bytes'] if state else 0)
+        self._file = None
+        if self.shards and self.shards[-1]['count'] < images_per_shard:
+            self._file = open(os.path.join(self.output_dir, self.shards[-1]['file']), 'ab')
+            self._file.truncate(self.shards[-1]['count'] * int(np.prod(self.image_shape)))
+
+    def __len__(self):
+        return sum(shard['count'] for shard in self.shards)
+
+    def _next_shard(self):
+        if self._file is not None:
+            self._file.close()
+            print('%s: %d images' % (self.shards[-1]['file'], self.shards[-1]['count']))
+        filename = 'shard_%05d.u8' % len(self.shards)
+        self._file = open(os.path.join(self.output_dir, filename), 'wb')
+        self.shards.append({'file': filename, 'count': 0})
+
+    def append(self, images, class_names, filenames):
+        """Appends images (n, height, width, 3) uint8 of the classes class_names, named filenames."""
+        images = np.ascontiguousarray(images, dtype=np.uint8)
+        if images.shape[1:] != self.image_shape:
+            raise ValueError('Images are %s, expected %s' % (images.shape[1:], self.image_shape))
+        pos = 0
+        while pos < images.shape[0]:
+            if self._file is None or self.shards[-1]['count'] >= self.images_per_shard:
+                self._next_shard()
+            take = min(images.shape[0] - pos, self.images_per_shard - self.shards[-1]['count'])
+            self._file.write(images[pos:pos + take].data)
+            self.shards[-1]['count'] += take
+            pos += take
+        lines = ['%s\t%s\n' % (name, os.path.join(name, filename)) for name, filename in zip(class_names, filenames)]
+        self._index.write(''.join(lines).encode('utf-8'))
+
+    def state(self):
+        """Flushes the images appended so far and returns a checkpoint of them."""
+        if self._file is not None:
+            self._file.flush()
+        self._index.flush()
+        return {'shards': [dict(shard) for shard in self.shards], 'index_bytes': self._index.tell()}
+
+    def close(self, class_names=None):
+        """Writes the index and shards.json.
+
+        Args:
+            class_names: All class names in label order; by default the
+                sorted names of the classes that got images
+
+        Returns:
+            Number of images written
+        """
+        if self._file is not None:
+            self._file.close()
+            print('%s: %d images' % (self.shards[-1]['file'], self.shards[-1]['count']))
+            self._file = None
+        self._index.close()
+        index_file = os.path.join(self.output_dir, PENDING_INDEX_FILE)
+        with open(index_file, 'rb') as f:
+            entries = [line.rstrip(b'\n').decode('utf-8').split('\t') for line in f]
+        names = np.array([name for name, _ in entries])
+        class_names = np.array(sorted(set(names.tolist())) if class_names is None else class_names)
+        order = np.argsort(class_names)
+        labels = order[np.searchsorted(class_names[order], names)] if len(names) else np.zeros((0,), np.int64)
+
+        counts = np.array([shard['count'] for shard in self.shards], dtype=np.int64)
+        np.savez(os.path.join(self.output_dir, INDEX_FILE),
+                 labels=labels.astype(np.int32),
+                 shard=np.repeat(np.arange(len(self.shards), dtype=np.int32), counts),
+                 row=np.concatenate([np.arange(c, dtype=np.int32) for c in counts] + [np.zeros((0,), np.int32)]),
+                 paths=np.array([path for _, path in entries]),
+                 class_names=class_names)
+        # Written last: a directory without shards.json is not a shard directory
+        with open(os.path.join(self.output_dir, META_FILE), 'w') as f:
+            json.dump({'image_shape': list(self.image_shape), 'nrof_images': len(entries),
+                       'nrof_classes': len(class_names), 'shards': self.shards}, f, indent=2)
+        os.remove(index_file)
+        return len(entries)
+
+
+class ShardReader(object):
+    """Random access to the images of a shard directory through np.memmap."""
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        with open(os.path.join(self.directory, META_FILE)) as f:
+            meta = json.load(f)
+        self.image_shape = tuple(meta['image_shape'])
+        with np.load(os.path.join(self.directory, INDEX_FILE)) as index:
+            self.labels = index['labels']
+            self.shard_ids = index['shard']
+            self.rows = index['row']
+            self.paths = index['paths']
+            self.class_names = [str(name) for name in index['class_names']]
+        self._shards = meta['shards']
+        self._maps = [None] * len(self._shards)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.labels.shape[0]
+
+    def _map(self, shard_id):
+        data = self._maps[shard_id]
+        if data is None:
+            with self._lock:
+                data = self._maps[shard_id]
+                if data is None:
+                    shard = self._shards[shard_id]
+                    data = np.memmap(os.path.join(self.directory, shard['file']), dtype=np.uint8, mode='r',
+                                     shape=(shard['count'],) + self.image_shape)
+                    self._maps[shard_id] = data
+        return data
+
+    def image(self, index):
+        return np.array(self._map(self.shard_ids[index])[self.rows[index]])
+
+    def images(self, indices):
+        """(n, height, width, 3) uint8 array with the images of indices, in that order."""
+        indices = np.asarray(indices, dtype=np.int64)
+        out = np.empty((indices.shape[0],) + self.image_shape, dtype=np.uint8)
+        shard_ids = self.shard_ids[indices]
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            out[mask] = self._map(shard_id)[self.rows[indices[mask]]]
+        return out
+
+    def keys(self, indices=None):
+        if indices is None:
+            indices = range(len(self))
+        return [make_key(self.directory, i) for i in indices]
+
+    def key_of(self):
+        """Dict from relative path (e.g. 'Name/Name_0001.png') to image key."""
+        return dict(zip((str(p) for p in self.paths), self.keys()))
+
+    def dataset(self, image_class):
+        """List of image_class(name, keys), one per class, like facenet.get_dataset."""
+        order = np.argsort(self.labels, kind='stable')
+        bounds = np.searchsorted(self.labels[order], np.arange(len(self.class_names) + 1))
+        return [image_class(name, self.keys(order[bounds[i]:bounds[i + 1]]))
+                for i, name in enumerate(self.class_names)]
+
+
+def open_shards(directory):
+    """ShardReader of directory, shared by all callers of the process."""
+    directory = os.path.abspath(os.path.expanduser(directory))
+    reader = _readers.get(directory)
+    if reader is None:
+        with _readers_lock:
+            reader = _readers.get(directory)
+            if reader is None:
+                reader = _readers[directory] = ShardReader(directory)
+    return reader
+
+
+def read_image(path):
+    """Image of a shard key or of a regular file, as an RGB uint8 array.
+
+    Used through tf.py_func by facenet.create_input_pipeline, so it gets bytes.
+    """
+    if isinstance(path, bytes):
+        path = path.decode('utf-8')
+    if is_key(path):
+        directory, index = parse_key(path)
+        return open_shards(directory).image(index)
+    return imread(path)
+
+
+def main(args):
+    nrof_images = write_shards(args.input_dir, args.output_dir, args.images_per_shard, args.nrof_workers)
+    print('Wrote %d images to %s' % (nrof_images, args.output_dir))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input_dir', type=str,
+        help='Directory with aligned face thumbnails, one subdirectory per class.')
+    parser.add_argument('output_dir', type=str,
+        help='Directory where the shards are written.')
+    parser.add_argument('--images_per_shard', type=int,
+        help='Number of images in each shard file.', default=10000)
+    parser.add_argument('--nrof_workers', type=int,
+        help='Number of decoding threads.', default=8)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
@@ -0,0 +1,122 @@
+"""Appendable HDF5 log of training statistics (stat.h5).
+
+train_softmax.py used to keep every statistic in a preallocated array
+(one value per training step, a 1000 bin histogram per epoch, ...) and
+rewrote the whole stat.h5 file at the end of every epoch. StatsLogger
+declares the statistics once as chunked datasets that grow with the run:
+values are buffered in memory and only the new rows are written when the
+buffer is flushed, so the I/O per epoch does not grow with the length of
+the run.
+
+The file is written in HDF5 single-writer/multiple-reader (SWMR) mode: it
+can be read while training runs, with read_stats() or
+
+    python stats_logger.py ~/logs/facenet/20180402-114759/stat.h5
+
+Rows that were never logged (steps without statistics, epochs without
+validation) read as NaN.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import sys
+
+import h5py
+import numpy as np
+
+CHUNK_BYTES = 1 << 16
+
+
+class StatsLogger(object):
+    """Buffered writer of resizable statistics datasets.
+
+    Args:
+        filename: HDF5 file, overwritten
+        fields: Dict of statistic name to the shape of one row, e.g.
+            {'loss': (), 'prelogits_hist': (1000,)}
+        flush_every: Buffered rows (over all statistics) that trigger a flush
+        dtype: Type of all the statistics
+    """
+
+    def __init__(self, filename, fields, flush_every=1000, dtype=np.float32):
+        self.filename = filename
+        self.flush_every = flush_every
+        self._file = h5py.File(filename, 'w', libver='latest')
+        for name, row_shape in fields.items():
+            row_shape = tuple(row_shape)
+            row_bytes = int(np.prod(row_shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+            chunk_rows = max(1, CHUNK_BYTES // row_bytes)
+            self._file.create_dataset(name, shape=(0,) + row_shape, maxshape=(None,) + row_shape,
+                                      chunks=(chunk_rows,) + row_shape, dtype=dtype, fillvalue=np.nan)
+        # No dataset can be added from here on, but readers can open the file
+        self._file.swmr_mode = True
+        self._pending = dict((name, {}) for name in fields)
+        self._nrof_pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def log(self, name, index, value):
+        """Sets row index of statistic name, replacing any earlier value of that row."""
+        pending = self._pending[name]
+        if index not in pending:
+            self._nrof_pending += 1
+        pending[index] = value
+        if self._nrof_pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered rows, one slice per run of consecutive rows."""
+        for name, pending in self._pending.items():
+            if not pending:
+                continue
+            dataset = self._file[name]
+            indices = np.array(sorted(pending))
+            values = np.array([pending[i] for i in indices.tolist()], dtype=dataset.dtype)
+            if indices[-1] >= dataset.shape[0]:
+                dataset.resize(indices[-1] + 1, axis=0)
+            runs = np.split(np.arange(len(indices)), np.flatnonzero(np.diff(indices) != 1) + 1)
+            for run in runs:
+                dataset[indices[run[0]]:indices[run[-1]] + 1] = values[run[0]:run[-1] + 1]
+            pending.clear()
+        self._nrof_pending = 0
+        self._file.flush()
+
+    def close(self):
+        if self._file.id.valid:
+            self.flush()
+            self._file.close()
+
+
+def read_stats(filename):
+    """Dict of statistic name to array, also while the file is being written."""
+    with h5py.File(filename, 'r', libver='latest', swmr=True) as f:
+        return dict((name, f[name][()]) for name in f)
+
+
+def main(args):
+    stats = read_stats(args.stat_file)
+    for name in sorted(stats):
+        values = stats[name]
+        logged = ~np.isnan(values.reshape(len(values), -1)).all(axis=1)
+        if values.ndim == 1 and logged.any():
+            last = '%g' % values[np.flatnonzero(logged)[-1]]
+        else:
+            last = '-'
+        print('%-16s %8d rows  %8d logged  last %s' % (name, len(values), np.count_nonzero(logged), last))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('stat_file', type=str,
+        help='Statistics file written by train_softmax.py (stat.h5 in the log directory).')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
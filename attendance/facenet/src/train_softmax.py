@@ -37,8 +37,9 @@ import importlib
 import argparse
 import facenet
 import lfw
-import h5py
-import math
+import shards
+import dataset_filter
+import stats_logger
 import tensorflow.contrib.slim as slim
 from tensorflow.python.ops import data_flow_ops
 from tensorflow.python.framework import ops
@@ -68,7 +69,7 @@ def main(args):
 
     np.random.seed(seed=args.seed)
     random.seed(args.seed)
-    dataset = facenet.get_dataset(args.data_dir)
+    dataset = facenet.get_dataset(args.data_dir, manifest_file=args.manifest_file)
     if args.filter_filename:
         dataset = filter_dataset(dataset, os.path.expanduser(args.filter_filename), 
             args.filter_percentile, args.filter_min_nrof_images_per_class)
@@ -119,13 +120,15 @@ def main(args):
         labels_placeholder = tf.placeholder(tf.int32, shape=(None,1), name='labels')
         control_placeholder = tf.placeholder(tf.int32, shape=(None,1), name='control')
         
-        nrof_preprocess_threads = 4
         input_queue = data_flow_ops.FIFOQueue(capacity=2000000,
                                     dtypes=[tf.string, tf.int32, tf.int32],
                                     shapes=[(1,), (1,), (1,)],
                                     shared_name=None, name=None)
         enqueue_op = input_queue.enqueue_many([image_paths_placeholder, labels_placeholder, control_placeholder], name='enqueue_op')
-        image_batch, label_batch = facenet.create_input_pipeline(input_queue, image_size, nrof_preprocess_threads, batch_size_placeholder)
+        # Shard directories are read through np.memmap instead of one file per image
+        from_shards = shards.is_shard_dir(args.data_dir) or bool(args.lfw_dir and shards.is_shard_dir(args.lfw_dir))
+        image_batch, label_batch = facenet.create_input_pipeline(input_queue, image_size, args.nrof_preprocess_threads,
+            batch_size_placeholder, from_shards)
 
         image_batch = tf.identity(image_batch, 'image_batch')
         image_batch = tf.identity(image_batch, 'input')
@@ -150,6 +153,10 @@ def main(args):
 
         embeddings = tf.nn.l2_normalize(prelogits, 1, 1e-10, name='embeddings')
 
+        # Histogram of the prelogits computed in the graph: only the 1000 counts are fetched
+        prelogits_hist = tf.histogram_fixed_width(tf.minimum(tf.abs(prelogits), args.prelogits_hist_max),
+            [0.0, args.prelogits_hist_max], nbins=1000)
+
         # Norm for the prelogits
         eps = 1e-4
         prelogits_norm = tf.reduce_mean(tf.norm(tf.abs(prelogits)+eps, ord=args.prelogits_norm_p, axis=1))
@@ -187,8 +194,8 @@ def main(args):
         summary_op = tf.summary.merge_all()
 
         # Start running operations on the Graph.
-        gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=args.gpu_memory_fraction)
-        sess = tf.Session(config=tf.ConfigProto(gpu_options=gpu_options, log_device_placement=False))
+        sess = tf.Session(config=facenet.session_config(args.gpu_memory_fraction, args.intra_op_threads,
+            args.inter_op_threads, args.precision))
         sess.run(tf.global_variables_initializer())
         sess.run(tf.local_variables_initializer())
         summary_writer = tf.summary.FileWriter(log_dir, sess.graph)
@@ -203,26 +210,26 @@ def main(args):
 
             # Training and validation loop
             print('Running training')
-            nrof_steps = args.max_nrof_epochs*args.epoch_size
-            nrof_val_samples = int(math.ceil(args.max_nrof_epochs / args.validate_every_n_epochs))   # Validate every validate_every_n_epochs as well as in the last epoch
-            stat = {
-                'loss': np.zeros((nrof_steps,), np.float32),
-                'center_loss': np.zeros((nrof_steps,), np.float32),
-                'reg_loss': np.zeros((nrof_steps,), np.float32),
-                'xent_loss': np.zeros((nrof_steps,), np.float32),
-                'prelogits_norm': np.zeros((nrof_steps,), np.float32),
-                'accuracy': np.zeros((nrof_steps,), np.float32),
-                'val_loss': np.zeros((nrof_val_samples,), np.float32),
-                'val_xent_loss': np.zeros((nrof_val_samples,), np.float32),
-                'val_accuracy': np.zeros((nrof_val_samples,), np.float32),
-                'lfw_accuracy': np.zeros((args.max_nrof_epochs,), np.float32),
-                'lfw_valrate': np.zeros((args.max_nrof_epochs,), np.float32),
-                'learning_rate': np.zeros((args.max_nrof_epochs,), np.float32),
-                'time_train': np.zeros((args.max_nrof_epochs,), np.float32),
-                'time_validate': np.zeros((args.max_nrof_epochs,), np.float32),
-                'time_evaluate': np.zeros((args.max_nrof_epochs,), np.float32),
-                'prelogits_hist': np.zeros((args.max_nrof_epochs, 1000), np.float32),
-              }
+            # Appended to stat.h5 as training goes, see stats_logger.py
+            stat = stats_logger.StatsLogger(stat_file_name, {
+                'loss': (),
+                'center_loss': (),
+                'reg_loss': (),
+                'xent_loss': (),
+                'prelogits_norm': (),
+                'accuracy': (),
+                'val_loss': (),
+                'val_xent_loss': (),
+                'val_accuracy': (),
+                'lfw_accuracy': (),
+                'lfw_valrate': (),
+                'learning_rate': (),
+                'time_train': (),
+                'images_per_sec': (),
+                'time_validate': (),
+                'time_evaluate': (),
+                'prelogits_hist': (1000,),
+              })
             for epoch in range(1,args.max_nrof_epochs+1):
                 step = sess.run(global_step, feed_dict=None)
                 # Train for one epoch
@@ -231,8 +238,8 @@ def main(args):
                     learning_rate_placeholder, phase_train_placeholder, batch_size_placeholder, control_placeholder, global_step, 
                     total_loss, train_op, summary_op, summary_writer, regularization_losses, args.learning_rate_schedule_file,
                     stat, cross_entropy_mean, accuracy, learning_rate,
-                    prelogits, prelogits_center_loss, args.random_rotate, args.random_crop, args.random_flip, prelogits_norm, args.prelogits_hist_max, args.use_fixed_image_standardization)
-                stat['time_train'][epoch-1] = time.time() - t
+                    prelogits_hist, prelogits_center_loss, args.random_rotate, args.random_crop, args.random_flip, prelogits_norm, args.use_fixed_image_standardization)
+                stat.log('time_train', epoch-1, time.time() - t)
                 
                 if not cont:
                     break
@@ -242,7 +249,7 @@ def main(args):
                     validate(args, sess, epoch, val_image_list, val_label_list, enqueue_op, image_paths_placeholder, labels_placeholder, control_placeholder,
                         phase_train_placeholder, batch_size_placeholder, 
                         stat, total_loss, regularization_losses, cross_entropy_mean, accuracy, args.validate_every_n_epochs, args.use_fixed_image_standardization)
-                stat['time_validate'][epoch-1] = time.time() - t
+                stat.log('time_validate', epoch-1, time.time() - t)
 
                 # Save variables and the metagraph if it doesn't exist already
                 save_variables_and_metagraph(sess, saver, summary_writer, model_dir, subdir, epoch)
@@ -253,51 +260,26 @@ def main(args):
                     evaluate(sess, enqueue_op, image_paths_placeholder, labels_placeholder, phase_train_placeholder, batch_size_placeholder, control_placeholder, 
                         embeddings, label_batch, lfw_paths, actual_issame, args.lfw_batch_size, args.lfw_nrof_folds, log_dir, step, summary_writer, stat, epoch, 
                         args.lfw_distance_metric, args.lfw_subtract_mean, args.lfw_use_flipped_images, args.use_fixed_image_standardization)
-                stat['time_evaluate'][epoch-1] = time.time() - t
+                stat.log('time_evaluate', epoch-1, time.time() - t)
 
-                print('Saving statistics')
-                with h5py.File(stat_file_name, 'w') as f:
-                    for key, value in stat.iteritems():
-                        f.create_dataset(key, data=value)
+                stat.flush()
+            stat.close()
     
     return model_dir
   
 def find_threshold(var, percentile):
-    hist, bin_edges = np.histogram(var, 100)
-    cdf = np.float32(np.cumsum(hist)) / np.sum(hist)
-    bin_centers = (bin_edges[:-1]+bin_edges[1:])/2
-    #plt.plot(bin_centers, cdf)
-    threshold = np.interp(percentile*0.01, cdf, bin_centers)
-    return threshold
+    return dataset_filter.find_threshold(var, percentile)
   
 def filter_dataset(dataset, data_filename, percentile, min_nrof_images_per_class):
-    with h5py.File(data_filename,'r') as f:
-        distance_to_center = np.array(f.get('distance_to_center'))
-        label_list = np.array(f.get('label_list'))
-        image_list = np.array(f.get('image_list'))
-        distance_to_center_threshold = find_threshold(distance_to_center, percentile)
-        indices = np.where(distance_to_center>=distance_to_center_threshold)[0]
-        filtered_dataset = dataset
-        removelist = []
-        for i in indices:
-            label = label_list[i]
-            image = image_list[i]
-            if image in filtered_dataset[label].image_paths:
-                filtered_dataset[label].image_paths.remove(image)
-            if len(filtered_dataset[label].image_paths)<min_nrof_images_per_class:
-                removelist.append(label)
-
-        ix = sorted(list(set(removelist)), reverse=True)
-        for i in ix:
-            del(filtered_dataset[i])
-
-    return filtered_dataset
+    # Vectorized over the whole dataset and cached next to data_filename, see dataset_filter.py
+    return dataset_filter.filter_dataset(dataset, data_filename, percentile, min_nrof_images_per_class,
+        facenet.ImageClass)
   
 def train(args, sess, epoch, image_list, label_list, index_dequeue_op, enqueue_op, image_paths_placeholder, labels_placeholder, 
       learning_rate_placeholder, phase_train_placeholder, batch_size_placeholder, control_placeholder, step, 
       loss, train_op, summary_op, summary_writer, reg_losses, learning_rate_schedule_file, 
       stat, cross_entropy_mean, accuracy, 
-      learning_rate, prelogits, prelogits_center_loss, random_rotate, random_crop, random_flip, prelogits_norm, prelogits_hist_max, use_fixed_image_standardization):
+      learning_rate, prelogits_hist, prelogits_center_loss, random_rotate, random_crop, random_flip, prelogits_norm, use_fixed_image_standardization):
     batch_number = 0
     
     if args.learning_rate>0.0:
@@ -321,35 +303,47 @@ def train(args, sess, epoch, image_list, label_list, index_dequeue_op, enqueue_o
 
     # Training loop
     train_time = 0
+    prelogits_hist_epoch = np.zeros((1000,), np.float32)
     while batch_number < args.epoch_size:
         start_time = time.time()
         feed_dict = {learning_rate_placeholder: lr, phase_train_placeholder:True, batch_size_placeholder:args.batch_size}
-        tensor_list = [loss, train_op, step, reg_losses, prelogits, cross_entropy_mean, learning_rate, prelogits_norm, accuracy, prelogits_center_loss]
-        if batch_number % 100 == 0:
-            loss_, _, step_, reg_losses_, prelogits_, cross_entropy_mean_, lr_, prelogits_norm_, accuracy_, center_loss_, summary_str = sess.run(tensor_list + [summary_op], feed_dict=feed_dict)
-            summary_writer.add_summary(summary_str, global_step=step_)
+        write_summary = batch_number % 100 == 0
+        # The diagnostic scalars are fetched every stats_every_n_steps steps (and with the summaries);
+        # the other steps only run the train op and are left as NaN in the stat file.
+        if write_summary or batch_number % args.stats_every_n_steps == 0:
+            tensor_list = [loss, train_op, step, reg_losses, prelogits_hist, cross_entropy_mean, learning_rate, prelogits_norm, accuracy, prelogits_center_loss]
+            if write_summary:
+                loss_, _, step_, reg_losses_, prelogits_hist_, cross_entropy_mean_, lr_, prelogits_norm_, accuracy_, center_loss_, summary_str = sess.run(tensor_list + [summary_op], feed_dict=feed_dict)
+                summary_writer.add_summary(summary_str, global_step=step_)
+            else:
+                loss_, _, step_, reg_losses_, prelogits_hist_, cross_entropy_mean_, lr_, prelogits_norm_, accuracy_, center_loss_ = sess.run(tensor_list, feed_dict=feed_dict)
+
+            stat.log('loss', step_-1, loss_)
+            stat.log('center_loss', step_-1, center_loss_)
+            stat.log('reg_loss', step_-1, np.sum(reg_losses_))
+            stat.log('xent_loss', step_-1, cross_entropy_mean_)
+            stat.log('prelogits_norm', step_-1, prelogits_norm_)
+            stat.log('learning_rate', epoch-1, lr_)
+            stat.log('accuracy', step_-1, accuracy_)
+            prelogits_hist_epoch += prelogits_hist_
+
+            duration = time.time() - start_time
+            print('Epoch: [%d][%d/%d]\tTime %.3f\tLoss %2.3f\tXent %2.3f\tRegLoss %2.3f\tAccuracy %2.3f\tLr %2.5f\tCl %2.3f' %
+                  (epoch, batch_number+1, args.epoch_size, duration, loss_, cross_entropy_mean_, np.sum(reg_losses_), accuracy_, lr_, center_loss_))
         else:
-            loss_, _, step_, reg_losses_, prelogits_, cross_entropy_mean_, lr_, prelogits_norm_, accuracy_, center_loss_ = sess.run(tensor_list, feed_dict=feed_dict)
-         
-        duration = time.time() - start_time
-        stat['loss'][step_-1] = loss_
-        stat['center_loss'][step_-1] = center_loss_
-        stat['reg_loss'][step_-1] = np.sum(reg_losses_)
-        stat['xent_loss'][step_-1] = cross_entropy_mean_
-        stat['prelogits_norm'][step_-1] = prelogits_norm_
-        stat['learning_rate'][epoch-1] = lr_
-        stat['accuracy'][step_-1] = accuracy_
-        stat['prelogits_hist'][epoch-1,:] += np.histogram(np.minimum(np.abs(prelogits_), prelogits_hist_max), bins=1000, range=(0.0, prelogits_hist_max))[0]
-        
-        duration = time.time() - start_time
-        print('Epoch: [%d][%d/%d]\tTime %.3f\tLoss %2.3f\tXent %2.3f\tRegLoss %2.3f\tAccuracy %2.3f\tLr %2.5f\tCl %2.3f' %
-              (epoch, batch_number+1, args.epoch_size, duration, loss_, cross_entropy_mean_, np.sum(reg_losses_), accuracy_, lr_, center_loss_))
+            _, step_ = sess.run([train_op, step], feed_dict=feed_dict)
+            duration = time.time() - start_time
         batch_number += 1
         train_time += duration
+    images_per_sec = args.batch_size * batch_number / max(train_time, 1e-6)
+    stat.log('images_per_sec', epoch-1, images_per_sec)
+    stat.log('prelogits_hist', epoch-1, prelogits_hist_epoch)
+    print('Epoch: [%d]\tTrain time %.1f s\t%.1f images/sec' % (epoch, train_time, images_per_sec))
     # Add validation loss and accuracy to summary
     summary = tf.Summary()
     #pylint: disable=maybe-no-member
     summary.value.add(tag='time/total', simple_value=train_time)
+    summary.value.add(tag='time/images_per_sec', simple_value=images_per_sec)
     summary_writer.add_summary(summary, global_step=step_)
     return True
 
@@ -386,9 +380,9 @@ def validate(args, sess, epoch, image_list, label_list, enqueue_op, image_paths_
     duration = time.time() - start_time
 
     val_index = (epoch-1)//validate_every_n_epochs
-    stat['val_loss'][val_index] = np.mean(loss_array)
-    stat['val_xent_loss'][val_index] = np.mean(xent_array)
-    stat['val_accuracy'][val_index] = np.mean(accuracy_array)
+    stat.log('val_loss', val_index, np.mean(loss_array))
+    stat.log('val_xent_loss', val_index, np.mean(xent_array))
+    stat.log('val_accuracy', val_index, np.mean(accuracy_array))
 
     print('Validation Epoch: %d\tTime %.3f\tLoss %2.3f\tXent %2.3f\tAccuracy %2.3f' %
           (epoch, duration, np.mean(loss_array), np.mean(xent_array), np.mean(accuracy_array)))
@@ -451,8 +445,8 @@ def evaluate(sess, enqueue_op, image_paths_placeholder, labels_placeholder, phas
     summary_writer.add_summary(summary, step)
     with open(os.path.join(log_dir,'lfw_result.txt'),'at') as f:
         f.write('%d\t%.5f\t%.5f\n' % (step, np.mean(accuracy), val))
-    stat['lfw_accuracy'][epoch-1] = np.mean(accuracy)
-    stat['lfw_valrate'][epoch-1] = val
+    stat.log('lfw_accuracy', epoch-1, np.mean(accuracy))
+    stat.log('lfw_valrate', epoch-1, val)
 
 def save_variables_and_metagraph(sess, saver, summary_writer, model_dir, model_name, step):
     # Save the model checkpoint
@@ -491,6 +485,9 @@ def parse_arguments(argv):
     parser.add_argument('--data_dir', type=str,
         help='Path to the data directory containing aligned face patches.',
         default='~/datasets/casia/casia_maxpy_mtcnnalign_182_160')
+    parser.add_argument('--manifest_file', type=str,
+        help='Keep the dataset listing in this manifest and only list the class directories that changed '
+        '(see dataset_manifest.py; images rewritten in place need dataset_manifest.py --rescan).', default=None)
     parser.add_argument('--model_def', type=str,
         help='Model definition. Points to a module containing the definition of the inference graph.', default='models.inception_resnet_v1')
     parser.add_argument('--max_nrof_epochs', type=int,
@@ -541,6 +538,15 @@ def parse_arguments(argv):
         help='Random seed.', default=666)
     parser.add_argument('--nrof_preprocess_threads', type=int,
         help='Number of preprocessing (data loading and augmentation) threads.', default=4)
+    parser.add_argument('--intra_op_threads', type=int,
+        help='Threads used inside one op (e.g. a convolution). 0 lets TensorFlow choose.', default=0)
+    parser.add_argument('--inter_op_threads', type=int,
+        help='Threads used to run independent ops in parallel. 0 lets TensorFlow choose.', default=0)
+    parser.add_argument('--precision', type=str, choices=['float32', 'bfloat16'],
+        help='bfloat16 runs the convolutions and matmuls in bfloat16 (mixed precision, variables stay float32). ' +
+        'Only faster on CPUs with native bfloat16 support.', default='float32')
+    parser.add_argument('--stats_every_n_steps', type=int,
+        help='Fetch the loss, accuracy and prelogits statistics every n training steps only.', default=1)
     parser.add_argument('--log_histograms', 
         help='Enables logging of weight/bias histograms in tensorboard.', action='store_true')
     parser.add_argument('--learning_rate_schedule_file', type=str,
@@ -573,7 +579,10 @@ def parse_arguments(argv):
         help='Concatenates embeddings for the image and its horizontally flipped counterpart.', action='store_true')
     parser.add_argument('--lfw_subtract_mean', 
         help='Subtract feature mean before calculating distance.', action='store_true')
-    return parser.parse_args(argv)
+    args = parser.parse_args(argv)
+    if args.stats_every_n_steps < 1:
+        parser.error('--stats_every_n_steps must be at least 1')
+    return args
   
 
 if __name__ == '__main__':
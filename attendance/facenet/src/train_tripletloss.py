@@ -38,6 +38,10 @@ import itertools
 import argparse
 import facenet
 import lfw
+import triplet_selection
+import embedding_bank
+import pk_sampler
+import shards
 
 from tensorflow.python.ops import data_flow_ops
 
@@ -63,7 +67,13 @@ def main(args):
     facenet.store_revision_info(src_path, log_dir, ' '.join(sys.argv))
 
     np.random.seed(seed=args.seed)
-    train_set = facenet.get_dataset(args.data_dir)
+    train_set = facenet.get_dataset(args.data_dir, manifest_file=args.manifest_file)
+    # Per-class image indices are computed once for the whole run
+    sampler = pk_sampler.PKSampler(train_set, args.people_per_batch, args.images_per_person, seed=args.seed)
+    bank = None
+    if args.embedding_bank_max_age > 0:
+        bank = embedding_bank.EmbeddingBank(np.repeat(np.arange(len(sampler)), sampler.class_sizes),
+            args.embedding_size, args.embedding_bank_max_age)
     
     print('Model directory: %s' % model_dir)
     print('Log directory: %s' % log_dir)
@@ -99,13 +109,14 @@ def main(args):
         enqueue_op = input_queue.enqueue_many([image_paths_placeholder, labels_placeholder])
         
         nrof_preprocess_threads = 4
+        # Shard directories are read through np.memmap instead of one file per image
+        from_shards = shards.is_shard_dir(args.data_dir) or bool(args.lfw_dir and shards.is_shard_dir(args.lfw_dir))
         images_and_labels = []
         for _ in range(nrof_preprocess_threads):
             filenames, label = input_queue.dequeue()
             images = []
             for filename in tf.unstack(filenames):
-                file_contents = tf.read_file(filename)
-                image = tf.image.decode_image(file_contents, channels=3)
+                image = facenet.read_image_op(filename, from_shards)
                 
                 if args.random_crop:
                     image = tf.random_crop(image, [args.image_size, args.image_size, 3])
@@ -180,10 +191,10 @@ def main(args):
                 step = sess.run(global_step, feed_dict=None)
                 epoch = step // args.epoch_size
                 # Train for one epoch
-                train(args, sess, train_set, epoch, image_paths_placeholder, labels_placeholder, labels_batch,
+                train(args, sess, sampler, epoch, image_paths_placeholder, labels_placeholder, labels_batch,
                     batch_size_placeholder, learning_rate_placeholder, phase_train_placeholder, enqueue_op, input_queue, global_step, 
                     embeddings, total_loss, train_op, summary_op, summary_writer, args.learning_rate_schedule_file,
-                    args.embedding_size, anchor, positive, negative, triplet_loss)
+                    args.embedding_size, anchor, positive, negative, triplet_loss, bank)
 
                 # Save variables and the metagraph if it doesn't exist already
                 save_variables_and_metagraph(sess, saver, summary_writer, model_dir, subdir, step)
@@ -197,46 +208,60 @@ def main(args):
     return model_dir
 
 
-def train(args, sess, dataset, epoch, image_paths_placeholder, labels_placeholder, labels_batch,
+def train(args, sess, sampler, epoch, image_paths_placeholder, labels_placeholder, labels_batch,
           batch_size_placeholder, learning_rate_placeholder, phase_train_placeholder, enqueue_op, input_queue, global_step, 
           embeddings, loss, train_op, summary_op, summary_writer, learning_rate_schedule_file,
-          embedding_size, anchor, positive, negative, triplet_loss):
+          embedding_size, anchor, positive, negative, triplet_loss, bank=None):
     batch_number = 0
     
     if args.learning_rate>0.0:
         lr = args.learning_rate
     else:
         lr = facenet.get_learning_rate_from_file(learning_rate_schedule_file, epoch)
+    if bank is not None:
+        bank_step = sess.run(global_step)
     while batch_number < args.epoch_size:
-        # Sample people randomly from the dataset
-        image_paths, num_per_class = sample_people(dataset, args.people_per_batch, args.images_per_person)
-        
-        print('Running forward pass on sampled images: ', end='')
-        start_time = time.time()
-        nrof_examples = args.people_per_batch * args.images_per_person
-        labels_array = np.reshape(np.arange(nrof_examples),(-1,3))
-        image_paths_array = np.reshape(np.expand_dims(np.array(image_paths),1), (-1,3))
-        sess.run(enqueue_op, {image_paths_placeholder: image_paths_array, labels_placeholder: labels_array})
-        emb_array = np.zeros((nrof_examples, embedding_size))
-        nrof_batches = int(np.ceil(nrof_examples / args.batch_size))
-        for i in range(nrof_batches):
-            batch_size = min(nrof_examples-i*args.batch_size, args.batch_size)
-            emb, lab = sess.run([embeddings, labels_batch], feed_dict={batch_size_placeholder: batch_size, 
-                learning_rate_placeholder: lr, phase_train_placeholder: True})
-            emb_array[lab,:] = emb
-        print('%.3f' % (time.time()-start_time))
-
-        # Select triplets based on the embeddings
-        print('Selecting suitable triplets for training')
-        triplets, nrof_random_negs, nrof_triplets = select_triplets(emb_array, num_per_class, 
-            image_paths, args.people_per_batch, args.alpha)
+        if bank is None:
+            # Sample people randomly from the dataset
+            image_paths, num_per_class = sampler.sample()
+            
+            print('Running forward pass on sampled images: ', end='')
+            start_time = time.time()
+            emb_array = forward_pass(args, sess, image_paths, image_paths_placeholder, labels_placeholder, labels_batch,
+                batch_size_placeholder, learning_rate_placeholder, phase_train_placeholder, enqueue_op, embeddings, lr, embedding_size)
+            print('%.3f' % (time.time()-start_time))
+
+            # Select triplets based on the embeddings
+            print('Selecting suitable triplets for training')
+            triplets, nrof_random_negs, nrof_triplets = select_triplets(emb_array, num_per_class, 
+                image_paths, args.people_per_batch, args.alpha, args.triplet_selection)
+            triplet_paths = list(itertools.chain(*triplets))
+        else:
+            # Only the sampled images without a recent embedding in the bank are embedded again
+            indices, _, _ = sampler.sample_indices()
+            stale = bank.stale_indices(indices, bank_step)
+            print('Running forward pass on %d of %d sampled images: ' % (len(stale), len(indices)), end='')
+            start_time = time.time()
+            if len(stale) > 0:
+                bank.update(stale, forward_pass(args, sess, sampler.image_paths[stale].tolist(), image_paths_placeholder,
+                    labels_placeholder, labels_batch, batch_size_placeholder, learning_rate_placeholder, phase_train_placeholder,
+                    enqueue_op, embeddings, lr, embedding_size), bank_step)
+            print('%.3f' % (time.time()-start_time))
+
+            # Negatives are mined in the batch and in the rest of the bank
+            print('Selecting suitable triplets for training')
+            anchors, positives, negatives, nrof_random_negs = bank.select_triplet_indices(indices, bank_step,
+                args.alpha, args.triplet_selection, args.embedding_bank_negatives)
+            perm = np.random.permutation(anchors.shape[0])
+            triplet_indices = np.stack([anchors[perm], positives[perm], negatives[perm]], axis=1).ravel()
+            triplet_paths = sampler.image_paths[triplet_indices].tolist()
+            nrof_triplets = anchors.shape[0]
         selection_time = time.time() - start_time
         print('(nrof_random_negs, nrof_triplets) = (%d, %d): time=%.3f seconds' % 
             (nrof_random_negs, nrof_triplets, selection_time))
 
         # Perform training on the selected triplets
         nrof_batches = int(np.ceil(nrof_triplets*3/args.batch_size))
-        triplet_paths = list(itertools.chain(*triplets))
         labels_array = np.reshape(np.arange(len(triplet_paths)),(-1,3))
         triplet_paths_array = np.reshape(np.expand_dims(np.array(triplet_paths),1), (-1,3))
         sess.run(enqueue_op, {image_paths_placeholder: triplet_paths_array, labels_placeholder: labels_array})
@@ -253,6 +278,11 @@ def train(args, sess, dataset, epoch, image_paths_placeholder, labels_placeholde
             feed_dict = {batch_size_placeholder: batch_size, learning_rate_placeholder: lr, phase_train_placeholder: True}
             err, _, step, emb, lab = sess.run([loss, train_op, global_step, embeddings, labels_batch], feed_dict=feed_dict)
             emb_array[lab,:] = emb
+            if bank is not None:
+                # The training pass embeds the triplet images anyway, with the
+                # weights from before this step's update
+                bank.update(triplet_indices[lab], emb, step - 1)
+                bank_step = step
             loss_array[i] = err
             duration = time.time() - start_time
             print('Epoch: [%d][%d/%d]\tTime %.3f\tLoss %2.3f' %
@@ -267,76 +297,39 @@ def train(args, sess, dataset, epoch, image_paths_placeholder, labels_placeholde
         summary.value.add(tag='time/selection', simple_value=selection_time)
         summary_writer.add_summary(summary, step)
     return step
+
+def forward_pass(args, sess, image_paths, image_paths_placeholder, labels_placeholder, labels_batch,
+                 batch_size_placeholder, learning_rate_placeholder, phase_train_placeholder, enqueue_op, embeddings, lr, embedding_size):
+    """Embeddings of image_paths, run through the training input queue."""
+    nrof_images = len(image_paths)
+    # The queue takes the images three by three: pad with copies of the last image
+    nrof_examples = int(np.ceil(nrof_images / 3.0)) * 3
+    image_paths = list(image_paths) + [image_paths[-1]] * (nrof_examples - nrof_images)
+    labels_array = np.reshape(np.arange(nrof_examples),(-1,3))
+    image_paths_array = np.reshape(np.expand_dims(np.array(image_paths),1), (-1,3))
+    sess.run(enqueue_op, {image_paths_placeholder: image_paths_array, labels_placeholder: labels_array})
+    emb_array = np.zeros((nrof_examples, embedding_size))
+    nrof_batches = int(np.ceil(nrof_examples / args.batch_size))
+    for i in range(nrof_batches):
+        batch_size = min(nrof_examples-i*args.batch_size, args.batch_size)
+        emb, lab = sess.run([embeddings, labels_batch], feed_dict={batch_size_placeholder: batch_size, 
+            learning_rate_placeholder: lr, phase_train_placeholder: True})
+        emb_array[lab,:] = emb
+    return emb_array[:nrof_images]
   
-def select_triplets(embeddings, nrof_images_per_class, image_paths, people_per_batch, alpha):
+def select_triplets(embeddings, nrof_images_per_class, image_paths, people_per_batch, alpha, mode='vgg'):
     """ Select the triplets for training
     """
-    trip_idx = 0
-    emb_start_idx = 0
-    num_trips = 0
-    triplets = []
-    
     # VGG Face: Choosing good triplets is crucial and should strike a balance between
     #  selecting informative (i.e. challenging) examples and swamping training with examples that
     #  are too hard. This is achieve by extending each pair (a, p) to a triplet (a, p, n) by sampling
     #  the image n at random, but only between the ones that violate the triplet loss margin. The
     #  latter is a form of hard-negative mining, but it is not as aggressive (and much cheaper) than
     #  choosing the maximally violating example, as often done in structured output learning.
-
-    for i in xrange(people_per_batch):
-        nrof_images = int(nrof_images_per_class[i])
-        for j in xrange(1,nrof_images):
-            a_idx = emb_start_idx + j - 1
-            neg_dists_sqr = np.sum(np.square(embeddings[a_idx] - embeddings), 1)
-            for pair in xrange(j, nrof_images): # For every possible positive pair.
-                p_idx = emb_start_idx + pair
-                pos_dist_sqr = np.sum(np.square(embeddings[a_idx]-embeddings[p_idx]))
-                neg_dists_sqr[emb_start_idx:emb_start_idx+nrof_images] = np.NaN
-                #all_neg = np.where(np.logical_and(neg_dists_sqr-pos_dist_sqr<alpha, pos_dist_sqr<neg_dists_sqr))[0]  # FaceNet selection
-                all_neg = np.where(neg_dists_sqr-pos_dist_sqr<alpha)[0] # VGG Face selecction
-                nrof_random_negs = all_neg.shape[0]
-                if nrof_random_negs>0:
-                    rnd_idx = np.random.randint(nrof_random_negs)
-                    n_idx = all_neg[rnd_idx]
-                    triplets.append((image_paths[a_idx], image_paths[p_idx], image_paths[n_idx]))
-                    #print('Triplet %d: (%d, %d, %d), pos_dist=%2.6f, neg_dist=%2.6f (%d, %d, %d, %d, %d)' % 
-                    #    (trip_idx, a_idx, p_idx, n_idx, pos_dist_sqr, neg_dists_sqr[n_idx], nrof_random_negs, rnd_idx, i, j, emb_start_idx))
-                    trip_idx += 1
-
-                num_trips += 1
-
-        emb_start_idx += nrof_images
-
-    np.random.shuffle(triplets)
-    return triplets, num_trips, len(triplets)
-
-def sample_people(dataset, people_per_batch, images_per_person):
-    nrof_images = people_per_batch * images_per_person
-  
-    # Sample classes from the dataset
-    nrof_classes = len(dataset)
-    class_indices = np.arange(nrof_classes)
-    np.random.shuffle(class_indices)
-    
-    i = 0
-    image_paths = []
-    num_per_class = []
-    sampled_class_indices = []
-    # Sample images from these classes until we have enough
-    while len(image_paths)<nrof_images:
-        class_index = class_indices[i]
-        nrof_images_in_class = len(dataset[class_index])
-        image_indices = np.arange(nrof_images_in_class)
-        np.random.shuffle(image_indices)
-        nrof_images_from_class = min(nrof_images_in_class, images_per_person, nrof_images-len(image_paths))
-        idx = image_indices[0:nrof_images_from_class]
-        image_paths_for_class = [dataset[class_index].image_paths[j] for j in idx]
-        sampled_class_indices += [class_index]*nrof_images_from_class
-        image_paths += image_paths_for_class
-        num_per_class.append(nrof_images_from_class)
-        i+=1
-  
-    return image_paths, num_per_class
+    # mode='facenet' additionally requires pos_dist < neg_dist (semi-hard negatives).
+    # Computed from one pairwise distance matrix per batch, see triplet_selection.py
+    return triplet_selection.select_triplets(embeddings, nrof_images_per_class, image_paths,
+        people_per_batch, alpha, mode)
 
 def evaluate(sess, image_paths, embeddings, labels_batch, image_paths_placeholder, labels_placeholder, 
         batch_size_placeholder, learning_rate_placeholder, phase_train_placeholder, enqueue_op, actual_issame, batch_size, 
@@ -429,6 +422,9 @@ def parse_arguments(argv):
     parser.add_argument('--data_dir', type=str,
         help='Path to the data directory containing aligned face patches.',
         default='~/datasets/casia/casia_maxpy_mtcnnalign_182_160')
+    parser.add_argument('--manifest_file', type=str,
+        help='Keep the dataset listing in this manifest and only list the class directories that changed '
+        '(see dataset_manifest.py; images rewritten in place need dataset_manifest.py --rescan).', default=None)
     parser.add_argument('--model_def', type=str,
         help='Model definition. Points to a module containing the definition of the inference graph.', default='models.inception_resnet_v1')
     parser.add_argument('--max_nrof_epochs', type=int,
@@ -445,6 +441,15 @@ def parse_arguments(argv):
         help='Number of batches per epoch.', default=1000)
     parser.add_argument('--alpha', type=float,
         help='Positive to negative triplet distance margin.', default=0.2)
+    parser.add_argument('--triplet_selection', type=str, choices=['vgg', 'facenet'],
+        help='Negatives within the margin (VGG Face) or semi-hard negatives farther than the positive (FaceNet).',
+        default='vgg')
+    parser.add_argument('--embedding_bank_max_age', type=int,
+        help='Keep the embeddings of all training images in a memory bank and embed a sampled image again only ' +
+        'if its embedding is older than this many steps. 0 embeds every sampled batch.', default=0)
+    parser.add_argument('--embedding_bank_negatives', type=int,
+        help='Number of fresh bank embeddings, besides the batch, searched for negatives. Mining keeps a ' +
+        'people_per_batch*images_per_person x this many distance matrix in memory.', default=10000)
     parser.add_argument('--embedding_size', type=int,
         help='Dimensionality of the embedding.', default=128)
     parser.add_argument('--random_crop', 
@@ -479,7 +484,10 @@ def parse_arguments(argv):
         help='Path to the data directory containing aligned face patches.', default='')
     parser.add_argument('--lfw_nrof_folds', type=int,
         help='Number of folds to use for cross validation. Mainly used for testing.', default=10)
-    return parser.parse_args(argv)
+    args = parser.parse_args(argv)
+    if args.embedding_bank_max_age > 0 and args.embedding_bank_negatives < 1:
+        parser.error('--embedding_bank_negatives must be at least 1')
+    return args
   
 
 if __name__ == '__main__':
@@ -0,0 +1,131 @@
+"""Vectorized triplet selection for train_tripletloss.py.
+
+The batch holds people_per_batch classes with a contiguous block of images
+each. The squared distance matrix of the batch is computed once, and every
+anchor's distances to the other classes are sorted once. For an
+anchor-positive pair the valid negatives are then a contiguous range of the
+anchor's sorted row:
+
+- 'vgg' (VGG Face, random semi-hard): neg_dist - pos_dist < alpha, i.e. the
+  negatives closer than pos_dist + alpha.
+- 'facenet' (FaceNet paper, semi-hard): pos_dist < neg_dist < pos_dist + alpha.
+
+Both bounds of all pairs come from one np.searchsorted over the sorted rows,
+and a random position inside the range picks the negative. This replaces the loops over
+classes, anchors and positives that recomputed the anchor's distances to the
+whole batch for every positive.
+
+The negatives can also be searched in a set of candidate embeddings other
+than the batch (see embedding_bank.py), with the same rules.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+SELECTION_MODES = ('vgg', 'facenet')
+
+
+def pairwise_squared_distances(embeddings):
+    """(n, n) squared euclidean distances, computed as |a|^2 + |b|^2 - 2 a.b."""
+    embeddings = np.asarray(embeddings, dtype=np.float64)
+    sq_norms = np.einsum('ij,ij->i', embeddings, embeddings)
+    dists = sq_norms[:, None] + sq_norms[None, :] - 2.0 * embeddings.dot(embeddings.T)
+    return np.maximum(dists, 0.0)
+
+
+def squared_distances(a, b):
+    """(n, m) squared euclidean distances between the rows of a and the rows of b."""
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    dists = np.einsum('ij,ij->i', a, a)[:, None] + np.einsum('ij,ij->i', b, b)[None, :] - 2.0 * a.dot(b.T)
+    return np.maximum(dists, 0.0)
+
+
+def batch_labels(nrof_images_per_class, people_per_batch):
+    """Class index of every image of the batch."""
+    counts = np.asarray(nrof_images_per_class[:people_per_batch], dtype=np.int64)
+    return np.repeat(np.arange(counts.shape[0]), counts)
+
+
+def select_triplet_indices(embeddings, labels, alpha, mode='vgg', rng=np.random,
+                           candidate_embeddings=None, candidate_labels=None):
+    """Picks one negative for every anchor-positive pair of the batch.
+
+    Args:
+        embeddings: (n, d) embeddings of the batch
+        labels: (n,) class of each row; the rows of a class are contiguous
+        alpha: Triplet loss margin
+        mode: 'vgg' or 'facenet', see the module docstring
+        rng: np.random or a RandomState
+        candidate_embeddings, candidate_labels: (m, d) and (m,) negatives to
+            choose from; the batch itself if None
+
+    Returns:
+        (anchors, positives, negatives, nrof_pairs), negatives being rows of
+        the candidates. Pairs without any valid negative are dropped;
+        nrof_pairs counts all anchor-positive pairs.
+    """
+    if mode not in SELECTION_MODES:
+        raise ValueError('Invalid triplet selection mode "%s"' % mode)
+    labels = np.asarray(labels)
+    n = labels.shape[0]
+    dists = pairwise_squared_distances(embeddings[:n])
+    same = labels[:, None] == labels[None, :]
+    if candidate_embeddings is None:
+        cand_dists, cand_same = dists, same
+    else:
+        cand_dists = squared_distances(embeddings[:n], candidate_embeddings)
+        cand_same = labels[:, None] == np.asarray(candidate_labels)[None, :]
+    m = cand_dists.shape[1]
+
+    # (a, p) with a < p in the same class, in the order of the original loops
+    anchors, positives = np.nonzero(np.triu(same, 1))
+    nrof_pairs = anchors.shape[0]
+    pos_dist = dists[anchors, positives]
+
+    # Every anchor's distances to the other classes in ascending order; its
+    # own class goes to the end with a value that never passes a bound, not
+    # even pos_dist + alpha
+    top = max(float(np.max(np.where(cand_same, 0.0, cand_dists), initial=0.0)),
+              float(np.max(pos_dist, initial=0.0))) + abs(alpha) + 1.0
+    neg_dists = np.where(cand_same, top, cand_dists)
+    order = np.argsort(neg_dists, axis=1)
+    sorted_dists = np.take_along_axis(neg_dists, order, axis=1)
+    # Row r is shifted by r * offset so that one searchsorted over the
+    # flattened matrix answers the bounds of all pairs
+    offset = 2.0 * top
+    flat = (sorted_dists + offset * np.arange(n)[:, None]).ravel()
+
+    base = offset * anchors
+    row_start = anchors * m
+    # Negatives with neg_dist - pos_dist < alpha
+    hi = np.searchsorted(flat, base + pos_dist + alpha, side='left') - row_start
+    if mode == 'facenet':
+        # ... and pos_dist < neg_dist
+        lo = np.searchsorted(flat, base + pos_dist, side='right') - row_start
+    else:
+        lo = np.zeros_like(hi)
+    count = np.maximum(hi - lo, 0)
+    pick = lo + np.floor(rng.random_sample(nrof_pairs) * count).astype(np.int64)
+    negatives = np.where(count > 0, order[anchors, np.minimum(pick, m - 1)], -1)
+
+    valid = negatives >= 0
+    return anchors[valid], positives[valid], negatives[valid], nrof_pairs
+
+
+def select_triplets(embeddings, nrof_images_per_class, image_paths, people_per_batch, alpha, mode='vgg', rng=np.random):
+    """ Select the triplets for training
+
+    Returns:
+        (triplets, nrof_pairs, nrof_triplets) as train_tripletloss expects:
+        a shuffled list of (anchor, positive, negative) paths, the number of
+        anchor-positive pairs and the number of triplets.
+    """
+    labels = batch_labels(nrof_images_per_class, people_per_batch)
+    anchors, positives, negatives, nrof_pairs = select_triplet_indices(embeddings, labels, alpha, mode, rng)
+    perm = rng.permutation(anchors.shape[0])
+    triplets = [(image_paths[a], image_paths[p], image_paths[n])
+                for a, p, n in zip(anchors[perm], positives[perm], negatives[perm])]
+    return triplets, nrof_pairs, len(triplets)
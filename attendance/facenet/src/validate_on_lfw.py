@@ -34,6 +34,7 @@ import numpy as np
 import argparse
 import facenet
 import lfw
+import shards
 import os
 import sys
 from tensorflow.python.ops import data_flow_ops
@@ -66,7 +67,8 @@ def main(args):
                                         shapes=[(1,), (1,), (1,)],
                                         shared_name=None, name=None)
             eval_enqueue_op = eval_input_queue.enqueue_many([image_paths_placeholder, labels_placeholder, control_placeholder], name='eval_enqueue_op')
-            image_batch, label_batch = facenet.create_input_pipeline(eval_input_queue, image_size, nrof_preprocess_threads, batch_size_placeholder)
+            image_batch, label_batch = facenet.create_input_pipeline(eval_input_queue, image_size, nrof_preprocess_threads,
+                batch_size_placeholder, shards.is_shard_dir(args.lfw_dir))
      
             # Load the model
             input_map = {'image_batch': image_batch, 'label_batch': label_batch, 'phase_train': phase_train_placeholder}
@@ -0,0 +1,140 @@
+"""Vectorized face verification metrics (ROC, accuracy and VAL@FAR with k folds).
+
+Distances are computed once per fold (only once in total without
+subtract_mean) and sorted. The number of genuine and impostor pairs below
+every threshold then comes from one np.searchsorted call per array, instead
+of one pass over all pairs per threshold. Folds are the contiguous blocks
+that sklearn's KFold(shuffle=False) would produce, represented by a fold id
+per pair. Training-fold counts are the total counts minus the test-fold
+counts. The results are identical to the per-threshold loops that
+facenet.calculate_roc and facenet.calculate_val used before (calculate_val
+drops repeated training FARs before interpolating, which recent scipy
+versions require).
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+
+import numpy as np
+from scipy import interpolate
+
+
+def distance(embeddings1, embeddings2, distance_metric=0):
+    if distance_metric==0:
+        # Euclidian distance
+        diff = np.subtract(embeddings1, embeddings2)
+        dist = np.sum(np.square(diff),1)
+    elif distance_metric==1:
+        # Distance based on cosine similarity
+        dot = np.sum(np.multiply(embeddings1, embeddings2), axis=1)
+        norm = np.linalg.norm(embeddings1, axis=1) * np.linalg.norm(embeddings2, axis=1)
+        similarity = dot / norm
+        dist = np.arccos(similarity) / math.pi
+    else:
+        raise ValueError('Undefined distance metric %d' % distance_metric)
+    return dist
+
+
+def fold_ids(nrof_pairs, nrof_folds):
+    """Fold of every pair, with the same contiguous split as KFold(n_splits=nrof_folds)."""
+    sizes = np.full(nrof_folds, nrof_pairs // nrof_folds, dtype=np.int64)
+    sizes[:nrof_pairs % nrof_folds] += 1
+    return np.repeat(np.arange(nrof_folds), sizes)
+
+
+class Counts(object):
+    """Genuine (same) and impostor (diff) pairs with distance below each threshold."""
+
+    def __init__(self, dist, actual_issame, thresholds):
+        same = np.sort(dist[actual_issame])
+        diff = np.sort(dist[np.logical_not(actual_issame)])
+        thresholds = np.asarray(thresholds)
+        # np.less(dist, threshold): searchsorted 'left' counts the values < threshold
+        self.tp = np.searchsorted(same, thresholds, side='left')
+        self.fp = np.searchsorted(diff, thresholds, side='left')
+        self.n_same = same.size
+        self.n_diff = diff.size
+
+    def __sub__(self, other):
+        result = Counts.__new__(Counts)
+        result.tp, result.fp = self.tp - other.tp, self.fp - other.fp
+        result.n_same, result.n_diff = self.n_same - other.n_same, self.n_diff - other.n_diff
+        return result
+
+    @property
+    def tpr(self):
+        return self.tp / float(self.n_same) if self.n_same else np.zeros(self.tp.shape)
+
+    @property
+    def fpr(self):
+        return self.fp / float(self.n_diff) if self.n_diff else np.zeros(self.fp.shape)
+
+    @property
+    def accuracy(self):
+        return (self.tp + self.n_diff - self.fp) / float(self.n_same + self.n_diff)
+
+
+def _fold_counts(thresholds, embeddings1, embeddings2, actual_issame, nrof_folds, distance_metric, subtract_mean):
+    """Yields (train counts, test counts, test distances, test issame) for every fold."""
+    assert(embeddings1.shape[0] == embeddings2.shape[0])
+    assert(embeddings1.shape[1] == embeddings2.shape[1])
+    nrof_pairs = min(len(actual_issame), embeddings1.shape[0])
+    embeddings1, embeddings2 = embeddings1[:nrof_pairs], embeddings2[:nrof_pairs]
+    actual_issame = np.asarray(actual_issame[:nrof_pairs], dtype=bool)
+    folds = fold_ids(nrof_pairs, nrof_folds)
+
+    total = None
+    if not subtract_mean:
+        dist = distance(embeddings1, embeddings2, distance_metric)
+        total = Counts(dist, actual_issame, thresholds)
+    for fold_idx in range(nrof_folds):
+        test_set = folds == fold_idx
+        if subtract_mean:
+            train_set = np.logical_not(test_set)
+            mean = np.mean(np.concatenate([embeddings1[train_set], embeddings2[train_set]]), axis=0)
+            dist = distance(embeddings1-mean, embeddings2-mean, distance_metric)
+        test = Counts(dist[test_set], actual_issame[test_set], thresholds)
+        if total is not None:
+            train = total - test
+        else:
+            train = Counts(dist[train_set], actual_issame[train_set], thresholds)
+        yield train, test, dist[test_set], actual_issame[test_set]
+
+
+def calculate_roc(thresholds, embeddings1, embeddings2, actual_issame, nrof_folds=10, distance_metric=0, subtract_mean=False):
+    """TPR and FPR averaged over the folds, and the test accuracy of each fold at its best training threshold."""
+    nrof_thresholds = len(thresholds)
+    tprs = np.zeros((nrof_folds,nrof_thresholds))
+    fprs = np.zeros((nrof_folds,nrof_thresholds))
+    accuracy = np.zeros((nrof_folds))
+    for fold_idx, (train, test, _, _) in enumerate(_fold_counts(
+            thresholds, embeddings1, embeddings2, actual_issame, nrof_folds, distance_metric, subtract_mean)):
+        # Find the best threshold for the fold
+        best_threshold_index = np.argmax(train.accuracy)
+        tprs[fold_idx], fprs[fold_idx] = test.tpr, test.fpr
+        accuracy[fold_idx] = test.accuracy[best_threshold_index]
+    return np.mean(tprs,0), np.mean(fprs,0), accuracy
+
+
+def calculate_val(thresholds, embeddings1, embeddings2, actual_issame, far_target, nrof_folds=10, distance_metric=0, subtract_mean=False):
+    """Validation rate at the threshold that gives far_target on the training folds."""
+    val = np.zeros(nrof_folds)
+    far = np.zeros(nrof_folds)
+    for fold_idx, (train, _, test_dist, test_issame) in enumerate(_fold_counts(
+            thresholds, embeddings1, embeddings2, actual_issame, nrof_folds, distance_metric, subtract_mean)):
+        # Find the threshold that gives FAR = far_target
+        far_train = train.fpr
+        if np.max(far_train)>=far_target:
+            # Recent scipy rejects repeated x values in a spline; keep the
+            # first threshold that reaches each FAR
+            far_train, first = np.unique(far_train, return_index=True)
+            f = interpolate.interp1d(far_train, np.asarray(thresholds)[first], kind='slinear')
+            threshold = f(far_target)
+        else:
+            threshold = 0.0
+        test = Counts(test_dist, test_issame, [threshold])
+        val[fold_idx] = test.tpr[0]
+        far[fold_idx] = test.fpr[0]
+    return np.mean(val), np.std(val), np.mean(far)
@@ -1,7 +1,7 @@
 from flask_wtf import FlaskForm
-from flask_wtf.file import FileField,FileAllowed
+from flask_wtf.file import FileField,FileAllowed,FileRequired
 from flask_login import current_user
-from wtforms import StringField, PasswordField, SubmitField, BooleanField, IntegerField
+from wtforms import StringField, PasswordField, SubmitField, BooleanField, IntegerField, SelectField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError
 from attendance.models import User, Class, Student
 
@@ -27,6 +27,11 @@ class LoginForm(FlaskForm):
 	remember = BooleanField('Remember Me')
 	submit = SubmitField('Login')
 
+class ImportForm(FlaskForm):
+    class_id = SelectField('Clase', coerce=int, validators=[DataRequired()])
+    file = FileField('Fichero CSV o XLSX', validators=[FileRequired(), FileAllowed(['csv', 'xlsx'])])
+    submit = SubmitField('Importar')
+
 class AddForm(FlaskForm):
     classname = StringField('Class Name', validators=[DataRequired()])
     coordinator = StringField('Coordinator Name', validators=[DataRequired()])
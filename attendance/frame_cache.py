@@ -0,0 +1,123 @@
+"""
+Cache de resultados de reconocimiento por hash perceptual del frame.
+
+Las camaras de los kioscos envian frames casi identicos mientras nadie (o
+un desconocido) esta delante. Cada frame se resume en un dHash de 256 bits
+calculado sobre una version reducida en grises; si en los ultimos ttl
+segundos se proceso un frame con un hash a distancia de Hamming
+<= max_distance, se devuelve ese resultado sin detectar ni calcular
+embeddings otra vez.
+
+Solo se guardan los resultados sin estudiante (CACHEABLE_STATUSES): el hash
+es del frame entero, y dos estudiantes distintos delante del mismo fondo
+estatico difieren en pocos bits, asi que un 'ok' en cache marcaria la
+asistencia del estudiante anterior. La cache se vacia cuando cambia la
+galeria, para que un estudiante recien enrolado no siga siendo 'unknown'.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from attendance import app
+from attendance.gallery import gallery_cache
+
+# Resultados que se pueden reutilizar para un frame parecido
+CACHEABLE_STATUSES = ('no_face', 'unknown')
+
+
+def dhash(gray, hash_size=16):
+    """Difference hash de una imagen en grises ya reducida a (hash_size, hash_size + 1).
+
+    Cada bit indica si un pixel es mas claro que su vecino de la derecha, asi
+    que es insensible a cambios globales de brillo y a la compresion JPEG.
+    """
+    gray = np.asarray(gray, dtype=np.int16)
+    if gray.shape != (hash_size, hash_size + 1):
+        raise ValueError('Se esperaba una imagen de %dx%d' % (hash_size + 1, hash_size))
+    bits = (gray[:, 1:] > gray[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def _hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class FrameCache:
+    """LRU de resultados con caducidad, buscado por hash exacto o cercano."""
+
+    def __init__(self, max_size=256, ttl=2.0, max_distance=8):
+        """
+        Args:
+            max_size: Numero maximo de frames recordados
+            ttl: Segundos que un resultado sigue siendo valido
+            max_distance: Bits distintos tolerados entre dos hashes
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.stats = {'hits': 0, 'near_hits': 0, 'misses': 0, 'expired': 0}
+
+    def get(self, scope, frame_hash, now=None):
+        """Resultado guardado para un frame parecido de scope, o None.
+
+        scope separa resultados que no son intercambiables (ruta, clase del
+        kiosco...).
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            key = (scope, frame_hash)
+            entry = self._entries.get(key)
+            if entry is None and self.max_distance > 0:
+                key, entry = self._nearest(scope, frame_hash)
+            if entry is not None and now - entry[0] > self.ttl:
+                del self._entries[key]
+                self.stats['expired'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits' if key[1] == frame_hash else 'near_hits'] += 1
+            return entry[1]
+
+    def _nearest(self, scope, frame_hash):
+        best_key, best_dist = None, self.max_distance + 1
+        for key in self._entries:
+            if key[0] == scope:
+                dist = _hamming(key[1], frame_hash)
+                if dist < best_dist:
+                    best_key, best_dist = key, dist
+        if best_key is None:
+            return None, None
+        return best_key, self._entries[best_key]
+
+    def put(self, scope, frame_hash, result, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            key = (scope, frame_hash)
+            self._entries[key] = (now, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['near_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['near_hits']) / float(lookups) if lookups else 0.0
+        return stats
+
+
+frame_cache = FrameCache(app.config.get('RECOGNITION_CACHE_SIZE', 256),
+                         app.config.get('RECOGNITION_CACHE_TTL', 2.0),
+                         app.config.get('RECOGNITION_CACHE_MAX_DISTANCE', 8))
+gallery_cache.add_listener(lambda model_version: frame_cache.clear())
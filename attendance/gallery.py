@@ -0,0 +1,402 @@
+"""
+Galeria de embeddings de los estudiantes enrolados.
+
+Los embeddings viven en la tabla face_embedding (ver models.FaceEmbedding)
+como bytes float32/float16. La galeria completa se carga con una sola
+consulta y un np.frombuffer sobre los bytes concatenados, y queda en memoria
+hasta que cambia el enrolamiento.
+
+La busqueda usa el indice de GALLERY_INDEX (ver ann_index): 'brute' por
+defecto, 'ivf' o 'hnsw' para galerias muy grandes, con los parametros de
+GALLERY_INDEX_PARAMS[tipo] (p. ej. {'ivf': {'nprobe': 16}}). Se guardan en
+GALLERY_INDEX_DIR y al recargar la galeria solo se anaden o quitan los
+embeddings que han cambiado, sin volver a entrenar el indice. Solo
+build-index escribe el indice en disco; los workers que sirven peticiones
+lo cargan y aplican en memoria los cambios posteriores, y si no pueden
+leerlo lo reconstruyen.
+
+Un kiosco de aula busca primero entre los estudiantes de su clase
+(Gallery.for_class, una submatriz por clase cacheada en la galeria) y solo
+si no hay coincidencia recurre al indice global.
+
+Uso:
+    python -m attendance.gallery import-npy encodings/
+    python -m attendance.gallery enroll [--class_id N]
+    python -m attendance.gallery build-index [--kind ivf]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import event, inspect
+
+from attendance import app, db
+from attendance.ann_index import build_index, index_path, load_index
+from attendance.models import FaceEmbedding, GalleryVersion, Student
+
+DTYPES = {'float32': np.float32, 'float16': np.float16}
+
+
+class Gallery:
+    """Matriz (n, dim) de embeddings con el student_id de cada fila.
+
+    embedding_ids son los ids de face_embedding de cada fila; el indice de
+    busqueda devuelve esos ids y student_of los traduce a estudiantes.
+    class_ids es la clase del estudiante de cada fila.
+    """
+
+    def __init__(self, model_version, embeddings, student_ids, signature=None,
+                 embedding_ids=None, index=None, class_ids=None):
+        self.model_version = model_version
+        self.embeddings = embeddings
+        self.student_ids = student_ids
+        self.signature = signature
+        if embedding_ids is None:
+            embedding_ids = np.arange(student_ids.shape[0], dtype=np.int64)
+        self.embedding_ids = embedding_ids
+        self.class_ids = class_ids
+        self._by_id = np.argsort(embedding_ids)
+        if index is None:
+            index = build_index('brute', embedding_ids, embeddings)
+        self.index = index
+        # Subgalerias por clase; mueren con la galeria al cambiar el enrolamiento
+        self._classes = {}
+        self._classes_lock = threading.Lock()
+
+    def __len__(self):
+        return self.student_ids.shape[0]
+
+    def distances(self, encoding):
+        """Distancias euclideas de un encoding a todas las filas."""
+        encoding = np.asarray(encoding, dtype=np.float32)
+        return np.linalg.norm(self.embeddings - encoding, axis=1)
+
+    def student_of(self, embedding_ids):
+        """student_id de cada id de face_embedding (-1 se mantiene como -1)."""
+        embedding_ids = np.asarray(embedding_ids, dtype=np.int64)
+        if len(self) == 0:
+            return np.full(embedding_ids.shape, -1, np.int64)
+        pos = np.searchsorted(self.embedding_ids, embedding_ids, sorter=self._by_id)
+        rows = self._by_id[np.minimum(pos, len(self) - 1)]
+        return np.where(embedding_ids >= 0, self.student_ids[rows], -1)
+
+    def search(self, encodings, k=1):
+        """Los k vecinos de cada encoding: (distancias (q, k), student_ids (q, k))."""
+        dists, ids = self.index.search(encodings, k)
+        return dists, self.student_of(ids)
+
+    def for_class(self, class_id):
+        """Subgaleria con los embeddings de los estudiantes de class_id."""
+        sub = self._classes.get(class_id)
+        if sub is None:
+            with self._classes_lock:
+                sub = self._classes.get(class_id)
+                if sub is None:
+                    if self.class_ids is None:
+                        raise ValueError('La galeria no tiene las clases de los estudiantes')
+                    rows = np.flatnonzero(self.class_ids == class_id)
+                    # Las clases son pequenas: busqueda exacta sobre la submatriz
+                    sub = Gallery(self.model_version, self.embeddings[rows], self.student_ids[rows],
+                                  self.signature, self.embedding_ids[rows], class_ids=self.class_ids[rows])
+                    self._classes[class_id] = sub
+        return sub
+
+    def match(self, encoding, tolerance=0.6, class_id=None):
+        """Devuelve (student_id, distancia) del vecino mas cercano o (None, distancia).
+
+        Con class_id se busca primero entre los estudiantes de esa clase y,
+        si ninguno queda dentro de tolerance, en la galeria completa.
+        """
+        if class_id is not None:
+            student_id, dist = self.for_class(class_id).match(encoding, tolerance)
+            if student_id is not None:
+                return student_id, dist
+        if len(self) == 0:
+            return None, float('inf')
+        dists, student_ids = self.search(encoding, k=1)
+        dist = float(dists[0, 0])
+        if dist <= tolerance:
+            return int(student_ids[0, 0]), dist
+        return None, dist
+
+
+def pack(vector, dtype='float32'):
+    return np.ascontiguousarray(vector, dtype=DTYPES[dtype]).tobytes()
+
+
+def _signature(model_version):
+    # Cambia al anadir o borrar embeddings y al cambiar de clase a un
+    # estudiante: permite detectar los cambios hechos desde otro proceso sin
+    # recargar la galeria entera. gallery_version cubre lo que el numero de
+    # filas y el mayor id no ven (cambios de clase, un id reutilizado).
+    return tuple(db.session.execute(
+        db.select(db.func.count(FaceEmbedding.id), db.func.max(FaceEmbedding.id), GalleryVersion.current())
+        .where(FaceEmbedding.model_version == model_version)).one())
+
+
+def _index_dir():
+    return app.config.get('GALLERY_INDEX_DIR') or os.path.join(app.instance_path, 'index')
+
+
+def _gallery_index(model_version, embedding_ids, embeddings, save=False):
+    """Indice de GALLERY_INDEX para la galeria, reutilizando el guardado en disco.
+
+    Con save se guarda el indice actualizado (solo desde build-index: varios
+    workers guardando a la vez se pisarian).
+    """
+    kind = app.config.get('GALLERY_INDEX', 'brute')
+    if kind == 'brute' or embeddings.shape[0] == 0:
+        return build_index('brute', embedding_ids, embeddings)
+
+    path = index_path(_index_dir(), model_version, kind)
+    index = None
+    if os.path.exists(path):
+        try:
+            index = load_index(path)
+        except Exception as e:
+            # np.load lanza BadZipFile y hnswlib RuntimeError con un fichero danado
+            print('Indice %s ilegible, se reconstruye: %s' % (path, e))
+        if index is not None and (index.kind != kind or index.dim != embeddings.shape[1]):
+            index = None
+
+    if index is None:
+        index = build_index(kind, embedding_ids, embeddings, **app.config.get('GALLERY_INDEX_PARAMS', {}).get(kind, {}))
+        changed = True
+    else:
+        # Altas y bajas desde la ultima vez que se guardo
+        new = ~np.isin(embedding_ids, index.ids)
+        changed = index.remove(np.setdiff1d(index.ids, embedding_ids)) > 0 or bool(new.any())
+        if new.any():
+            index.add(embedding_ids[new], embeddings[new])
+    if changed and save:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        index.save(path)
+    return index
+
+
+def load_gallery(model_version, save_index=False):
+    """Carga todos los embeddings de model_version con una unica consulta."""
+    signature = _signature(model_version)
+    rows = db.session.execute(
+        db.select(FaceEmbedding.id, FaceEmbedding.student_id, Student.class_id, FaceEmbedding.dtype,
+                  FaceEmbedding.dim, FaceEmbedding.vector)
+        .join(Student, Student.id == FaceEmbedding.student_id)
+        .where(FaceEmbedding.model_version == model_version)
+        .order_by(FaceEmbedding.dtype, FaceEmbedding.id)).all()
+    if not rows:
+        return Gallery(model_version, np.zeros((0, 0), np.float32), np.zeros((0,), np.int64), signature,
+                       class_ids=np.zeros((0,), np.int64))
+
+    dims = {r.dim for r in rows}
+    if len(dims) > 1:
+        raise ValueError('Embeddings de %s con dimensiones distintas: %s' % (model_version, sorted(dims)))
+    dim = dims.pop()
+
+    # Un bloque contiguo por dtype (normalmente solo hay uno)
+    blocks, ids, start = [], [], 0
+    for end in range(1, len(rows) + 1):
+        if end == len(rows) or rows[end].dtype != rows[start].dtype:
+            chunk = rows[start:end]
+            buf = b''.join(r.vector for r in chunk)
+            blocks.append(np.frombuffer(buf, dtype=DTYPES[chunk[0].dtype]).reshape(-1, dim).astype(np.float32))
+            start = end
+    embeddings = np.concatenate(blocks)
+    student_ids = np.fromiter((r.student_id for r in rows), dtype=np.int64, count=len(rows))
+    embedding_ids = np.fromiter((r.id for r in rows), dtype=np.int64, count=len(rows))
+    class_ids = np.fromiter((r.class_id or -1 for r in rows), dtype=np.int64, count=len(rows))
+    return Gallery(model_version, embeddings, student_ids, signature, embedding_ids,
+                   _gallery_index(model_version, embedding_ids, embeddings, save_index), class_ids)
+
+
+class GalleryCache:
+    """Galeria cargada una vez por proceso e invalidada al cambiar el enrolamiento."""
+
+    def __init__(self, refresh_seconds=30.0):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._galleries = {}
+        self._checked = {}
+        self._listeners = []
+
+    def get(self, model_version=None):
+        model_version = model_version or app.config['EMBEDDING_MODEL_VERSION']
+        with self._lock:
+            gallery = self._galleries.get(model_version)
+            now = time.time()
+            if gallery is not None and now - self._checked.get(model_version, 0) > self.refresh_seconds:
+                self._checked[model_version] = now
+                if _signature(model_version) != gallery.signature:
+                    gallery = None
+            if gallery is None:
+                gallery = load_gallery(model_version)
+                self._galleries[model_version] = gallery
+                self._checked[model_version] = now
+                self._notify(model_version)
+            return gallery
+
+    def invalidate(self, model_version=None):
+        with self._lock:
+            if model_version is None:
+                self._galleries.clear()
+            else:
+                self._galleries.pop(model_version, None)
+            self._notify(model_version)
+
+    def add_listener(self, callback):
+        """callback(model_version) se llama cada vez que se invalida o recarga una galeria.
+
+        model_version es None cuando se invalidan todas.
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, model_version):
+        for callback in self._listeners:
+            callback(model_version)
+
+
+gallery_cache = GalleryCache(app.config.get('GALLERY_REFRESH_SECONDS', 30.0))
+
+
+def _invalidate_after_commit(session, model_version):
+    session.info.setdefault('gallery_invalidate', set()).add(model_version)
+
+
+def _enrolment_changed(model_versions):
+    """Avanza gallery_version en la transaccion actual e invalida las galerias al confirmarla."""
+    GalleryVersion.bump(db.session.connection())
+    for model_version in model_versions:
+        _invalidate_after_commit(db.session(), model_version)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_committed(session):
+    # Invalidar antes del commit dejaria que otro hilo recargase la galeria
+    # sin el cambio y la guardase con la firma antigua
+    for model_version in session.info.pop('gallery_invalidate', ()):
+        gallery_cache.invalidate(model_version)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_invalidations(session):
+    session.info.pop('gallery_invalidate', None)
+
+
+@event.listens_for(Student, 'after_update')
+def _student_class_changed(mapper, connection, target):
+    # Los embeddings no cambian, pero si las subgalerias de Gallery.for_class
+    state = inspect(target)
+    if state.attrs.class_id.history.has_changes():
+        GalleryVersion.bump(connection)
+        _invalidate_after_commit(state.session, None)
+
+
+def add_embeddings(student_id, vectors, model_version=None, dtype=None, sources=None, commit=True):
+    """Guarda uno o varios embeddings de un estudiante en un solo INSERT."""
+    model_version = model_version or app.config['EMBEDDING_MODEL_VERSION']
+    dtype = dtype or app.config['EMBEDDING_DTYPE']
+    vectors = np.atleast_2d(np.asarray(vectors))
+    sources = sources or [None] * vectors.shape[0]
+    db.session.execute(db.insert(FaceEmbedding), [
+        {'student_id': student_id, 'model_version': model_version, 'dtype': dtype,
+         'dim': vectors.shape[1], 'vector': pack(v, dtype), 'source': src}
+        for v, src in zip(vectors, sources)])
+    _enrolment_changed([model_version])
+    if commit:
+        db.session.commit()
+    return vectors.shape[0]
+
+
+def remove_embeddings(embedding_ids, commit=True):
+    """Borra embeddings por id; el indice los quita en la siguiente recarga."""
+    embedding_ids = [int(i) for i in embedding_ids]
+    versions = set(db.session.execute(
+        db.select(FaceEmbedding.model_version).where(FaceEmbedding.id.in_(embedding_ids))).scalars())
+    nrof_deleted = db.session.execute(
+        db.delete(FaceEmbedding).where(FaceEmbedding.id.in_(embedding_ids))).rowcount
+    if versions:
+        _enrolment_changed(versions)
+    if commit:
+        db.session.commit()
+    return nrof_deleted
+
+
+def import_npy_dir(path, model_version=None, dtype=None):
+    """Importa los ficheros encodings/{student_id}.npy del formato anterior."""
+    nrof_imported = 0
+    known = set(db.session.execute(db.select(Student.id)).scalars())
+    for entry in os.scandir(path):
+        name, ext = os.path.splitext(entry.name)
+        if ext != '.npy' or not name.isdigit() or int(name) not in known:
+            continue
+        nrof_imported += add_embeddings(int(name), np.load(entry.path), model_version, dtype,
+                                        sources=None, commit=False)
+    db.session.commit()
+    return nrof_imported
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def enroll_from_photos(students, photo_root=None):
+    """Calcula y guarda un embedding por foto de la carpeta photo_dir de cada estudiante."""
+    from attendance import recognition
+
+    photo_root = photo_root or app.config['FACENET_TRAIN_IMG']
+    nrof_enrolled = 0
+    for student in students:
+        folder = os.path.join(photo_root, student.photo_dir or student.stuname)
+        if not os.path.isdir(folder):
+            print('Sin fotos para %s (%s)' % (student.stuname, folder))
+            continue
+        vectors, sources = [], []
+        for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+            if os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            encodings = recognition.face_encodings(recognition.load_image(entry.path))
+            if len(encodings) == 1:
+                vectors.append(encodings[0])
+                sources.append(entry.path)
+        if vectors:
+            nrof_enrolled += add_embeddings(student.id, vectors, sources=sources, commit=False)
+        print('%s: %d embeddings' % (student.stuname, len(vectors)))
+    db.session.commit()
+    return nrof_enrolled
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m attendance.gallery')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('import-npy', help='Importa encodings/{id}.npy a la tabla face_embedding')
+    p.add_argument('path', type=str)
+    p = sub.add_parser('enroll', help='Genera embeddings desde las carpetas de fotos')
+    p.add_argument('--class_id', type=int, help='Solo los estudiantes de esta clase')
+    p = sub.add_parser('build-index', help='Construye y guarda el indice de busqueda de la galeria')
+    p.add_argument('--kind', type=str, choices=['ivf', 'hnsw'], help='Por defecto GALLERY_INDEX')
+    p.add_argument('--rebuild', action='store_true', help='Descarta el indice guardado')
+    args = parser.parse_args(argv)
+
+    with app.app_context():
+        db.create_all()
+        if args.command == 'import-npy':
+            print('Importados %d embeddings' % import_npy_dir(args.path))
+        elif args.command == 'build-index':
+            if args.kind:
+                app.config['GALLERY_INDEX'] = args.kind
+            model_version = app.config['EMBEDDING_MODEL_VERSION']
+            path = index_path(_index_dir(), model_version, app.config['GALLERY_INDEX'])
+            if args.rebuild and os.path.exists(path):
+                os.remove(path)
+            gallery = load_gallery(model_version, save_index=True)
+            print('Indice %s con %d embeddings en %s' % (gallery.index.kind, len(gallery.index), path))
+        else:
+            query = Student.query
+            if args.class_id:
+                query = query.filter_by(class_id=args.class_id)
+            print('Guardados %d embeddings' % enroll_from_photos(query.all()))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,152 @@
+"""
+Importacion masiva de estudiantes desde CSV, XLSX o JSON.
+
+Las filas se validan por columnas (campos vacios, registros duplicados en el
+fichero y registros ya existentes en la clase, este ultimo con una sola
+consulta) y las validas se insertan con un unico executemany dentro de una
+transaccion. Cada fila puede indicar una carpeta de fotos para el
+enrolamiento por lotes.
+"""
+import csv
+import io
+import os
+from collections import Counter
+
+from attendance import app, db
+from attendance.models import Student
+
+COLUMNS = ('stuname', 'regno', 'mobileno', 'photo_dir')
+REQUIRED = ('stuname', 'regno')
+
+# Encabezados alternativos aceptados en los ficheros (en minusculas)
+ALIASES = {
+    'nombre': 'stuname', 'name': 'stuname', 'estudiante': 'stuname',
+    'registro': 'regno', 'reg no': 'regno', 'reg_no': 'regno',
+    'telefono': 'mobileno', 'teléfono': 'mobileno', 'mobile': 'mobileno',
+    'fotos': 'photo_dir', 'photos': 'photo_dir',
+}
+
+
+class ImportResult:
+    """Resultado de una importacion: filas insertadas y errores por fila."""
+
+    def __init__(self, inserted=0, errors=None):
+        self.inserted = inserted
+        self.errors = errors or []
+
+    def to_dict(self):
+        return {'inserted': self.inserted,
+                'errors': [{'row': row, 'error': msg} for row, msg in self.errors]}
+
+
+def _normalize_header(name):
+    key = (name or '').strip().lower()
+    return ALIASES.get(key, key)
+
+
+def read_csv(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text)
+    header = [_normalize_header(h) for h in next(reader, [])]
+    return [dict(zip(header, row)) for row in reader]
+
+
+def read_xlsx(stream):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError('Se necesita openpyxl para importar ficheros .xlsx')
+    worksheet = load_workbook(stream, read_only=True, data_only=True).active
+    rows = worksheet.iter_rows(values_only=True)
+    header = [_normalize_header(str(h) if h is not None else '') for h in next(rows, ())]
+    return [dict(zip(header, row)) for row in rows]
+
+
+def read_file(file_storage):
+    """Lee un FileStorage subido por el formulario (.csv o .xlsx)."""
+    ext = os.path.splitext(file_storage.filename or '')[1].lower()
+    if ext == '.csv':
+        return read_csv(file_storage.stream)
+    if ext == '.xlsx':
+        return read_xlsx(file_storage.stream)
+    raise ValueError('Formato no soportado: %s (use .csv o .xlsx)' % (ext or 'sin extension'))
+
+
+def _to_columns(rows):
+    columns = {}
+    for name in COLUMNS:
+        values = []
+        for row in rows:
+            value = row.get(name)
+            values.append('' if value is None else str(value).strip())
+        columns[name] = values
+    return columns
+
+
+def validate(rows, class_id, photo_root=None):
+    """Valida las filas por columnas.
+
+    Returns:
+        tuple: (mappings listos para insertar, lista de (fila, error))
+    """
+    columns = _to_columns(rows)
+    nrof_rows = len(rows)
+    bad = {}
+
+    for name in REQUIRED:
+        for i in (i for i, v in enumerate(columns[name]) if not v):
+            bad.setdefault(i, 'Falta el campo %s' % name)
+
+    regnos = columns['regno']
+    counts = Counter(regnos)
+    for i in (i for i, r in enumerate(regnos) if r and counts[r] > 1):
+        bad.setdefault(i, 'Registro %s repetido en el fichero' % regnos[i])
+
+    wanted = {r for r in regnos if r}
+    existing = set()
+    if wanted:
+        existing = set(db.session.execute(
+            db.select(Student.regno).where(Student.class_id == class_id, Student.regno.in_(wanted))).scalars())
+    for i in (i for i, r in enumerate(regnos) if r in existing):
+        bad.setdefault(i, 'Registro %s ya existe en la clase' % regnos[i])
+
+    photo_dirs = columns['photo_dir']
+    if photo_root:
+        for i, d in enumerate(photo_dirs):
+            if d and not os.path.isdir(os.path.join(photo_root, d)):
+                bad.setdefault(i, 'No existe la carpeta de fotos %s' % d)
+
+    mappings = [{'stuname': columns['stuname'][i],
+                 'regno': regnos[i],
+                 'mobileno': columns['mobileno'][i] or None,
+                 'photo_dir': photo_dirs[i] or None,
+                 'class_id': class_id}
+                for i in range(nrof_rows) if i not in bad]
+    # Numeracion de filas como en la hoja de calculo (la 1 es el encabezado)
+    errors = [(i + 2, bad[i]) for i in sorted(bad)]
+    return mappings, errors
+
+
+def insert_students(mappings):
+    """Inserta todas las filas con un executemany en la transaccion actual."""
+    if mappings:
+        db.session.execute(db.insert(Student), mappings)
+    return len(mappings)
+
+
+def import_students(rows, class_id, photo_root=None, commit=True):
+    """Valida e inserta estudiantes en una clase.
+
+    Args:
+        rows: Lista de dicts con las claves de COLUMNS
+        class_id: Clase a la que se asignan los estudiantes
+        photo_root: Directorio base de photo_dir (por defecto FACENET_TRAIN_IMG)
+        commit: Confirmar la transaccion al terminar
+    """
+    if photo_root is None:
+        photo_root = app.config.get('FACENET_TRAIN_IMG')
+    mappings, errors = validate(rows, class_id, photo_root)
+    inserted = insert_students(mappings)
+    if commit:
+        db.session.commit()
+    return ImportResult(inserted, errors)
@@ -0,0 +1,117 @@
+"""
+Migracion de site.db al esquema actual.
+
+- student: anade la columna photo_dir.
+- gallery_version: tabla nueva (la crea db.create_all) con el contador que
+  la galeria usa para detectar cambios hechos desde otros procesos.
+- attendance: la tabla antigua guardaba 'timestamp' como texto libre y una
+  fila por frame reconocido. La migracion la renombra, crea la tabla nueva
+  (fecha, indices y clave unica por estudiante y dia) y copia una fila por
+  (student_id, dia) con la primera y la ultima deteccion.
+- Las horas copiadas del texto antiguo ('YYYY-MM-DD HH:MM:SS') se guardan
+  en el formato de SQLAlchemy ('YYYY-MM-DD HH:MM:SS.ffffff'): SQLite compara
+  el texto y el cursor de /attendance_list repetiria la fila frontera.
+
+Uso:
+    python -m attendance.migrate
+"""
+from sqlalchemy import inspect, text
+
+from attendance import app, db
+from attendance.models import Attendance
+
+LEGACY_TABLE = 'attendance_legacy'
+
+
+def sqlalchemy_datetime(expr):
+    """Expresion SQL que formatea expr como guarda SQLAlchemy un DateTime en SQLite."""
+    # %f da segundos con 3 decimales; SQLAlchemy escribe microsegundos
+    return f"strftime('%Y-%m-%d %H:%M:%f', {expr}) || '000'"
+
+
+def needs_upgrade(engine):
+    """True si la tabla attendance existe y aun no tiene la columna 'date'."""
+    insp = inspect(engine)
+    if not insp.has_table('attendance'):
+        return False
+    columns = {c['name'] for c in insp.get_columns('attendance')}
+    return 'date' not in columns
+
+
+def upgrade_attendance(engine):
+    """Convierte la tabla attendance antigua al esquema nuevo.
+
+    Returns:
+        tuple: (filas antiguas, filas migradas)
+    """
+    if not needs_upgrade(engine):
+        Attendance.__table__.create(engine, checkfirst=True)
+        for index in Attendance.__table__.indexes:
+            index.create(engine, checkfirst=True)
+        return 0, 0
+
+    with engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE attendance RENAME TO {LEGACY_TABLE}'))
+        # Los indices conservan su nombre tras el RENAME; se eliminan para
+        # poder crearlos de nuevo sobre la tabla nueva.
+        for index in inspect(conn).get_indexes(LEGACY_TABLE):
+            conn.execute(text(f'DROP INDEX IF EXISTS {index["name"]}'))
+        Attendance.__table__.create(conn)
+
+        old_rows = conn.execute(text(f'SELECT COUNT(*) FROM {LEGACY_TABLE}')).scalar()
+        conn.execute(text(f'''
+            INSERT INTO attendance (student_id, class_id, date, timestamp, last_seen)
+            SELECT a.student_id, s.class_id, date(a.timestamp),
+                   {sqlalchemy_datetime('MIN(a.timestamp)')}, {sqlalchemy_datetime('MAX(a.timestamp)')}
+            FROM {LEGACY_TABLE} a
+            JOIN student s ON s.id = a.student_id
+            WHERE a.timestamp IS NOT NULL AND date(a.timestamp) IS NOT NULL
+            GROUP BY a.student_id, date(a.timestamp)
+        '''))
+        new_rows = conn.execute(text('SELECT COUNT(*) FROM attendance')).scalar()
+        conn.execute(text(f'DROP TABLE {LEGACY_TABLE}'))
+    return old_rows, new_rows
+
+
+def normalize_timestamps(engine):
+    """Reescribe en el formato de SQLAlchemy las horas que migraciones anteriores copiaron sin microsegundos.
+
+    Returns:
+        int: filas corregidas
+    """
+    with engine.begin() as conn:
+        result = conn.execute(text(f'''
+            UPDATE attendance
+            SET timestamp = {sqlalchemy_datetime('timestamp')}, last_seen = {sqlalchemy_datetime('last_seen')}
+            WHERE length(timestamp) = 19 OR length(last_seen) = 19
+        '''))
+    return result.rowcount
+
+
+def upgrade_students(engine):
+    """Anade a student las columnas que falten (photo_dir)."""
+    columns = {c['name'] for c in inspect(engine).get_columns('student')}
+    if 'photo_dir' in columns:
+        return False
+    with engine.begin() as conn:
+        conn.execute(text('ALTER TABLE student ADD COLUMN photo_dir VARCHAR(500)'))
+    return True
+
+
+def main():
+    with app.app_context():
+        db.create_all()
+        if upgrade_students(db.engine):
+            print('Anadida la columna student.photo_dir')
+        old_rows, new_rows = upgrade_attendance(db.engine)
+        if old_rows:
+            print('Migradas %d filas de asistencia a %d registros diarios' % (old_rows, new_rows))
+        else:
+            print('La tabla attendance ya estaba al dia')
+        fixed = normalize_timestamps(db.engine)
+        if fixed:
+            print('Corregido el formato de la hora en %d registros' % fixed)
+
+
+if __name__ == '__main__':
+    main()
@@ -36,21 +36,140 @@ class Student(db.Model):
     stuname = db.Column(db.String(200), nullable=False)
     regno = db.Column(db.String(200), nullable=False)
     mobileno = db.Column(db.String(200))
+    photo_dir = db.Column(db.String(500))  # carpeta de fotos para enrolar, relativa a FACENET_TRAIN_IMG
 
     class_id = db.Column(db.Integer, db.ForeignKey("class.id"), nullable=False)
 
     def __repr__(self):
         return f"Student('{self.stuname}', '{self.regno}', '{self.mobileno}')"
     
-class Attendance(db.Model):
-    __tablename__ = 'attendance'
+class FaceEmbedding(db.Model):
+    """Embedding de una imagen de enrolamiento, empaquetado como bytes.
+
+    vector guarda dim valores float32 (o float16) contiguos; model_version
+    identifica el modelo que lo genero para no mezclar espacios distintos.
+    """
+    __tablename__ = 'face_embedding'
+    __table_args__ = (
+        db.Index('ix_face_embedding_version_student', 'model_version', 'student_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    student_id = db.Column(db.Integer, db.ForeignKey('student.id'))
-    timestamp = db.Column(db.String)   # <-- COINCIDE EXACTAMENTE CON TU BD
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    model_version = db.Column(db.String(64), nullable=False)
+    dtype = db.Column(db.String(8), nullable=False, default='float32')
+    dim = db.Column(db.Integer, nullable=False)
+    vector = db.Column(db.LargeBinary, nullable=False)
+    source = db.Column(db.String(500))  # imagen de origen
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
 
-    student = db.relationship('Student')
+    student = db.relationship('Student', backref=db.backref('embeddings', lazy=True))
+
+    def __repr__(self):
+        return f"FaceEmbedding('{self.student_id}', '{self.model_version}', '{self.dtype}x{self.dim}')"
+
+
+class GalleryVersion(db.Model):
+    """Contador que avanza con cada alta o baja de embeddings y cambio de clase.
+
+    Una sola fila (id 1). Cada proceso guarda el valor con su galeria en
+    memoria y la recarga cuando cambia, aunque el numero de embeddings y el
+    mayor id sigan siendo los mismos.
+    """
+    __tablename__ = 'gallery_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
 
+    @classmethod
+    def bump(cls, connection):
+        """Avanza el contador dentro de la transaccion de connection.
 
+        Args:
+            connection: Conexion de la transaccion que hace el cambio
+                (db.session.connection() o la de un evento de flush)
+        """
+        stmt = _upsert_insert(connection.dialect.name)(cls.__table__).values(id=1, version=1)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=['id'], set_={'version': cls.__table__.c.version + 1}))
 
+    @classmethod
+    def current(cls):
+        """Subconsulta escalar con la version actual (NULL si nunca ha cambiado)."""
+        return db.select(cls.version).where(cls.id == 1).scalar_subquery()
 
+
+class Attendance(db.Model):
+    """Una fila por estudiante y dia de clase.
+
+    Las detecciones repetidas del mismo dia no crean filas nuevas: solo
+    actualizan last_seen (ver Attendance.mark).
+    """
+    __tablename__ = 'attendance'
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'date', name='uq_attendance_student_date'),
+        db.Index('ix_attendance_class_date', 'class_id', 'date'),
+        db.Index('ix_attendance_date_student', 'date', 'student_id'),
+        db.Index('ix_attendance_timestamp_id', 'timestamp', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    class_id = db.Column(db.Integer, db.ForeignKey('class.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.now)  # primera deteccion
+    last_seen = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    student = db.relationship('Student')
+
+    def __repr__(self):
+        return f"Attendance('{self.student_id}', '{self.date}', '{self.timestamp}')"
+
+    @classmethod
+    def mark(cls, student_id, when=None):
+        """Registra la asistencia de un estudiante de forma idempotente.
+
+        Un unico INSERT ... ON CONFLICT DO UPDATE sobre la clave unica
+        (student_id, date): la primera deteccion del dia crea la fila y las
+        siguientes solo avanzan last_seen.
+
+        Args:
+            student_id: Id del estudiante reconocido
+            when: datetime de la deteccion (por defecto, ahora)
+        """
+        cls.mark_many([(student_id, when or datetime.now())])
+
+    @classmethod
+    def mark_many(cls, marks):
+        """Version por lotes de mark: un executemany dentro de la transaccion actual.
+
+        Args:
+            marks: Iterable de (student_id, datetime)
+        """
+        params = [{'p_student': student_id, 'p_date': when.date(), 'p_when': when}
+                  for student_id, when in marks]
+        if not params:
+            return
+        db.session.execute(cls._upsert_statement(), params)
+
+    @classmethod
+    def _upsert_statement(cls):
+        stmt = _upsert_insert(db.engine.dialect.name)(cls.__table__).values(
+            student_id=db.bindparam('p_student'),
+            class_id=db.select(Student.class_id).where(Student.id == db.bindparam('p_student')).scalar_subquery(),
+            date=db.bindparam('p_date'),
+            timestamp=db.bindparam('p_when'),
+            last_seen=db.bindparam('p_when'),
+        )
+        return stmt.on_conflict_do_update(
+            index_elements=['student_id', 'date'],
+            set_={'last_seen': stmt.excluded.last_seen},
+        )
+
+
+def _upsert_insert(dialect_name):
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
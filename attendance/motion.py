@@ -0,0 +1,169 @@
+"""
+Deteccion condicionada al movimiento para camaras fijas de kiosco.
+
+La mayoria de frames de take.html muestran un pasillo vacio o una escena sin
+cambios. MotionGate compara cada frame (reducido a 1/8 y en grises, el mismo
+que se usa para el hash perceptual) con un fondo que se actualiza como media
+movil. Si cambia menos de min_area del frame no se detecta nada y se reutiliza
+el ultimo resultado del kiosco; si cambia, la deteccion se limita a las
+regiones que han cambiado, ampliadas con un margen.
+"""
+import threading
+import time
+
+import numpy as np
+
+from attendance import app
+
+
+class MotionGate:
+    """Fondo y estadisticas de un kiosco."""
+
+    def __init__(self, threshold=25, min_area=0.002, alpha=0.05, margin=0.5, min_size=16,
+                 max_region_area=0.5):
+        """
+        Args:
+            threshold: Diferencia de gris (0-255) a partir de la cual un pixel cambia
+            min_area: Fraccion del frame que debe cambiar para detectar
+            alpha: Peso del frame nuevo en la media movil del fondo
+            margin: Margen anadido a cada region, relativo a su tamano
+            min_size: Lado minimo de una region en pixeles del frame reducido,
+                para que el detector tenga la cara entera y algo de contexto
+            max_region_area: Si las regiones cubren mas que esto se procesa el frame entero
+        """
+        self.threshold = threshold
+        self.min_area = min_area
+        self.alpha = alpha
+        self.margin = margin
+        self.min_size = min_size
+        self.max_region_area = max_region_area
+        self._background = None
+        self._lock = threading.Lock()
+        self.last_result = None  # ((class_id, tolerance), resultado) del ultimo frame procesado
+        self.last_used = time.time()
+        self.stats = {'frames': 0, 'gated': 0, 'regions': 0, 'full': 0, 'processed_area': 0.0}
+
+    def update(self, small, scale=8):
+        """Actualiza el fondo con un frame reducido en grises.
+
+        Args:
+            small: Frame en grises a 1/scale de resolucion
+            scale: Factor de reduccion respecto al frame completo
+
+        Returns:
+            None si hay que detectar en todo el frame, una lista vacia si no
+            hay movimiento o las regiones (top, right, bottom, left) del frame
+            completo donde detectar
+        """
+        small = np.asarray(small, dtype=np.float32)
+        with self._lock:
+            self.last_used = time.time()
+            self.stats['frames'] += 1
+            if self._background is None or self._background.shape != small.shape:
+                self._background = small.copy()
+                return self._full()
+
+            mask = np.abs(small - self._background) > self.threshold
+            # Media movil: una persona quieta acaba formando parte del fondo
+            self._background += self.alpha * (small - self._background)
+            changed = mask.mean()
+            if changed < self.min_area:
+                self.stats['gated'] += 1
+                return []
+
+            regions = self._regions(mask)
+            area = sum((b - t) * (r - l) for t, r, b, l in regions) / float(mask.size)
+            if not regions or area > self.max_region_area:
+                return self._full()
+            self.stats['regions'] += 1
+            self.stats['processed_area'] += area
+            return [tuple(v * scale for v in region) for region in regions]
+
+    def _full(self):
+        self.stats['full'] += 1
+        self.stats['processed_area'] += 1.0
+        return None
+
+    def _regions(self, mask):
+        import cv2
+
+        height, width = mask.shape
+        mask = cv2.dilate(mask.astype(np.uint8), np.ones((3, 3), np.uint8))
+        nrof_labels, _, boxes, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        regions = []
+        # La etiqueta 0 es el fondo
+        for x, y, w, h, _ in boxes[1:nrof_labels]:
+            mx = max(self.margin * w, (self.min_size - w) / 2.0)
+            my = max(self.margin * h, (self.min_size - h) / 2.0)
+            regions.append((max(0, int(y - my)), min(width, int(np.ceil(x + w + mx))),
+                            min(height, int(np.ceil(y + h + my))), max(0, int(x - mx))))
+        return _merge(regions)
+
+    def metrics(self):
+        with self._lock:
+            return _summary(dict(self.stats))
+
+
+def _summary(stats):
+    frames = stats['frames']
+    stats['gating_ratio'] = stats['gated'] / float(frames) if frames else 0.0
+    stats['mean_processed_area'] = stats.pop('processed_area') / float(frames) if frames else 0.0
+    return stats
+
+
+def _merge(regions):
+    """Une las regiones que se solapan para no detectar dos veces la misma cara."""
+    regions = sorted(regions, key=lambda r: r[3])
+    merged = True
+    while merged:
+        merged = False
+        out = []
+        for t, r, b, l in regions:
+            for i, (t2, r2, b2, l2) in enumerate(out):
+                if l < r2 and l2 < r and t < b2 and t2 < b:
+                    out[i] = (min(t, t2), max(r, r2), max(b, b2), min(l, l2))
+                    merged = True
+                    break
+            else:
+                out.append((t, r, b, l))
+        regions = out
+    return regions
+
+
+class MotionGates:
+    """Un MotionGate por kiosco; los kioscos inactivos se descartan."""
+
+    def __init__(self, idle_seconds=600.0, **options):
+        self.idle_seconds = idle_seconds
+        self.options = options
+        self._lock = threading.Lock()
+        self._gates = {}
+        self._retired = {'frames': 0, 'gated': 0, 'regions': 0, 'full': 0, 'processed_area': 0.0}
+
+    def get(self, kiosk):
+        now = time.time()
+        with self._lock:
+            gate = self._gates.get(kiosk)
+            if gate is None:
+                for key in [k for k, g in self._gates.items() if now - g.last_used > self.idle_seconds]:
+                    for name, value in self._gates.pop(key).stats.items():
+                        self._retired[name] += value
+                gate = self._gates[kiosk] = MotionGate(**self.options)
+            return gate
+
+    def metrics(self):
+        with self._lock:
+            gates = list(self._gates.values())
+            totals = dict(self._retired)
+        for gate in gates:
+            with gate._lock:
+                for name, value in gate.stats.items():
+                    totals[name] += value
+        totals['kiosks'] = len(gates)
+        return _summary(totals)
+
+
+motion_gates = MotionGates(threshold=app.config.get('MOTION_THRESHOLD', 25),
+                           min_area=app.config.get('MOTION_MIN_AREA', 0.002),
+                           alpha=app.config.get('MOTION_ALPHA', 0.05),
+                           margin=app.config.get('MOTION_REGION_MARGIN', 0.5))
@@ -0,0 +1,167 @@
+"""
+Cache en memoria de estudiantes ya marcados en la sesion (dia) actual.
+
+Con la camara enviando frames continuamente, el mismo estudiante se reconoce
+decenas de veces por minuto. PresenceBuffer descarta en memoria los
+reconocimientos ya registrados hoy y acumula los nuevos para escribirlos por
+lotes en una sola transaccion, por numero de marcas o por tiempo.
+"""
+import atexit
+import signal
+import threading
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from attendance import app, db
+from attendance.models import Attendance
+
+
+class PresenceBuffer:
+    """Marca asistencias sin una escritura en SQLite por cada frame."""
+
+    def __init__(self, flush_interval=5.0, flush_count=50):
+        """
+        Args:
+            flush_interval: Segundos maximos que una marca espera en memoria
+            flush_count: Numero de marcas pendientes que fuerza un flush
+        """
+        self.flush_interval = flush_interval
+        self.flush_count = flush_count
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._day = None
+        self._seen = set()
+        self._pending = []
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'hits': 0, 'marked': 0, 'flushes': 0, 'dropped': 0}
+
+    def mark(self, student_id, when=None):
+        """Registra al estudiante si aun no estaba marcado hoy.
+
+        Returns:
+            bool: True si es la primera deteccion del dia
+        """
+        when = when or datetime.now()
+        with self._lock:
+            if self._day != when.date():
+                self._load_day(when.date())
+            if student_id in self._seen:
+                self.stats['hits'] += 1
+                return False
+            self._seen.add(student_id)
+            self._pending.append((student_id, when))
+            self.stats['marked'] += 1
+            flush_now = len(self._pending) >= self.flush_count
+        self._ensure_thread()
+        if flush_now:
+            self.flush()
+        return True
+
+    def is_marked(self, student_id, day=None):
+        with self._lock:
+            return self._day == (day or datetime.now().date()) and student_id in self._seen
+
+    def flush(self):
+        """Escribe todas las marcas pendientes en una unica transaccion.
+
+        Si la escritura falla (p. ej. la base de datos bloqueada), las marcas
+        vuelven a la cola para el siguiente intento en lugar de perderse.
+        Una marca que viola una restriccion no se reintenta: bloquearia para
+        siempre a todas las que llegan detras.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            try:
+                with app.app_context():
+                    written = self._write(pending)
+            except BaseException:
+                # BaseException: tambien un SystemExit (SIGTERM) a mitad de flush;
+                # el upsert es idempotente y el flush de atexit las reescribe
+                with self._lock:
+                    self._pending = pending + self._pending
+                raise
+            self.stats['flushes'] += 1
+            return written
+
+    def _write(self, pending):
+        try:
+            Attendance.mark_many(pending)
+            db.session.commit()
+            return len(pending)
+        except IntegrityError:
+            db.session.rollback()
+        # Fila a fila para aislar las marcas invalidas (p. ej. un estudiante
+        # borrado entre el reconocimiento y el flush)
+        written = 0
+        for student_id, when in pending:
+            try:
+                Attendance.mark_many([(student_id, when)])
+                db.session.commit()
+                written += 1
+            except IntegrityError as e:
+                db.session.rollback()
+                self.stats['dropped'] += 1
+                app.logger.warning('Asistencia descartada (estudiante %s, %s): %s', student_id, when, e.orig)
+        return written
+
+    def close(self):
+        """Detiene el hilo de flush periodico y vacia la cola."""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.flush_interval)
+        self.flush()
+
+    def _load_day(self, day):
+        # Cambio de sesion: las marcas pendientes del dia anterior siguen en
+        # la cola; solo se reinicia el conjunto de presentes con lo que ya
+        # esta en la base de datos para ese dia.
+        with app.app_context():
+            rows = db.session.execute(
+                db.select(Attendance.student_id).where(Attendance.date == day)).scalars()
+            self._seen = set(rows)
+        self._day = day
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='presence-flush', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                app.logger.warning('No se pudieron guardar las asistencias: %s', e)
+
+
+presence = PresenceBuffer(
+    flush_interval=app.config.get('PRESENCE_FLUSH_INTERVAL', 5.0),
+    flush_count=app.config.get('PRESENCE_FLUSH_COUNT', 50),
+)
+atexit.register(presence.close)
+
+
+def _exit_on_sigterm(signum, frame):
+    # Sin flush aqui: el manejador corre en el hilo principal, que puede tener
+    # tomado _lock o _flush_lock (no reentrantes). SystemExit deshace la pila,
+    # liberando los locks, y el presence.close registrado en atexit vacia la cola.
+    if callable(_previous_sigterm):
+        _previous_sigterm(signum, frame)
+    elif _previous_sigterm != signal.SIG_IGN:
+        raise SystemExit(128 + signum)
+
+
+# Los servidores envian SIGTERM al parar; con la accion por defecto el proceso
+# muere sin ejecutar atexit.
+_previous_sigterm = None
+if threading.current_thread() is threading.main_thread():
+    _previous_sigterm = signal.getsignal(signal.SIGTERM)
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
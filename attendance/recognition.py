@@ -0,0 +1,240 @@
+"""
+Reconocimiento facial con carga diferida.
+
+TensorFlow, OpenCV, FaceNet, MTCNN y face_recognition solo se importan la
+primera vez que una ruta de reconocimiento los necesita. Asi /login, /home y
+el resto de la aplicacion arrancan sin pagar el coste de la pila de ML.
+"""
+import os
+import pickle
+import threading
+
+from attendance import app
+
+_recognizer = None
+_recognizer_lock = threading.Lock()
+
+
+class FacenetRecognizer:
+    """Pipeline MTCNN + FaceNet + SVM que usa /face_recog.
+
+    El grafo, la sesion y el clasificador se cargan una sola vez y se
+    reutilizan entre peticiones.
+    """
+
+    minsize = 20  # minimum size of face
+    threshold = [0.6, 0.7, 0.7]  # three steps's threshold
+    factor = 0.709  # scale factor
+    image_size = 160
+    # Solo con align_landmarks: align_dataset_mtcnn usa 182 px con margen 44
+    # y el entrenamiento recorta el centro a 160, en 160 px quedan 22 px
+    margin = 22
+    min_probability = 0.43
+
+    def __init__(self, model_dir, classifier_filename, train_img, gpu_memory_fraction=0.6, threshold=None,
+                 align_landmarks=False):
+        """
+        Args:
+            model_dir: Directorio (o .pb) del modelo FaceNet
+            classifier_filename: Pickle con (modelo SVM, nombres de clase)
+            train_img: Directorio con una carpeta por estudiante
+            gpu_memory_fraction: Fraccion maxima de memoria de GPU
+            threshold: Umbrales de las tres redes de MTCNN (por defecto los de la clase)
+            align_landmarks: Alinear las caras con sus cinco landmarks en vez
+                de recortar la caja. Solo sirve con un clasificador entrenado
+                sobre caras alineadas (align_dataset_mtcnn --align_landmarks)
+        """
+        import tensorflow as tf
+        import attendance.facenet.src.facenet as facenet
+        from attendance.facenet.src.align import detect_face, landmarks
+
+        self._facenet = facenet
+        self._detect_face = detect_face
+        self._landmarks = landmarks
+        self.align_landmarks = align_landmarks
+        if threshold is not None:
+            self.threshold = list(threshold)
+
+        # Carpetas de train_img en orden; solo se listan las carpetas, no las fotos
+        self.human_names = sorted(name for name in os.listdir(train_img)
+                                  if os.path.isdir(os.path.join(train_img, name)))
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=gpu_memory_fraction)
+            self.sess = tf.Session(config=tf.ConfigProto(gpu_options=gpu_options, log_device_placement=False))
+            with self.sess.as_default():
+                self.pnet, self.rnet, self.onet = detect_face.create_mtcnn(self.sess, None)
+
+                print('Loading feature extraction model')
+                facenet.load_model(model_dir)
+
+                self.images_placeholder = self.graph.get_tensor_by_name("input:0")
+                self.embeddings = self.graph.get_tensor_by_name("embeddings:0")
+                self.phase_train_placeholder = self.graph.get_tensor_by_name("phase_train:0")
+
+        with open(os.path.expanduser(classifier_filename), 'rb') as infile:
+            (self.model, self.class_names) = pickle.load(infile)
+
+    def embed(self, frame):
+        """Detecta las caras de un frame y calcula sus embeddings.
+
+        Cada cara se recorta de su caja y se escala a 160x160, como las fotos
+        con las que se entreno my_classifier.pkl. Con align_landmarks se
+        alinea en cambio con sus cinco landmarks de MTCNN directamente desde
+        el frame. Todas pasan por FaceNet en un solo batch.
+
+        Args:
+            frame: Imagen RGB o en escala de grises
+
+        Returns:
+            tuple: (cajas (n, 4) x1, y1, x2, y2, embeddings (n, dim))
+        """
+        import cv2
+        import numpy as np
+
+        if frame.ndim == 2:
+            frame = self._facenet.to_rgb(frame)
+        frame = frame[:, :, 0:3]
+
+        bounding_boxes, points = self._detect_face.detect_face(
+            frame, self.minsize, self.pnet, self.rnet, self.onet, self.threshold, self.factor)
+        nrof_faces = bounding_boxes.shape[0]
+        print('Face Detected: %d' % nrof_faces)
+
+        bb = bounding_boxes[:, 0:4].astype(np.int32)
+        # inner exception
+        keep = (bb[:, 0] > 0) & (bb[:, 1] > 0) & (bb[:, 2] < frame.shape[1]) & (bb[:, 3] < frame.shape[0])
+        if not keep.all():
+            print('face is too close')
+        bb = bb[keep]
+        if len(bb) == 0:
+            return bb, np.zeros((0, int(self.embeddings.get_shape()[1])), np.float32)
+
+        if self.align_landmarks:
+            faces = self._landmarks.align_faces(frame, points[:, keep], self.image_size, self.margin)
+        else:
+            faces = [cv2.resize(frame[y1:y2, x1:x2], (self.image_size, self.image_size),
+                                interpolation=cv2.INTER_LINEAR) for x1, y1, x2, y2 in bb]
+        images = np.stack([self._facenet.prewhiten(face) for face in faces])
+        feed_dict = {self.images_placeholder: images, self.phase_train_placeholder: False}
+        return bb, self.sess.run(self.embeddings, feed_dict=feed_dict)
+
+    def recognize(self, frame, allowed_names=None):
+        """Detecta y clasifica todas las caras de un frame RGB.
+
+        Args:
+            frame: Imagen RGB o en escala de grises
+            allowed_names: Si se indica, solo se consideran esos estudiantes
+                (p. ej. los de la clase del kiosco)
+
+        Returns:
+            list: Un dict por cara con 'name', 'probability' y 'box'
+        """
+        import numpy as np
+
+        bb, emb_array = self.embed(frame)
+        results = []
+        if len(bb) == 0:
+            return results
+
+        predictions = self.model.predict_proba(emb_array)
+        if allowed_names is not None:
+            allowed = np.array([name in allowed_names for name in self.human_names])
+            predictions = np.where(allowed[:predictions.shape[1]], predictions, 0.0)
+        best_class_indices = np.argmax(predictions, axis=1)
+        for i, best_class_index in enumerate(best_class_indices):
+            results.append({
+                'name': self.human_names[best_class_index],
+                'probability': float(predictions[i, best_class_index]),
+                'box': tuple(int(v) for v in bb[i]),
+            })
+        return results
+
+
+def get_recognizer():
+    """Devuelve el reconocedor FaceNet, creandolo en la primera llamada."""
+    global _recognizer
+    if _recognizer is None:
+        with _recognizer_lock:
+            if _recognizer is None:
+                _recognizer = FacenetRecognizer(
+                    app.config['FACENET_MODEL_DIR'],
+                    app.config['FACENET_CLASSIFIER'],
+                    app.config['FACENET_TRAIN_IMG'],
+                    threshold=app.config.get('MTCNN_THRESHOLD'),
+                    align_landmarks=app.config.get('FACENET_ALIGN_LANDMARKS', False),
+                )
+    return _recognizer
+
+
+def _data_url_buffer(data_url):
+    import base64
+    import numpy as np
+
+    encoded = data_url.split(",", 1)[1]
+    return np.frombuffer(base64.b64decode(encoded), np.uint8)
+
+
+def decode_data_url(data_url):
+    """Convierte una imagen 'data:image/...;base64,...' en un array RGB."""
+    import cv2
+
+    img = cv2.imdecode(_data_url_buffer(data_url), cv2.IMREAD_COLOR)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+REDUCED_SCALE = 8
+
+
+def decode_reduced(data_url):
+    """Frame 'data:image/...;base64,...' en grises a 1/REDUCED_SCALE de resolucion.
+
+    El JPEG se decodifica directamente a baja resolucion, mucho mas barato que
+    la decodificacion completa que necesita la deteccion.
+    """
+    import cv2
+
+    return cv2.imdecode(_data_url_buffer(data_url), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+
+
+def frame_hash(small):
+    """dHash de 256 bits de un frame reducido (ver decode_reduced)."""
+    import cv2
+    from attendance.frame_cache import dhash
+
+    return dhash(cv2.resize(small, (17, 16), interpolation=cv2.INTER_AREA))
+
+
+def face_encodings(img, locations=None):
+    """Encodings de face_recognition (dlib) para las caras de la imagen."""
+    import face_recognition
+
+    return face_recognition.face_encodings(img, known_face_locations=locations)
+
+
+def face_locations(img, regions=None):
+    """Caras de la imagen como (top, right, bottom, left).
+
+    Con regions solo se busca dentro de esas regiones (top, right, bottom,
+    left) y las cajas se devuelven en coordenadas de la imagen completa.
+    """
+    import face_recognition
+
+    if regions is None:
+        return face_recognition.face_locations(img)
+    locations = []
+    for top, right, bottom, left in regions:
+        top, left = max(0, top), max(0, left)
+        bottom, right = min(img.shape[0], bottom), min(img.shape[1], right)
+        if bottom <= top or right <= left:
+            continue
+        for t, r, b, l in face_recognition.face_locations(img[top:bottom, left:right]):
+            locations.append((t + top, r + left, b + top, l + left))
+    return locations
+
+
+def load_image(path):
+    import face_recognition
+
+    return face_recognition.load_image_file(path)
@@ -0,0 +1,211 @@
+"""
+Reportes de asistencia en Excel o CSV generados desde la base de datos.
+
+Cada reporte tiene una hoja por clase con una fila por estudiante y una
+columna por dia. Las filas se escriben en orden y de una sola vez, por lo que
+xlsxwriter puede trabajar en modo constant_memory. Los reportes se generan en
+un hilo aparte; la ruta solo encola el trabajo y devuelve un enlace de
+descarga cuando esta listo.
+
+El estado de cada trabajo se guarda en <job_id>.json junto al reporte, asi
+que cualquier worker de gunicorn responde a las consultas de estado y a las
+descargas. Los ficheros de mas de REPORTS_TTL segundos se borran al encolar
+el siguiente reporte y el rango de fechas se limita a REPORTS_MAX_DAYS dias.
+"""
+import csv
+import json
+import os
+import re
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from attendance import app, db
+from attendance.models import Attendance, Class, Student
+
+PRESENT = 'Presente'
+ABSENT = 'Ausente'
+
+
+def _date_range(date_from, date_to):
+    days = []
+    day = date_from
+    while day <= date_to:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def _class_rows(class_obj, days):
+    """Genera (nombre, regno, [estado por dia]) para cada estudiante de la clase."""
+    present = defaultdict(set)
+    stmt = (db.select(Attendance.student_id, Attendance.date)
+            .where(Attendance.class_id == class_obj.id,
+                   Attendance.date >= days[0], Attendance.date <= days[-1])
+            .execution_options(yield_per=1000))
+    for student_id, day in db.session.execute(stmt):
+        present[student_id].add(day)
+
+    students = db.session.execute(
+        db.select(Student.id, Student.stuname, Student.regno)
+        .where(Student.class_id == class_obj.id)
+        .order_by(Student.stuname))
+    for student_id, stuname, regno in students:
+        seen = present.get(student_id, ())
+        yield stuname, regno, [PRESENT if day in seen else ABSENT for day in days]
+
+
+def _sheet_name(class_obj, used):
+    # Excel limita los nombres de hoja a 31 caracteres, sin []:*?/\ y unicos.
+    name = ''.join(c for c in class_obj.classname if c not in '[]:*?/\\')[:31] or 'Clase'
+    base, n = name, 1
+    while name.lower() in used:
+        n += 1
+        suffix = ' (%d)' % n
+        name = base[:31 - len(suffix)] + suffix
+    used.add(name.lower())
+    return name
+
+
+def write_xlsx(path, classes, days):
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    bold = workbook.add_format({'bold': True})
+    used = set()
+    try:
+        for class_obj in classes:
+            worksheet = workbook.add_worksheet(_sheet_name(class_obj, used))
+            header = ['Estudiante', 'Reg No'] + [d.isoformat() for d in days]
+            worksheet.write_row(0, 0, header, bold)
+            for row, (stuname, regno, states) in enumerate(_class_rows(class_obj, days), start=1):
+                worksheet.write_row(row, 0, [stuname, regno] + states)
+    finally:
+        workbook.close()
+
+
+def write_csv(path, classes, days):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Clase', 'Estudiante', 'Reg No'] + [d.isoformat() for d in days])
+        for class_obj in classes:
+            for stuname, regno, states in _class_rows(class_obj, days):
+                writer.writerow([class_obj.classname, stuname, regno] + states)
+
+
+WRITERS = {'xlsx': write_xlsx, 'csv': write_csv}
+
+
+def build_report(path, date_from, date_to=None, class_ids=None, fmt='xlsx'):
+    """Escribe el reporte de asistencia en path.
+
+    Args:
+        path: Fichero de salida
+        date_from: Primer dia del reporte
+        date_to: Ultimo dia (por defecto, date_from)
+        class_ids: Clases a incluir (por defecto, todas)
+        fmt: 'xlsx' o 'csv'
+    """
+    days = _date_range(date_from, date_to or date_from)
+    query = Class.query.order_by(Class.classname)
+    if class_ids:
+        query = query.filter(Class.id.in_(class_ids))
+    WRITERS[fmt](path, query.all(), days)
+    return path
+
+
+_JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ReportJobs:
+    """Genera reportes en un hilo de fondo y guarda su estado en disco por id."""
+
+    def __init__(self, output_dir, max_workers=1):
+        self.output_dir = output_dir
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='reports')
+
+    def submit(self, date_from, date_to=None, class_ids=None, fmt='xlsx'):
+        """Encola un reporte y devuelve su id.
+
+        Raises:
+            ValueError: Formato desconocido, date_to anterior a date_from o
+                mas de REPORTS_MAX_DAYS dias
+        """
+        if fmt not in WRITERS:
+            raise ValueError('Formato de reporte no soportado: %s' % fmt)
+        date_to = date_to or date_from
+        if date_to < date_from:
+            raise ValueError('La fecha final es anterior a la inicial')
+        max_days = app.config.get('REPORTS_MAX_DAYS', 366)
+        if (date_to - date_from).days + 1 > max_days:
+            raise ValueError('El reporte no puede cubrir mas de %d dias' % max_days)
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.cleanup()
+        job_id = uuid.uuid4().hex
+        filename = 'Report_for_%s_%s.%s' % (datetime.now().strftime('%Y_%m_%d-%H%M%S'), job_id[:8], fmt)
+        job = {'status': 'pending', 'filename': filename, 'error': None}
+        self._save(job_id, job)
+        self._executor.submit(self._run, job_id, job, os.path.join(self.output_dir, filename),
+                              date_from, date_to, class_ids, fmt)
+        return job_id
+
+    def get(self, job_id):
+        if not _JOB_ID.match(job_id):
+            return None
+        try:
+            with open(self._state_path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def path(self, job_id):
+        job = self.get(job_id)
+        return os.path.join(self.output_dir, job['filename']) if job else None
+
+    def cleanup(self, now=None):
+        """Borra los reportes y estados de mas de REPORTS_TTL segundos."""
+        ttl = app.config.get('REPORTS_TTL', 24 * 3600)
+        now = time.time() if now is None else now
+        removed = 0
+        try:
+            entries = list(os.scandir(self.output_dir))
+        except FileNotFoundError:
+            return removed
+        for entry in entries:
+            try:
+                if entry.is_file() and now - entry.stat().st_mtime > ttl:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                # Otro worker lo ha borrado antes
+                pass
+        return removed
+
+    def _state_path(self, job_id):
+        return os.path.join(self.output_dir, job_id + '.json')
+
+    def _save(self, job_id, job):
+        # Temporal y os.replace: otro worker nunca lee un estado a medias
+        path = self._state_path(job_id)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp, path)
+
+    def _run(self, job_id, job, path, date_from, date_to, class_ids, fmt):
+        job['status'] = 'running'
+        self._save(job_id, job)
+        try:
+            with app.app_context():
+                build_report(path, date_from, date_to, class_ids, fmt)
+        except Exception as e:
+            app.logger.exception('Error generando el reporte %s', path)
+            job['status'], job['error'] = 'failed', str(e)
+        else:
+            job['status'] = 'done'
+        self._save(job_id, job)
+
+
+report_jobs = ReportJobs(app.config.get('REPORTS_DIR') or os.path.join(app.instance_path, 'reports'))
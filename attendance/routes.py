@@ -2,29 +2,24 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from flask import render_template,url_for,flash,redirect,request,jsonify,abort,make_response
+from flask import render_template,url_for,flash,redirect,request,jsonify,abort,make_response,Response,stream_with_context,send_file
 from attendance import app, db, bcrypt
-from attendance.forms import RegistrationForm, LoginForm, AddForm, EditForm
+from attendance.forms import RegistrationForm, LoginForm, AddForm, EditForm, ImportForm
 from attendance.models import User, Class, Student, Attendance
 from flask_login import login_user, current_user, logout_user, login_required
+from sqlalchemy.orm import contains_eager
 
 import os
-import pickle
 import sys
-import time
-import cv2
-import numpy as np
-import tensorflow as tf
-from scipy import misc
-import attendance.facenet.src.facenet as facenet
-from facenet.src.align import detect_face
-from keras.models import load_model
-from flask_httpauth import HTTPBasicAuth
-import sqlite3
-import xlsxwriter
+import csv
+import io
+import json
 import datetime
-import requests
+from flask_httpauth import HTTPBasicAuth
 from werkzeug.utils import secure_filename
+from attendance import recognition as recog, importer
+from attendance.presence import presence
+from attendance.reports import report_jobs
 
 auth = HTTPBasicAuth()
 
@@ -83,32 +78,67 @@ def add():
             co_email=form.co_email.data
         )
         db.session.add(new_class)
-        db.session.commit()  # Para obtener el new_class.id
+        db.session.flush()  # Para obtener el new_class.id
 
-        # Procesar estudiantes dinámicos
+        # Procesar estudiantes dinámicos (un solo INSERT por lotes)
+        rows = []
         for key in request.form:
             if key.startswith("stuname_"):
                 num = key.split("_")[1]
-                stuname = request.form.get(f"stuname_{num}")
-                regno = request.form.get(f"regno_{num}")
-                mobileno = request.form.get(f"mobileno_{num}")
-
-                student = Student(
-                    stuname=stuname,
-                    regno=regno,
-                    mobileno=mobileno,
-                    class_id=new_class.id
-                )
-                db.session.add(student)
-
+                rows.append({
+                    "stuname": request.form.get(f"stuname_{num}"),
+                    "regno": request.form.get(f"regno_{num}"),
+                    "mobileno": request.form.get(f"mobileno_{num}"),
+                })
+        result = importer.import_students(rows, new_class.id, commit=False)
         db.session.commit()
-        
+
+        for row, error in result.errors:
+            flash(f"Estudiante {row - 1}: {error}", "warning")
         flash("La clase y los estudiantes fueron guardados correctamente", "success")
         return redirect(url_for("home"))
 
     return render_template("add.html", title="Adding Class", form=form)
 
 
+@app.route("/import", methods=['GET','POST'])
+@login_required
+def import_students():
+    form = ImportForm()
+    form.class_id.choices = [(c.id, c.classname) for c in Class.query.order_by(Class.classname)]
+
+    if form.validate_on_submit():
+        try:
+            rows = importer.read_file(form.file.data)
+        except ValueError as e:
+            flash(str(e), "danger")
+            return render_template("import.html", title="Importar Estudiantes", form=form)
+
+        result = importer.import_students(rows, form.class_id.data)
+        for row, error in result.errors[:20]:
+            flash(f"Fila {row}: {error}", "warning")
+        if len(result.errors) > 20:
+            flash(f"... y {len(result.errors) - 20} filas mas con errores", "warning")
+        flash(f"Se importaron {result.inserted} estudiantes", "success")
+        return redirect(url_for("import_students"))
+
+    return render_template("import.html", title="Importar Estudiantes", form=form)
+
+
+@app.route("/api/classes/<int:class_id>/students", methods=["POST"])
+@login_required
+def api_import_students(class_id):
+    """Importa estudiantes enviados como JSON: {"students": [{...}, ...]}."""
+    if db.session.get(Class, class_id) is None:
+        abort(404)
+    data = request.get_json(silent=True) or {}
+    rows = data.get("students")
+    if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+        return jsonify({"error": "Se esperaba {\"students\": [...]}"}), 400
+    result = importer.import_students(rows, class_id)
+    return jsonify(result.to_dict()), (201 if result.inserted else 200)
+
+
 @app.route("/edit",methods=['GET','POST'])
 @login_required
 def edit():
@@ -122,7 +152,9 @@ def edit():
 @app.route("/take")
 @login_required
 def take():
-	return render_template('take.html',title="Take Attendance")		
+	classes = Class.query.order_by(Class.classname).all()
+	return render_template('take.html',title="Take Attendance",classes=classes,
+		class_id=request.args.get('class_id', type=int))		
 
 @app.route("/logout")
 def logout():
@@ -135,139 +167,93 @@ def recognition():
 	
 @app.route("/face_recog", methods=['GET','POST'])
 def face_recog():
+	import cv2
+
 	if request.method == "POST":
 		file=request.files["image"]
 		filename = secure_filename(file.filename)
 	names = []	
 	img_name=str(filename)	
 	img_path="attendance/facenet/dataset/test-images/"+img_name
-	modeldir = "attendance/facenet/src/20180402-114759/"
-	classifier_filename = "attendance/facenet/src/20180402-114759/my_classifier.pkl"
-	npy=""
-	train_img="attendance/facenet/dataset/raw"
-
-	workbook = xlsxwriter.Workbook('C:\\Users\\Dell\\Attendance\\Reports\\Report_for_'+ datetime.datetime.now().strftime("%Y_%m_%d-%H")+'.xlsx')
-	worksheet = workbook.add_worksheet()
-	conn = sqlite3.connect('C:\\Users\\Dell\\Attendance\\attendance\\site.db')
-	c = conn.cursor()
-	students = c.execute("SELECT stuname FROM 'add'")
-
-	with tf.Graph().as_default():
-		gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=0.6)
-		sess = tf.Session(config=tf.ConfigProto(gpu_options=gpu_options, log_device_placement=False))
-		with sess.as_default():
-			pnet, rnet, onet = detect_face.create_mtcnn(sess, npy)
-			
-			minsize = 20  # minimum size of face
-			threshold = [0.6, 0.7, 0.7]  # three steps's threshold
-			factor = 0.709  # scale factor
-			margin = 32
-			frame_interval = 3
-			batch_size = 1000
-			image_size = 160
-			input_image_size = 160
-
-			HumanNames = os.listdir(train_img)
-			HumanNames.sort()
-
-			print('Loading feature extraction model')
-			facenet.load_model(modeldir)
-
-			images_placeholder = tf.get_default_graph().get_tensor_by_name("input:0")
-			embeddings = tf.get_default_graph().get_tensor_by_name("embeddings:0")
-			phase_train_placeholder = tf.get_default_graph().get_tensor_by_name("phase_train:0")
-			embedding_size = embeddings.get_shape()[1]
-
-			classifier_filename_exp = os.path.expanduser(classifier_filename)
-			with open(classifier_filename_exp, 'rb') as infile:
-				(model, class_names) = pickle.load(infile)
-			# video_capture = cv2.VideoCapture("akshay_mov.mp4")
-			c = 0 
-
-			print('Start Recognition!')
-			prevTime = 0
-			# ret, frame = video_capture.read()
-			frame = cv2.imread(img_path,0)
-			#frame = cv2.resize(frame, (0,0), fx=0.5, fy=0.5)    #resize frame (optional)
-			curTime = time.time()+1    # calc fps
-			timeF = frame_interval
-			if (c % timeF == 0):
-				find_results = []
-				if frame.ndim == 2:
-					frame = facenet.to_rgb(frame)
-				frame = frame[:, :, 0:3]
-				bounding_boxes, _ = detect_face.detect_face(frame, minsize, pnet, rnet, onet, threshold, factor)
-				nrof_faces = bounding_boxes.shape[0]
-				print('Face Detected: %d' % nrof_faces)   				
-				if nrof_faces > 0:
-					det = bounding_boxes[:, 0:4]
-					img_size = np.asarray(frame.shape)[0:2]
-					cropped = []
-					scaled = []
-					scaled_reshape = []
-					bb = np.zeros((nrof_faces,4), dtype=np.int32)
-				for i in range(nrof_faces):
-					emb_array = np.zeros((1, embedding_size))
-					bb[i][0] = det[i][0]
-					bb[i][1] = det[i][1]
-					bb[i][2] = det[i][2]
-					bb[i][3] = det[i][3]
-					#inner exception
-					if bb[i][0] <= 0 or bb[i][1] <= 0 or bb[i][2] >= len(frame[0]) or bb[i][3] >= len(frame):
-						print('face is too close')
-						break
-					cropped.append(frame[bb[i][1]:bb[i][3], bb[i][0]:bb[i][2], :])
-					cropped[i] = facenet.flip(cropped[i], False)
-					scaled.append(misc.imresize(cropped[i], (image_size, image_size), interp='bilinear'))
-					scaled[i] = cv2.resize(scaled[i], (input_image_size,input_image_size),
-										   interpolation=cv2.INTER_CUBIC)
-					scaled[i] = facenet.prewhiten(scaled[i])
-					scaled_reshape.append(scaled[i].reshape(-1,input_image_size,input_image_size,3))
-					feed_dict = {images_placeholder: scaled_reshape[i], phase_train_placeholder: False}
-					emb_array[0, :] = sess.run(embeddings, feed_dict=feed_dict)
-					predictions = model.predict_proba(emb_array)
-					#print(predictions)
-					best_class_indices = np.argmax(predictions, axis=1)
-					# no print(best_class_indices)
-					best_class_probabilities = predictions[np.arange(len(best_class_indices)), best_class_indices]
-					#print(best_class_probabilities)
-					cv2.rectangle(frame, (bb[i][0], bb[i][1]), (bb[i][2], bb[i][3]), (0, 255, 0), 2)    #boxing face
-					#plot result idx under box
-					text_x = bb[i][0]
-					text_y = bb[i][3] + 20
-					#print('Result Indices: ', best_class_indices[0])
-					print(HumanNames[best_class_indices[0]])
-					names.append(HumanNames[best_class_indices[0]])
-					for H_i in HumanNames:
-						if HumanNames[best_class_indices[0]] == H_i and best_class_probabilities > 0.43:
-							result_names = HumanNames[best_class_indices[0]]
-							cv2.putText(frame, result_names, (text_x, text_y), cv2.FONT_HERSHEY_COMPLEX_SMALL,1, (0, 0, 255), thickness=1, lineType=1)
-			else:
-				print('Unable to align')
-
-	for i, row in enumerate(students):
-		for j, value in enumerate(row):
-			worksheet.write_string(i,j+2,'Absent')
-			for name in names:
-				if name == value:
-					worksheet.write_string(i,j+2,'Present') 
-			worksheet.write_string(i,j, str(value))	
-
-	# reg_no = c.execute("SELECT regno FROM 'add'")
-	# for i, row in enumerate(reg_no):
-	# 	for j, value in enumerate(row):
-	# 		worksheet.write(i,j+1,value)
+	class_id = request.form.get('class_id', type=int)
+
+	# Con una clase elegida el clasificador solo considera a sus estudiantes
+	allowed_names = None
+	if class_id:
+		allowed_names = set(db.session.execute(
+			db.select(Student.stuname).where(Student.class_id == class_id)).scalars())
+
+	from attendance.calibration import thresholds
+
+	recognizer = recog.get_recognizer()
+	print('Start Recognition!')
+	frame = cv2.imread(img_path,0)
+	for face in recognizer.recognize(frame, allowed_names):
+		x1, y1, x2, y2 = face['box']
+		cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)    #boxing face
+		print(face['name'])
+		if face['probability'] > thresholds.get('min_probability'):
+			names.append(face['name'])
+			cv2.putText(frame, face['name'], (x1, y2 + 20), cv2.FONT_HERSHEY_COMPLEX_SMALL,1, (0, 0, 255), thickness=1, lineType=1)
+
+	# Registrar a los reconocidos y generar el reporte del dia en segundo plano
+	if names:
+		for student in Student.query.filter(Student.stuname.in_(set(names))):
+			presence.mark(student.id)
+		presence.flush()
+	job_id = report_jobs.submit(datetime.date.today(), class_ids=[class_id] if class_id else None)
 
 	cv2.imshow('Image', frame)
 	cv2.imwrite('output/'+img_path.split('/')[-1],frame)
 	if cv2.waitKey(9000) & 0xFF == ord('q'):
 		sys.exit("Thanks")
-	workbook.close()		
 	cv2.destroyAllWindows() 
 	flash('The students faces were recognized successfully!','success')
-	return render_template('take.html',title="Take Attendance")	                   
+	return redirect(url_for('report_status', job_id=job_id))	                   
+
 
 
+@app.route("/reports", methods=['GET','POST'])
+@login_required
+def reports():
+	if request.method == 'POST':
+		date_from = _parse_form_date('date_from') or datetime.date.today()
+		date_to = _parse_form_date('date_to') or date_from
+		class_ids = request.form.getlist('class_id', type=int)
+		fmt = request.form.get('format', 'xlsx')
+		try:
+			job_id = report_jobs.submit(date_from, date_to, class_ids or None, fmt)
+		except ValueError:
+			# Formato desconocido o rango de fechas invertido o demasiado largo
+			abort(400)
+		return redirect(url_for('report_status', job_id=job_id))
+	classes = Class.query.order_by(Class.classname).all()
+	return render_template('reports.html', title='Reportes', classes=classes, job=None)
+
+@app.route("/reports/<job_id>")
+@login_required
+def report_status(job_id):
+	job = report_jobs.get(job_id)
+	if job is None:
+		abort(404)
+	return render_template('reports.html', title='Reportes', job=job, job_id=job_id)
+
+@app.route("/reports/<job_id>/download")
+@login_required
+def report_download(job_id):
+	job = report_jobs.get(job_id)
+	if job is None or job['status'] != 'done':
+		abort(404)
+	return send_file(report_jobs.path(job_id), as_attachment=True, download_name=job['filename'])
+
+def _parse_form_date(name):
+	value = request.form.get(name)
+	if not value:
+		return None
+	try:
+		return datetime.date.fromisoformat(value)
+	except ValueError:
+		abort(400)
 
 @app.route("/mark", methods=['GET','POST'])
 def mark():
@@ -292,124 +278,248 @@ def sms():
 	return render_template('take.html',title="Take Attendance")
 
 
-@app.route("/detect", methods=["POST"])
-def detect():
-    import base64
-    import io
-    from PIL import Image
-    import face_recognition
-
-    data = request.get_json()
-    image_data = data["image"].split(",")[1]
-    image_bytes = base64.b64decode(image_data)
-
-    image = Image.open(io.BytesIO(image_bytes))
-    img_array = np.array(image)
-
-    # Detectar rostros
-    locations = face_recognition.face_locations(img_array)
-
+def _kiosk_class_id(data):
+    """Clase del kiosco: 'class_id' del JSON o de la URL (/take?class_id=N)."""
+    class_id = data.get("class_id") or request.args.get("class_id")
+    if not class_id:
+        return None
+    try:
+        return int(class_id)
+    except (TypeError, ValueError):
+        abort(400)
+
+
+def _recognize_frame(data_url, tolerance, class_id, kiosk=None):
+    """Reconoce la primera cara de un frame del kiosco.
+
+    Con kiosk (camara continua) los frames sin movimiento respecto al fondo
+    de ese kiosco reutilizan su ultimo resultado, si se obtuvo con la misma
+    clase y tolerancia, y la deteccion se limita a las regiones que han
+    cambiado. Los frames casi identicos a uno procesado
+    hace poco (con la misma clase y tolerancia) en el que no se reconocio a
+    nadie reutilizan su resultado sin detectar ni calcular el embedding.
+    Un estudiante reconocido nunca se toma de la cache.
+
+    Returns:
+        tuple: ('no_face' | 'ok' | 'unknown', student_id o None)
+    """
+    from attendance.frame_cache import CACHEABLE_STATUSES, frame_cache
+
+    small = recog.decode_reduced(data_url)
+
+    scope = (class_id, tolerance)
+    gate, regions = None, None
+    if kiosk is not None and app.config.get('MOTION_GATE', True):
+        from attendance.motion import motion_gates
+        gate = motion_gates.get(kiosk)
+        regions = gate.update(small, recog.REDUCED_SCALE)
+        if regions == []:
+            if gate.last_result is not None and gate.last_result[0] == scope:
+                return gate.last_result[1]
+            regions = None
+
+    key = recog.frame_hash(small)
+    result = frame_cache.get(scope, key)
+    if result is None:
+        result = _detect_and_match(data_url, tolerance, class_id, regions)
+        if result[0] in CACHEABLE_STATUSES:
+            frame_cache.put(scope, key, result)
+    if gate is not None:
+        gate.last_result = (scope, result)
+    return result
+
+
+def _detect_and_match(data_url, tolerance, class_id, regions=None):
+    from attendance.gallery import gallery_cache
+
+    img_array = recog.decode_data_url(data_url)
+
+    # Detectar rostros (solo en las regiones con movimiento, si las hay)
+    locations = recog.face_locations(img_array, regions)
     if len(locations) == 0:
-        return jsonify({"status": "no_face"})
-
-    # Encoding del rostro detectado
-    encoding = face_recognition.face_encodings(img_array, known_face_locations=locations)[0]
+        return ("no_face", None)
 
-    # Cargar tus estudiantes y comparar
-    students = Student.query.all()
+    # Encoding del rostro detectado, comparado contra la galeria de
+    # embeddings (cargada una vez), primero con la clase del kiosco
+    encoding = recog.face_encodings(img_array, locations)[0]
+    student_id, _ = gallery_cache.get().match(encoding, tolerance=tolerance, class_id=class_id)
+    return ("ok", student_id) if student_id is not None else ("unknown", None)
 
-    known_encodings = []
-    known_ids = []
 
-    for s in students:
-        # Debes tener encodings guardados por estudiante
-        known_encodings.append(np.load(f"encodings/{s.id}.npy"))
-        known_ids.append(s.id)
+@app.route("/detect", methods=["POST"])
+def detect():
+    from attendance.calibration import thresholds
 
-    matches = face_recognition.compare_faces(known_encodings, encoding, tolerance=0.45)
+    data = request.get_json()
+    class_id = _kiosk_class_id(data)
+    # Solo con un id de kiosco explicito: detras de un proxy o NAT varios
+    # kioscos comparten remote_addr y se suprimirian los frames entre si
+    kiosk = data.get("kiosk") or None
+    status, student_id = _recognize_frame(data["image"], thresholds.get('detect'), class_id, kiosk)
 
-    if True in matches:
-        idx = matches.index(True)
-        student_id = known_ids[idx]
-        student = Student.query.get(student_id)
+    if status == "ok":
+        student = db.session.get(Student, student_id)
 
         # Registrar asistencia
         record_attendance(student_id)
 
         return jsonify({
             "status": "ok",
-            "name": student.stuname
+            "name": student.stuname,
+            "in_class": class_id is None or student.class_id == class_id
         })
 
-    return jsonify({"status": "unknown"})
+    return jsonify({"status": status})
 
 
 @app.route("/attendance_mark", methods=["POST"])
 def attendance_mark():
-    from attendance.models import Student, Attendance
-    from datetime import datetime
-    import base64, cv2, numpy as np, face_recognition
+    from attendance.calibration import thresholds
 
     data = request.get_json()
-    img_b64 = data["image"]
-
-    # Convertir base64 → imagen
-    header, encoded = img_b64.split(",", 1)
-    img_bytes = base64.b64decode(encoded)
-
-    npimg = np.frombuffer(img_bytes, np.uint8)
-    img = cv2.imdecode(npimg, cv2.IMREAD_COLOR)
-
-    # Extraer encoding de la cara detectada
-    unknown_enc = face_recognition.face_encodings(img)
-    if len(unknown_enc) == 0:
-        return jsonify({"status": "no_face"})
-
-    unknown = unknown_enc[0]
+    class_id = _kiosk_class_id(data)
+    status, student_id = _recognize_frame(data["image"], thresholds.get('mark'), class_id)
 
-    # Buscar coincidencias con estudiantes registrados
-    students = Student.query.all()
+    if status == "ok":
+        stu = db.session.get(Student, student_id)
 
-    for stu in students:
-        if not stu.face_encoding:
-            continue
+        # Registrar asistencia (una fila por estudiante y dia); los
+        # estudiantes ya marcados hoy no vuelven a tocar la BD
+        presence.mark(stu.id)
 
-        known = np.frombuffer(stu.face_encoding, dtype=np.float64)
-
-        match = face_recognition.compare_faces([known], unknown)[0]
-
-        if match:
-            # Registrar asistencia con timestamp
-            new_att = Attendance(
-                student_id=stu.id,
-                timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            )
+        return jsonify({
+            "status": "ok",
+            "name": stu.stuname,
+            "in_class": class_id is None or stu.class_id == class_id
+        })
 
-            db.session.add(new_att)
-            db.session.commit()
+    return jsonify({"status": status})
 
-            return jsonify({
-                "status": "ok",
-                "name": stu.stuname
-            })
 
-    return jsonify({"status": "unknown"})
+@app.route("/api/recognition/stats")
+@login_required
+def recognition_stats():
+    from attendance.frame_cache import frame_cache
+    from attendance.motion import motion_gates
+
+    return jsonify({
+        "frame_cache": frame_cache.metrics(),
+        "motion": motion_gates.metrics(),
+        "presence": dict(presence.stats),
+    })
+
+
+ATTENDANCE_PAGE_SIZE = 50
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_COLUMNS = ['id', 'student_id', 'stuname', 'regno', 'class_id', 'classname', 'date', 'timestamp', 'last_seen']
+
+
+def _parse_date(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        abort(400)
+
+
+def _attendance_filters():
+    """Condiciones WHERE a partir de ?class_id, ?student_id, ?date_from y ?date_to."""
+    filters = []
+    class_id = request.args.get('class_id', type=int)
+    student_id = request.args.get('student_id', type=int)
+    date_from = _parse_date('date_from')
+    date_to = _parse_date('date_to')
+    if class_id:
+        filters.append(Attendance.class_id == class_id)
+    if student_id:
+        filters.append(Attendance.student_id == student_id)
+    if date_from:
+        filters.append(Attendance.date >= date_from)
+    if date_to:
+        filters.append(Attendance.date <= date_to)
+    return filters
 
 
 @app.route('/attendance_list')
 def attendance_list():
-    records = Attendance.query.order_by(Attendance.timestamp.desc()).all()
-    return render_template('attendance_list.html', records=records)
-
+    # Paginacion por clave (timestamp, id): cada pagina es una busqueda en el
+    # indice, sin OFFSET, y el estudiante se carga en el mismo JOIN.
+    per_page = min(request.args.get('per_page', ATTENDANCE_PAGE_SIZE, type=int), 500)
+    query = (Attendance.query
+             .join(Attendance.student)
+             .options(contains_eager(Attendance.student))
+             .filter(*_attendance_filters()))
+
+    before = request.args.get('before')
+    before_id = request.args.get('before_id', type=int)
+    if before and before_id:
+        try:
+            before_ts = datetime.datetime.fromisoformat(before)
+        except ValueError:
+            abort(400)
+        query = query.filter(db.or_(
+            Attendance.timestamp < before_ts,
+            db.and_(Attendance.timestamp == before_ts, Attendance.id < before_id)))
+
+    rows = query.order_by(Attendance.timestamp.desc(), Attendance.id.desc()).limit(per_page + 1).all()
+    records = rows[:per_page]
+
+    next_url = None
+    if len(rows) > per_page:
+        args = request.args.to_dict()
+        args.update(before=records[-1].timestamp.isoformat(), before_id=records[-1].id)
+        next_url = url_for('attendance_list', **args)
+
+    export_args = {k: v for k, v in request.args.items() if k not in ('before', 'before_id', 'per_page')}
+    return render_template('attendance_list.html', records=records, next_url=next_url,
+                           classes=Class.query.order_by(Class.classname).all(),
+                           export_args=export_args)
+
+
+@app.route('/attendance_export.<fmt>')
+@login_required
+def attendance_export(fmt):
+    """Exporta las asistencias filtradas como CSV o JSON (lineas) en streaming.
+
+    Las filas se leen en bloques de EXPORT_CHUNK_SIZE con yield_per, de modo
+    que la tabla nunca se carga entera en memoria.
+    """
+    if fmt not in ('csv', 'json'):
+        abort(404)
+
+    stmt = (db.select(Attendance.id, Attendance.student_id, Student.stuname, Student.regno,
+                      Attendance.class_id, Class.classname, Attendance.date,
+                      Attendance.timestamp, Attendance.last_seen)
+            .join(Student, Student.id == Attendance.student_id)
+            .join(Class, Class.id == Attendance.class_id)
+            .where(*_attendance_filters())
+            .order_by(Attendance.date, Attendance.class_id, Attendance.student_id)
+            .execution_options(yield_per=EXPORT_CHUNK_SIZE))
+
+    def generate():
+        result = db.session.execute(stmt)
+        if fmt == 'csv':
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerow(EXPORT_COLUMNS)
+            for chunk in result.partitions():
+                writer.writerows(chunk)
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+            yield buf.getvalue()
+        else:
+            for chunk in result.partitions():
+                yield ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=str) + '\n'
+                              for row in chunk)
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename=asistencias.%s' % fmt
+    return response
 
 
 def record_attendance(student_id):
-    today = datetime.date.today()
-
-    record = Attendance.query.filter_by(student_id=student_id, date=today).first()
-
-    if not record:
-        new_record = Attendance(student_id=student_id, date=today)
-        db.session.add(new_record)
-        db.session.commit()
-
+    presence.mark(student_id)
@@ -0,0 +1,109 @@
+"""Landmark alignment vs the previous crop/rotate paths.
+
+Compares, on a synthetic frame with several faces:
+
+- box crop + resize (face_recog, align_dataset_mtcnn before alignment)
+- crop + full-size rotation with cv2.warpAffine + resize (preprocessed_mtcnn)
+- landmarks.align_faces: one similarity warp per face straight to 160x160,
+  with OpenCV and with the NumPy batch fallback
+
+and checks that the aligned crops put the eyes where the template says.
+"""
+from __future__ import print_function
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+LANDMARKS_PY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'attendance', 'facenet', 'src',
+                                            'align', 'landmarks.py'))
+
+
+def load_landmarks():
+    # Se carga el fichero directamente para no importar el paquete attendance
+    spec = importlib.util.spec_from_file_location('landmarks', LANDMARKS_PY)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_faces(landmarks, nrof_faces, width, height, rng):
+    ref = landmarks.reference_landmarks(160, 0)
+    angle = rng.uniform(-0.4, 0.4, nrof_faces)
+    scale = rng.uniform(0.6, 1.4, nrof_faces)
+    center = rng.uniform([120, 120], [width - 120, height - 120], (nrof_faces, 2))
+    rot = np.stack([np.stack([np.cos(angle), -np.sin(angle)], 1), np.stack([np.sin(angle), np.cos(angle)], 1)], 1)
+    pts = np.einsum('nij,kj->nki', rot * scale[:, None, None], ref - 80.0) + center[:, None, :]
+    boxes = np.concatenate([pts.min(axis=1) - 30 * scale[:, None], pts.max(axis=1) + 30 * scale[:, None]], axis=1)
+    return pts.astype(np.float32), boxes.astype(np.int32)
+
+
+def box_crop(img, boxes, size):
+    return [cv2.resize(img[y0:y1, x0:x1], (size, size), interpolation=cv2.INTER_LINEAR)
+            for x0, y0, x1, y1 in boxes]
+
+
+def rotate_full(img, pts, boxes, size):
+    out = []
+    for (x0, y0, x1, y1), p in zip(boxes, pts):
+        face = img[y0:y1, x0:x1]
+        left_eye, right_eye = p[0] - (x0, y0), p[1] - (x0, y0)
+        dx, dy = right_eye[0] - left_eye[0], right_eye[1] - left_eye[1]
+        center = tuple(np.mean([left_eye, right_eye], axis=0).astype(int))
+        rot = cv2.getRotationMatrix2D((int(center[0]), int(center[1])), np.degrees(np.arctan2(dy, dx)), 1)
+        face = cv2.warpAffine(face, rot, (face.shape[1], face.shape[0]))
+        out.append(cv2.resize(face, (size, size)))
+    return out
+
+
+def timeit(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return 1000.0 * (time.perf_counter() - start) / repeat
+
+
+def main(args):
+    landmarks = load_landmarks()
+    rng = np.random.RandomState(args.seed)
+    img = cv2.GaussianBlur(rng.randint(0, 255, (args.height, args.width, 3)).astype(np.uint8), (5, 5), 0)
+    pts, boxes = make_faces(landmarks, args.nrof_faces, args.width, args.height, rng)
+    size = args.image_size
+
+    print('%d faces in a %dx%d frame, output %dx%d' % (args.nrof_faces, args.width, args.height, size, size))
+    print('box crop + resize:           %.2f ms' % timeit(lambda: box_crop(img, boxes, size), args.repeat))
+    print('crop + rotate + resize:      %.2f ms' % timeit(lambda: rotate_full(img, pts, boxes, size), args.repeat))
+    print('landmark warp (OpenCV):      %.2f ms' % timeit(lambda: landmarks.warp_faces(img, pts, size), args.repeat))
+    matrices = landmarks.estimate_similarity(pts, landmarks.reference_landmarks(size))
+    print('landmark warp (NumPy batch): %.2f ms' % timeit(lambda: landmarks._warp_numpy(img, matrices, size), args.repeat))
+
+    mapped = np.einsum('nij,nkj->nki', matrices[:, :, :2], pts) + matrices[:, None, :, 2]
+    err = np.abs(mapped - landmarks.reference_landmarks(size)).max()
+    print('Max landmark error after alignment: %.2e px' % err)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nrof_faces', type=int,
+        help='Faces in the frame.', default=8)
+    parser.add_argument('--width', type=int,
+        help='Frame width.', default=1280)
+    parser.add_argument('--height', type=int,
+        help='Frame height.', default=720)
+    parser.add_argument('--image_size', type=int,
+        help='Aligned face size.', default=160)
+    parser.add_argument('--repeat', type=int,
+        help='Timing repetitions.', default=50)
+    parser.add_argument('--seed', type=int,
+        help='Random seed.', default=666)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
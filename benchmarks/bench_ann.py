@@ -0,0 +1,125 @@
+"""Recall vs latency of the gallery search indexes.
+
+Builds a synthetic gallery shaped like a district-wide deployment (many
+identities, a few 128-d embeddings each, tight clusters per identity) and
+queries it with fresh noisy samples of enrolled identities. Recall@1 is
+measured against the exact brute-force neighbour, latency is per single query
+(the /detect and /attendance_mark case). IVF is swept over nprobe and HNSW
+(if hnswlib is installed) over ef.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from attendance.ann_index import build_index, load_index  # noqa: E402
+
+
+def make_gallery(nrof_identities, per_identity, dim, noise, seed):
+    rng = np.random.RandomState(seed)
+    centers = rng.randn(nrof_identities, dim).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    labels = np.repeat(np.arange(nrof_identities), per_identity)
+    vectors = centers[labels] + noise * rng.randn(labels.shape[0], dim).astype(np.float32)
+    return centers, vectors
+
+
+def make_queries(centers, nrof_queries, noise, seed):
+    rng = np.random.RandomState(seed + 1)
+    who = rng.randint(0, centers.shape[0], nrof_queries)
+    return centers[who] + noise * rng.randn(nrof_queries, centers.shape[1]).astype(np.float32)
+
+
+def time_queries(index, queries, **kwargs):
+    found = np.empty((queries.shape[0],), np.int64)
+    start = time.perf_counter()
+    for i in range(queries.shape[0]):
+        found[i] = index.search(queries[i], 1, **kwargs)[1][0, 0]
+    elapsed = time.perf_counter() - start
+    return found, 1000.0 * elapsed / queries.shape[0]
+
+
+def report(name, found, truth, latency_ms, base_ms):
+    recall = float(np.mean(found == truth))
+    print('%-22s recall@1 %.4f  %8.3f ms/query  %6.1fx' % (name, recall, latency_ms, base_ms / latency_ms))
+
+
+def main(args):
+    centers, vectors = make_gallery(args.nrof_identities, args.per_identity, args.dim, args.noise, args.seed)
+    queries = make_queries(centers, args.nrof_queries, args.noise, args.seed)
+    ids = np.arange(vectors.shape[0], dtype=np.int64)
+    print('Gallery: %d embeddings (%d identities), dim %d; %d queries'
+          % (vectors.shape[0], args.nrof_identities, args.dim, args.nrof_queries))
+
+    brute = build_index('brute', ids, vectors)
+    truth, base_ms = time_queries(brute, queries)
+    report('brute', truth, truth, base_ms, base_ms)
+    start = time.perf_counter()
+    _, batch_ids = brute.search(queries, 1)
+    batch_ms = 1000.0 * (time.perf_counter() - start) / queries.shape[0]
+    report('brute (batched)', batch_ids[:, 0], truth, batch_ms, base_ms)
+
+    start = time.perf_counter()
+    ivf = build_index('ivf', ids, vectors, nlist=args.nlist)
+    print('IVF build (nlist=%d): %.1f s' % (ivf.nlist, time.perf_counter() - start))
+    for nprobe in args.nprobe:
+        found, ms = time_queries(ivf, queries, nprobe=nprobe)
+        report('ivf nprobe=%d' % nprobe, found, truth, ms, base_ms)
+
+    # Persistencia e insercion incremental: guardar, recargar, anadir 1% mas
+    path = os.path.join(tempfile.mkdtemp(), 'gallery.idx')
+    start = time.perf_counter()
+    ivf.save(path)
+    ivf = load_index(path)
+    extra = vectors[:max(1, vectors.shape[0] // 100)]
+    ivf.add(np.arange(vectors.shape[0], vectors.shape[0] + extra.shape[0]), extra)
+    ivf.search(queries[0], 1)
+    print('IVF save + load + add %d: %.2f s' % (extra.shape[0], time.perf_counter() - start))
+
+    try:
+        import hnswlib  # noqa: F401
+    except ImportError:
+        print('hnswlib not installed, skipping HNSW')
+        return
+    start = time.perf_counter()
+    hnsw = build_index('hnsw', ids, vectors, M=args.hnsw_m)
+    print('HNSW build (M=%d): %.1f s' % (args.hnsw_m, time.perf_counter() - start))
+    for ef in args.ef:
+        hnsw.ef = ef
+        found, ms = time_queries(hnsw, queries)
+        report('hnsw ef=%d' % ef, found, truth, ms, base_ms)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nrof_identities', type=int,
+        help='Number of enrolled students.', default=25000)
+    parser.add_argument('--per_identity', type=int,
+        help='Embeddings per student.', default=4)
+    parser.add_argument('--dim', type=int,
+        help='Embedding dimension.', default=128)
+    parser.add_argument('--noise', type=float,
+        help='Per-component standard deviation around each identity.', default=0.03)
+    parser.add_argument('--nrof_queries', type=int,
+        help='Number of single-face queries.', default=500)
+    parser.add_argument('--nlist', type=int,
+        help='IVF lists (default 4*sqrt(n)).', default=None)
+    parser.add_argument('--nprobe', type=int, nargs='+',
+        help='IVF lists probed per query.', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--hnsw_m', type=int,
+        help='HNSW graph degree.', default=16)
+    parser.add_argument('--ef', type=int, nargs='+',
+        help='HNSW search beam widths.', default=[16, 32, 64, 128])
+    parser.add_argument('--seed', type=int,
+        help='Random seed.', default=666)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
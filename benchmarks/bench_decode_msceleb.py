@@ -0,0 +1,174 @@
+"""Parallel chunked MS-Celeb TSV decoding vs the previous one-line-at-a-time loop.
+
+Writes a synthetic TSV in the MsCelebV1 format (--nrof_images JPEG faces of
+--image_size pixels over --nrof_classes MIDs) and decodes it resized to
+--size with:
+
+- loop: the previous decode_msceleb_dataset loop on one core (cv2.resize in
+  place of misc.imresize, which is gone from scipy)
+- files: decode_tsv with --nrof_workers processes, one file per image
+- shards: decode_tsv straight into uint8 shards, killed half way and resumed
+
+and checks that the files and the shards hold the same pixels as the loop.
+"""
+from __future__ import print_function
+
+import argparse
+import base64
+import importlib.util
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'attendance', 'facenet', 'src'))
+
+
+def load_module(name):
+    # decode_msceleb_dataset.py solo importa TensorFlow (facenet) dentro de main
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SRC_DIR, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    # Registrado para que los procesos del pool encuentren decode_chunk
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_tsv(path, args, rng):
+    with open(path, 'w') as f:
+        for i in range(args.nrof_images):
+            mid = 'm.%06d' % rng.randint(args.nrof_classes)
+            img = cv2.GaussianBlur(rng.randint(0, 255, (args.image_size, args.image_size, 3)).astype(np.uint8), (15, 15), 0)
+            data = base64.b64encode(cv2.imencode('.jpg', img)[1].tobytes()).decode('ascii')
+            f.write('\t'.join([mid, '%d' % i, '1', 'http://img/%d.jpg' % i, 'FaceId-%d' % i, data]) + '\n')
+
+
+def reference_loop(tsv_file, output_dir, size, output_format):
+    """The loop of the old decode_msceleb_dataset.main."""
+    i = 0
+    with open(tsv_file) as f:
+        for line in f:
+            fields = line.split('\t')
+            class_dir = fields[0]
+            img_name = fields[1] + '-' + fields[4] + '.' + output_format
+            img_string = fields[5]
+            img_dec_string = base64.b64decode(img_string)
+            img_data = np.frombuffer(img_dec_string, dtype=np.uint8)
+            img = cv2.imdecode(img_data, cv2.IMREAD_COLOR)
+            if size:
+                img = cv2.resize(img, (size, size), interpolation=cv2.INTER_LINEAR)
+            full_class_dir = os.path.join(output_dir, class_dir)
+            if not os.path.exists(full_class_dir):
+                os.mkdir(full_class_dir)
+            full_path = os.path.join(full_class_dir, img_name.replace('/', '_'))
+            cv2.imwrite(full_path, img)
+            i += 1
+    return i
+
+
+def run_in_group(decoder, tsv_file, output_dir, kwargs):
+    # Grupo de procesos propio: se mata junto con los procesos del pool
+    os.setpgrp()
+    sys.stdout = open(os.devnull, 'w')
+    decoder.decode_tsv([tsv_file], output_dir, **kwargs)
+
+
+def interrupted_run(decoder, tsv_file, output_dir, args):
+    """Runs decode_tsv into shards in a child process and kills it half way."""
+    kwargs = dict(size=args.size, output='shards', images_per_shard=args.images_per_shard,
+                  nrof_workers=args.nrof_workers, chunk_size=args.chunk_size)
+    process = multiprocessing.Process(target=run_in_group, args=(decoder, tsv_file, output_dir, kwargs))
+    process.start()
+    progress_file = os.path.join(output_dir, decoder.PROGRESS_FILE)
+    nrof_chunks = len(decoder.tsv_chunks([tsv_file], args.chunk_size * 1024 * 1024))
+    while process.is_alive():
+        if os.path.exists(progress_file):
+            try:
+                with open(progress_file) as f:
+                    if json.load(f)['next_chunk'] >= nrof_chunks // 2:
+                        break
+            except ValueError:
+                pass
+        time.sleep(0.01)
+    os.killpg(process.pid, signal.SIGKILL)
+    process.join()
+
+
+def main(args):
+    decoder = load_module('decode_msceleb_dataset')
+    shards = sys.modules['shards']
+    rng = np.random.RandomState(args.seed)
+    work_dir = tempfile.mkdtemp(prefix='bench_msceleb_')
+    try:
+        tsv_file = os.path.join(work_dir, 'msceleb.tsv')
+        make_tsv(tsv_file, args, rng)
+        mb = os.path.getsize(tsv_file) / 1024 / 1024
+        print('%d images, %.0f MB of TSV, %d workers' % (args.nrof_images, mb, args.nrof_workers))
+
+        loop_dir = os.path.join(work_dir, 'loop')
+        os.mkdir(loop_dir)
+        start = time.perf_counter()
+        reference_loop(tsv_file, loop_dir, args.size, 'png')
+        loop_s = time.perf_counter() - start
+        print('loop:   %5.1f MB/s' % (mb / loop_s))
+
+        files_dir = os.path.join(work_dir, 'files')
+        start = time.perf_counter()
+        decoder.decode_tsv([tsv_file], files_dir, args.size, 'png', 'files', nrof_workers=args.nrof_workers,
+                           chunk_size=args.chunk_size)
+        files_s = time.perf_counter() - start
+        same = all(np.array_equal(cv2.imread(os.path.join(loop_dir, rel)), cv2.imread(os.path.join(files_dir, rel)))
+                   for rel in (os.path.join(d, f) for d in os.listdir(loop_dir) for f in os.listdir(os.path.join(loop_dir, d))))
+        print('files:  %5.1f MB/s (%.1fx), same images: %s' % (mb / files_s, loop_s / files_s, same))
+
+        shards_dir = os.path.join(work_dir, 'shards')
+        interrupted_run(decoder, tsv_file, shards_dir, args)
+        with open(os.path.join(shards_dir, decoder.PROGRESS_FILE)) as f:
+            resumed_at = json.load(f)['next_chunk']
+        start = time.perf_counter()
+        nrof_images, _ = decoder.decode_tsv([tsv_file], shards_dir, args.size, output='shards',
+                                            images_per_shard=args.images_per_shard, nrof_workers=args.nrof_workers,
+                                            chunk_size=args.chunk_size)
+        resume_s = time.perf_counter() - start
+        reader = shards.ShardReader(shards_dir)
+        same = len(reader) == args.nrof_images and all(
+            np.array_equal(reader.image(i), cv2.cvtColor(cv2.imread(os.path.join(loop_dir, str(rel))), cv2.COLOR_BGR2RGB))
+            for i, rel in enumerate(reader.paths))
+        print('shards: killed after chunk %d, resumed in %.1f s, %d images, same images: %s'
+              % (resumed_at, resume_s, len(reader), same))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nrof_images', type=int,
+        help='Number of TSV records.', default=4000)
+    parser.add_argument('--nrof_classes', type=int,
+        help='Number of MIDs.', default=200)
+    parser.add_argument('--image_size', type=int,
+        help='Size of the encoded images.', default=250)
+    parser.add_argument('--size', type=int,
+        help='Decoded images are resized to this size.', default=182)
+    parser.add_argument('--images_per_shard', type=int,
+        help='Images per shard file.', default=1000)
+    parser.add_argument('--nrof_workers', type=int,
+        help='Decoding processes.', default=multiprocessing.cpu_count())
+    parser.add_argument('--chunk_size', type=int,
+        help='TSV chunk size in MB.', default=4)
+    parser.add_argument('--seed', type=int,
+        help='Random seed.', default=666)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
@@ -0,0 +1,166 @@
+"""Triplet mining from an embedding_bank.EmbeddingBank vs a forward pass per batch.
+
+Simulates train_tripletloss on a synthetic dataset: --nrof_classes classes
+of --images_per_class images whose embedding at step t is a fixed point
+near the class center plus noise that drifts from step to step (the model
+being trained). For --nrof_steps steps, a P x K batch is sampled and triplets are
+mined:
+
+- batch: every sampled image is embedded, negatives from the batch only
+  (the previous train_tripletloss)
+- bank: only the images without an embedding from the last --max_age steps
+  are embedded, negatives from the batch and from --nrof_candidates bank
+  embeddings; the triplet images "trained on" refresh the bank
+
+Prints the forward passes spent on mining per step, the mining time and how
+hard the triplets are with the current embeddings (mean triplet loss and
+fraction of triplets violating the margin).
+"""
+from __future__ import print_function
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+import numpy as np
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'attendance', 'facenet', 'src'))
+
+
+def load_module(name):
+    # train_tripletloss.py importa TensorFlow; se cargan solo los modulos sin TensorFlow
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SRC_DIR, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class ImageClass():
+    def __init__(self, name, image_paths):
+        self.name = name
+        self.image_paths = image_paths
+
+    def __len__(self):
+        return len(self.image_paths)
+
+
+class Model(object):
+    """Embeddings that drift a little at every training step."""
+
+    def __init__(self, args, rng):
+        centers = rng.randn(args.nrof_classes, args.embedding_size)
+        centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+        self.base = np.repeat(centers, args.images_per_class, axis=0)
+        self.base += args.spread * rng.randn(*self.base.shape) / np.sqrt(args.embedding_size)
+        self.drift = args.drift
+        self.correlation = args.drift_correlation
+        self.rng = np.random.RandomState(args.seed)
+        self.noise = self.rng.randn(*self.base.shape)
+
+    def next_step(self):
+        # Deriva AR(1): el modelo cambia poco de un paso al siguiente
+        innovation = self.rng.randn(*self.base.shape)
+        self.noise = self.correlation * self.noise + np.sqrt(1.0 - self.correlation ** 2) * innovation
+
+    def embed(self, indices):
+        emb = self.base[indices] + self.drift * self.noise[indices] / np.sqrt(self.base.shape[1])
+        return emb / np.linalg.norm(emb, axis=1, keepdims=True)
+
+
+def triplet_hardness(model, anchors, positives, negatives, alpha):
+    a, p, n = model.embed(anchors), model.embed(positives), model.embed(negatives)
+    loss = np.sum(np.square(a - p), 1) - np.sum(np.square(a - n), 1) + alpha
+    return np.mean(np.maximum(loss, 0.0)), np.mean(loss > 0)
+
+
+def run(mode, args, modules):
+    pk_sampler, triplet_selection, embedding_bank = modules
+    rng = np.random.RandomState(args.seed)
+    dataset = [ImageClass('c%05d' % c, ['c%05d/%04d' % (c, i) for i in range(args.images_per_class)])
+               for c in range(args.nrof_classes)]
+    sampler = pk_sampler.PKSampler(dataset, args.people_per_batch, args.images_per_person, seed=args.seed)
+    model = Model(args, rng)
+    bank = None
+    if mode == 'bank':
+        bank = embedding_bank.EmbeddingBank(np.repeat(np.arange(len(sampler)), sampler.class_sizes),
+                                            args.embedding_size, args.max_age)
+    nrof_forward = mining_time = 0.0
+    losses, violating = [], []
+    for step in range(args.nrof_steps):
+        model.next_step()
+        indices, num_per_class, _ = sampler.sample_indices()
+        start = time.perf_counter()
+        if bank is None:
+            emb = model.embed(indices)
+            nrof_forward += len(indices)
+            labels = triplet_selection.batch_labels(num_per_class, args.people_per_batch)
+            a, p, n, _ = triplet_selection.select_triplet_indices(emb, labels, args.alpha, 'vgg', rng)
+            a, p, n = indices[a], indices[p], indices[n]
+        else:
+            stale = bank.stale_indices(indices, step)
+            if len(stale) > 0:
+                bank.update(stale, model.embed(stale), step)
+            nrof_forward += len(stale)
+            a, p, n, _ = bank.select_triplet_indices(indices, step, args.alpha, 'vgg', args.nrof_candidates, rng)
+        mining_time += time.perf_counter() - start
+        if len(a) == 0:
+            continue
+        # Los embeddings del paso de entrenamiento actualizan el banco sin coste
+        triplet_images = np.concatenate([a, p, n])
+        if bank is not None:
+            bank.update(triplet_images, model.embed(triplet_images), step)
+        loss, violation = triplet_hardness(model, a, p, n, args.alpha)
+        losses.append(loss)
+        violating.append(violation)
+    print('%-5s %7.0f forward passes/step, mining %5.1f ms/step, triplet loss %.4f, violating %.1f%%'
+          % (mode, nrof_forward / args.nrof_steps, 1000 * mining_time / args.nrof_steps,
+             np.mean(losses), 100 * np.mean(violating)))
+
+
+def main(args):
+    modules = (load_module('pk_sampler'), load_module('triplet_selection'), load_module('embedding_bank'))
+    print('%d classes x %d images, batches of %d x %d, %d steps, max age %d, %d candidates'
+          % (args.nrof_classes, args.images_per_class, args.people_per_batch, args.images_per_person,
+             args.nrof_steps, args.max_age, args.nrof_candidates))
+    for mode in ('batch', 'bank'):
+        run(mode, args, modules)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nrof_classes', type=int,
+        help='Number of classes.', default=500)
+    parser.add_argument('--images_per_class', type=int,
+        help='Images per class.', default=20)
+    parser.add_argument('--people_per_batch', type=int,
+        help='Number of people per batch.', default=45)
+    parser.add_argument('--images_per_person', type=int,
+        help='Number of images per person.', default=10)
+    parser.add_argument('--embedding_size', type=int,
+        help='Dimensionality of the embedding.', default=64)
+    parser.add_argument('--spread', type=float,
+        help='Spread of the images around their class center.', default=1.0)
+    parser.add_argument('--drift', type=float,
+        help='Size of the drift noise of the embeddings.', default=0.5)
+    parser.add_argument('--drift_correlation', type=float,
+        help='Correlation of the drift noise between consecutive steps.', default=0.99)
+    parser.add_argument('--alpha', type=float,
+        help='Triplet loss margin.', default=0.2)
+    parser.add_argument('--nrof_steps', type=int,
+        help='Number of training steps.', default=300)
+    parser.add_argument('--max_age', type=int,
+        help='Bank embeddings older than this many steps are embedded again.', default=50)
+    parser.add_argument('--nrof_candidates', type=int,
+        help='Bank embeddings searched for negatives besides the batch.', default=2000)
+    parser.add_argument('--seed', type=int,
+        help='Random seed.', default=666)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
@@ -0,0 +1,135 @@
+"""Vectorized dataset_filter.filter_dataset vs the previous train_softmax loop.
+
+Writes a synthetic filtering metrics file like calculate_filtering_metrics
+(--nrof_classes classes of a random number of images, random distances to
+the class center), then filters the dataset at --percentile with:
+
+- loop: the previous `image in image_paths` / list.remove loop
+- vectorized: dataset_filter.filter_dataset without and with its cache
+
+and checks that the filtered datasets are identical.
+"""
+from __future__ import print_function
+
+import argparse
+import copy
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+DATASET_FILTER_PY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'attendance', 'facenet', 'src',
+                                                 'dataset_filter.py'))
+
+
+def load_dataset_filter():
+    # train_softmax.py importa TensorFlow; se carga solo dataset_filter.py
+    spec = importlib.util.spec_from_file_location('dataset_filter', DATASET_FILTER_PY)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class ImageClass():
+    def __init__(self, name, image_paths):
+        self.name = name
+        self.image_paths = image_paths
+
+
+def reference_filter(dataset, data_filename, percentile, min_nrof_images_per_class, find_threshold):
+    """The loop of the old train_softmax.filter_dataset."""
+    with h5py.File(data_filename, 'r') as f:
+        distance_to_center = np.array(f.get('distance_to_center'))
+        label_list = np.array(f.get('label_list'))
+        image_list = [s.decode('utf-8') if isinstance(s, bytes) else s for s in np.array(f.get('image_list'))]
+        distance_to_center_threshold = find_threshold(distance_to_center, percentile)
+        indices = np.where(distance_to_center >= distance_to_center_threshold)[0]
+        filtered_dataset = dataset
+        removelist = []
+        for i in indices:
+            label = label_list[i]
+            image = image_list[i]
+            if image in filtered_dataset[label].image_paths:
+                filtered_dataset[label].image_paths.remove(image)
+            if len(filtered_dataset[label].image_paths) < min_nrof_images_per_class:
+                removelist.append(label)
+
+        ix = sorted(list(set(removelist)), reverse=True)
+        for i in ix:
+            del(filtered_dataset[i])
+
+    return filtered_dataset
+
+
+def make_dataset(args, rng, data_filename):
+    sizes = rng.randint(args.min_images, args.max_images + 1, args.nrof_classes)
+    dataset = []
+    for c, size in enumerate(sizes):
+        name = 'm.%07d' % c
+        dataset.append(ImageClass(name, ['/data/aligned/%s/%s_%04d.png' % (name, name, i) for i in range(size)]))
+    image_list = [path for cls in dataset for path in cls.image_paths]
+    label_list = np.repeat(np.arange(args.nrof_classes), sizes)
+    distance_to_center = rng.gamma(4.0, 0.2, len(image_list))
+    string_dtype = h5py.special_dtype(vlen=str)
+    with h5py.File(data_filename, 'w') as f:
+        f.create_dataset('class_names', data=np.array([cls.name for cls in dataset], dtype=string_dtype))
+        f.create_dataset('image_list', data=np.array(image_list, dtype=string_dtype))
+        f.create_dataset('label_list', data=label_list)
+        f.create_dataset('distance_to_center', data=distance_to_center)
+    return dataset
+
+
+def main(args):
+    module = load_dataset_filter()
+    rng = np.random.RandomState(args.seed)
+    work_dir = tempfile.mkdtemp(prefix='bench_filter_')
+    try:
+        data_filename = os.path.join(work_dir, 'metrics.hdf')
+        dataset = make_dataset(args, rng, data_filename)
+        print('%d images of %d classes, percentile %g' % (sum(len(cls.image_paths) for cls in dataset),
+                                                          len(dataset), args.percentile))
+
+        start = time.perf_counter()
+        reference = reference_filter(copy.deepcopy(dataset), data_filename, args.percentile,
+                                     args.min_nrof_images_per_class, module.find_threshold)
+        loop_s = time.perf_counter() - start
+
+        timings = {}
+        for name in ('vectorized', 'cached'):
+            start = time.perf_counter()
+            filtered = module.filter_dataset(dataset, data_filename, args.percentile,
+                                             args.min_nrof_images_per_class, ImageClass)
+            timings[name] = time.perf_counter() - start
+            same = ([(cls.name, cls.image_paths) for cls in filtered] ==
+                    [(cls.name, cls.image_paths) for cls in reference])
+            print('%-10s %.2f s (%.0fx), same result: %s' % (name, timings[name], loop_s / timings[name], same))
+        print('loop       %.2f s, %d classes and %d images left' % (loop_s, len(reference),
+                                                                    sum(len(cls.image_paths) for cls in reference)))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nrof_classes', type=int,
+        help='Number of classes.', default=10000)
+    parser.add_argument('--min_images', type=int,
+        help='Minimum number of images per class.', default=10)
+    parser.add_argument('--max_images', type=int,
+        help='Maximum number of images per class.', default=200)
+    parser.add_argument('--percentile', type=float,
+        help='Images at or above this percentile of the distances are removed.', default=75.0)
+    parser.add_argument('--min_nrof_images_per_class', type=int,
+        help='Classes left with fewer images are removed.', default=20)
+    parser.add_argument('--seed', type=int,
+        help='Random seed.', default=666)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
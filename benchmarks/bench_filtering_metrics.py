@@ -0,0 +1,144 @@
+"""Streaming ClassStatistics vs the previous calculate_filtering_metrics loop.
+
+Builds synthetic embeddings for --nrof_classes classes of a random number of
+images each, sorted by class as calculate_filtering_metrics enqueues them,
+and feeds them in batches of --batch_size to:
+
+- loop: the previous np.append / set(lab_array) / np.delete accumulation
+- streaming: ClassStatistics.update
+
+both in order and with the batches of --nrof_workers workers completing out
+of order, and checks that the centers, variances and distances to the class
+centers match.
+"""
+from __future__ import print_function
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+import numpy as np
+
+CLASS_STATISTICS_PY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'attendance', 'facenet', 'src',
+                                                   'class_statistics.py'))
+
+
+def load_class_statistics():
+    # calculate_filtering_metrics.py importa TensorFlow; se carga solo class_statistics.py
+    spec = importlib.util.spec_from_file_location('class_statistics', CLASS_STATISTICS_PY)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def reference_loop(batches, label_array, nrof_examples_per_class, embedding_size):
+    """The accumulation of the old calculate_filtering_metrics.main."""
+    nrof_classes = len(nrof_examples_per_class)
+    class_variance = np.zeros((nrof_classes,))
+    class_center = np.zeros((nrof_classes, embedding_size))
+    distance_to_center = np.ones((len(label_array),))*np.nan
+    emb_array = np.zeros((0, embedding_size))
+    idx_array = np.zeros((0,), dtype=np.int32)
+    lab_array = np.zeros((0,), dtype=np.int32)
+    index_arr = np.append(0, np.cumsum(nrof_examples_per_class))
+    for emb, idx in batches:
+        emb_array = np.append(emb_array, emb, axis=0)
+        idx_array = np.append(idx_array, idx, axis=0)
+        lab_array = np.append(lab_array, label_array[idx], axis=0)
+        for cls in set(lab_array):
+            cls_idx = np.where(lab_array == cls)[0]
+            if cls_idx.shape[0] == nrof_examples_per_class[cls]:
+                i2 = np.argsort(idx_array[cls_idx])
+                emb_sort = emb_array[cls_idx, :][i2, :]
+                center = np.mean(emb_sort, axis=0)
+                dists_sqr = np.sum(np.square(emb_sort - center), axis=1)
+                class_variance[cls] = np.mean(dists_sqr)
+                class_center[cls, :] = center
+                distance_to_center[index_arr[cls]:index_arr[cls+1]] = np.sqrt(dists_sqr)
+                emb_array = np.delete(emb_array, cls_idx, axis=0)
+                idx_array = np.delete(idx_array, cls_idx, axis=0)
+                lab_array = np.delete(lab_array, cls_idx, axis=0)
+    return distance_to_center, class_center, class_variance
+
+
+def make_batches(args, rng):
+    sizes = rng.randint(args.min_images, args.max_images + 1, args.nrof_classes)
+    labels = np.repeat(np.arange(args.nrof_classes), sizes)
+    centers = rng.randn(args.nrof_classes, args.dim)
+    embeddings = centers[labels] + 0.5 * rng.randn(labels.shape[0], args.dim)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    indices = np.arange(labels.shape[0])
+    batches = [(embeddings[i:i + args.batch_size], indices[i:i + args.batch_size])
+               for i in range(0, labels.shape[0], args.batch_size)]
+    return labels, sizes, batches
+
+
+def interleave(batches, nrof_workers, rng):
+    """Batch order of nrof_workers workers that finish their batches in random order."""
+    order = []
+    window = list(range(min(nrof_workers, len(batches))))
+    next_batch = len(window)
+    while window:
+        done = window.pop(rng.randint(len(window)))
+        order.append(batches[done])
+        if next_batch < len(batches):
+            window.append(next_batch)
+            next_batch += 1
+    return order
+
+
+def streaming(module, batches, labels, dim):
+    stats = module.ClassStatistics(labels, dim)
+    max_pending = 0
+    for emb, idx in batches:
+        stats.update(emb, idx)
+        max_pending = max(max_pending, stats.nrof_pending)
+    assert stats.is_complete()
+    return stats, max_pending
+
+
+def main(args):
+    module = load_class_statistics()
+    rng = np.random.RandomState(args.seed)
+    labels, sizes, batches = make_batches(args, rng)
+    print('%d images of %d classes, batches of %d' % (labels.shape[0], args.nrof_classes, args.batch_size))
+
+    for name, order in (('in order', batches), ('%d workers' % args.nrof_workers,
+                                                 interleave(batches, args.nrof_workers, rng))):
+        start = time.perf_counter()
+        ref_dist, ref_center, ref_variance = reference_loop(order, labels, sizes, args.dim)
+        loop_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        stats, max_pending = streaming(module, order, labels, args.dim)
+        stream_s = time.perf_counter() - start
+        err = max(np.max(np.abs(stats.distance_to_center - ref_dist)),
+                  np.max(np.abs(stats.class_center - ref_center)),
+                  np.max(np.abs(stats.class_variance - ref_variance)))
+        print('%-10s loop %.2f s, streaming %.3f s (%.1fx), at most %d embeddings held, max abs difference %.1e'
+              % (name, loop_s, stream_s, loop_s / stream_s, max_pending, err))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nrof_classes', type=int,
+        help='Number of classes.', default=2000)
+    parser.add_argument('--min_images', type=int,
+        help='Minimum number of images per class.', default=5)
+    parser.add_argument('--max_images', type=int,
+        help='Maximum number of images per class.', default=40)
+    parser.add_argument('--dim', type=int,
+        help='Embedding size.', default=128)
+    parser.add_argument('--batch_size', type=int,
+        help='Images per batch.', default=90)
+    parser.add_argument('--nrof_workers', type=int,
+        help='Simulated concurrent workers.', default=4)
+    parser.add_argument('--seed', type=int,
+        help='Random seed.', default=666)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
@@ -0,0 +1,61 @@
+"""Benchmarks importing a cohort of students.
+
+Compares the old /add pattern (one ORM object per student) against the bulk
+import path in attendance.importer, on a throwaway SQLite database.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+
+def make_rows(n):
+    return [{'stuname': 'Estudiante %05d' % i, 'regno': '%012d' % i, 'mobileno': '9%09d' % i}
+            for i in range(n)]
+
+
+def main(args):
+    tmp_dir = tempfile.mkdtemp()
+    os.environ['ATTENDANCE_DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp_dir, 'bench.db')
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+    from attendance import app, db, importer
+    from attendance.models import Class, Student
+
+    rows = make_rows(args.nrof_students)
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([Class(id=1, classname='ORM'), Class(id=2, classname='Bulk')])
+        db.session.commit()
+
+        t = time.time()
+        for row in rows:
+            db.session.add(Student(class_id=1, **row))
+        db.session.commit()
+        orm_time = time.time() - t
+
+        t = time.time()
+        result = importer.import_students(rows, 2)
+        bulk_time = time.time() - t
+
+        assert result.inserted == len(rows), result.errors[:5]
+        assert Student.query.filter_by(class_id=2).count() == len(rows)
+
+    print('Students:           %d' % len(rows))
+    print('ORM per-object add: %.3f s (%.0f rows/s)' % (orm_time, len(rows) / orm_time))
+    print('Bulk import:        %.3f s (%.0f rows/s)' % (bulk_time, len(rows) / bulk_time))
+    print('Speedup:            %.1fx' % (orm_time / bulk_time))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nrof_students', type=int,
+        help='Number of students to import.', default=5000)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
@@ -0,0 +1,169 @@
+"""Vectorized LFW-style evaluation vs the previous per-threshold loops.
+
+The reference implementation below is the calculate_roc/calculate_val code
+facenet.py used before (one pass over all pairs per threshold and fold),
+with repeated FARs dropped before interp1d as current scipy requires. On
+--check_pairs random pairs both implementations must return the same TPR,
+FPR, accuracy and VAL@FAR; then verification.py is timed alone on
+--nrof_pairs pairs, where the loops would take minutes.
+"""
+from __future__ import print_function
+
+import argparse
+import importlib.util
+import math
+import os
+import sys
+import time
+
+import numpy as np
+from scipy import interpolate
+from sklearn.model_selection import KFold
+
+VERIFICATION_PY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'attendance', 'facenet', 'src',
+                                               'verification.py'))
+
+
+def load_verification():
+    # facenet.py importa TensorFlow; se carga solo verification.py
+    spec = importlib.util.spec_from_file_location('verification', VERIFICATION_PY)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def distance(embeddings1, embeddings2, distance_metric=0):
+    if distance_metric==0:
+        diff = np.subtract(embeddings1, embeddings2)
+        dist = np.sum(np.square(diff),1)
+    else:
+        dot = np.sum(np.multiply(embeddings1, embeddings2), axis=1)
+        norm = np.linalg.norm(embeddings1, axis=1) * np.linalg.norm(embeddings2, axis=1)
+        dist = np.arccos(dot / norm) / math.pi
+    return dist
+
+
+def calculate_accuracy(threshold, dist, actual_issame):
+    predict_issame = np.less(dist, threshold)
+    tp = np.sum(np.logical_and(predict_issame, actual_issame))
+    fp = np.sum(np.logical_and(predict_issame, np.logical_not(actual_issame)))
+    tn = np.sum(np.logical_and(np.logical_not(predict_issame), np.logical_not(actual_issame)))
+    fn = np.sum(np.logical_and(np.logical_not(predict_issame), actual_issame))
+    tpr = 0 if (tp+fn==0) else float(tp) / float(tp+fn)
+    fpr = 0 if (fp+tn==0) else float(fp) / float(fp+tn)
+    acc = float(tp+tn)/dist.size
+    return tpr, fpr, acc
+
+
+def calculate_val_far(threshold, dist, actual_issame):
+    predict_issame = np.less(dist, threshold)
+    true_accept = np.sum(np.logical_and(predict_issame, actual_issame))
+    false_accept = np.sum(np.logical_and(predict_issame, np.logical_not(actual_issame)))
+    n_same = np.sum(actual_issame)
+    n_diff = np.sum(np.logical_not(actual_issame))
+    return float(true_accept) / float(n_same), float(false_accept) / float(n_diff)
+
+
+def reference_roc(thresholds, embeddings1, embeddings2, actual_issame, nrof_folds, distance_metric, subtract_mean):
+    nrof_pairs = min(len(actual_issame), embeddings1.shape[0])
+    nrof_thresholds = len(thresholds)
+    k_fold = KFold(n_splits=nrof_folds, shuffle=False)
+    tprs = np.zeros((nrof_folds,nrof_thresholds))
+    fprs = np.zeros((nrof_folds,nrof_thresholds))
+    accuracy = np.zeros((nrof_folds))
+    indices = np.arange(nrof_pairs)
+    for fold_idx, (train_set, test_set) in enumerate(k_fold.split(indices)):
+        mean = np.mean(np.concatenate([embeddings1[train_set], embeddings2[train_set]]), axis=0) if subtract_mean else 0.0
+        dist = distance(embeddings1-mean, embeddings2-mean, distance_metric)
+        acc_train = np.zeros((nrof_thresholds))
+        for threshold_idx, threshold in enumerate(thresholds):
+            _, _, acc_train[threshold_idx] = calculate_accuracy(threshold, dist[train_set], actual_issame[train_set])
+        best_threshold_index = np.argmax(acc_train)
+        for threshold_idx, threshold in enumerate(thresholds):
+            tprs[fold_idx,threshold_idx], fprs[fold_idx,threshold_idx], _ = calculate_accuracy(
+                threshold, dist[test_set], actual_issame[test_set])
+        _, _, accuracy[fold_idx] = calculate_accuracy(thresholds[best_threshold_index], dist[test_set], actual_issame[test_set])
+    return np.mean(tprs,0), np.mean(fprs,0), accuracy
+
+
+def reference_val(thresholds, embeddings1, embeddings2, actual_issame, far_target, nrof_folds, distance_metric, subtract_mean):
+    nrof_pairs = min(len(actual_issame), embeddings1.shape[0])
+    nrof_thresholds = len(thresholds)
+    k_fold = KFold(n_splits=nrof_folds, shuffle=False)
+    val = np.zeros(nrof_folds)
+    far = np.zeros(nrof_folds)
+    indices = np.arange(nrof_pairs)
+    for fold_idx, (train_set, test_set) in enumerate(k_fold.split(indices)):
+        mean = np.mean(np.concatenate([embeddings1[train_set], embeddings2[train_set]]), axis=0) if subtract_mean else 0.0
+        dist = distance(embeddings1-mean, embeddings2-mean, distance_metric)
+        far_train = np.zeros(nrof_thresholds)
+        for threshold_idx, threshold in enumerate(thresholds):
+            _, far_train[threshold_idx] = calculate_val_far(threshold, dist[train_set], actual_issame[train_set])
+        if np.max(far_train)>=far_target:
+            far_train, first = np.unique(far_train, return_index=True)
+            f = interpolate.interp1d(far_train, thresholds[first], kind='slinear')
+            threshold = f(far_target)
+        else:
+            threshold = 0.0
+        val[fold_idx], far[fold_idx] = calculate_val_far(threshold, dist[test_set], actual_issame[test_set])
+    return np.mean(val), np.std(val), np.mean(far)
+
+
+def make_pairs(nrof_pairs, dim, rng):
+    # Pares genuinos: la segunda cara es la primera con ruido
+    embeddings1 = rng.randn(nrof_pairs, dim).astype(np.float32)
+    actual_issame = rng.rand(nrof_pairs) < 0.5
+    embeddings2 = rng.randn(nrof_pairs, dim).astype(np.float32)
+    embeddings2[actual_issame] = embeddings1[actual_issame] + 1.5 * embeddings2[actual_issame]
+    embeddings1 /= np.linalg.norm(embeddings1, axis=1, keepdims=True)
+    embeddings2 /= np.linalg.norm(embeddings2, axis=1, keepdims=True)
+    return embeddings1, embeddings2, actual_issame
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main(args):
+    verification = load_verification()
+    rng = np.random.RandomState(args.seed)
+    thresholds = np.arange(0, 4, 0.01)
+    val_thresholds = np.arange(0, 4, 0.001)
+
+    e1, e2, issame = make_pairs(args.check_pairs, args.dim, rng)
+    for metric in (0, 1):
+        for subtract_mean in (False, True):
+            ref, ref_s = timed(lambda: reference_roc(thresholds, e1, e2, issame, args.nrof_folds, metric, subtract_mean)
+                               + reference_val(val_thresholds, e1, e2, issame, 1e-3, args.nrof_folds, metric, subtract_mean))
+            new, new_s = timed(lambda: verification.calculate_roc(thresholds, e1, e2, issame, args.nrof_folds, metric, subtract_mean)
+                               + verification.calculate_val(val_thresholds, e1, e2, issame, 1e-3, args.nrof_folds, metric, subtract_mean))
+            same = all(np.allclose(a, b, rtol=0, atol=1e-12) for a, b in zip(ref, new))
+            print('%d pairs, metric %d, subtract_mean %-5s: loops %.2f s, vectorized %.3f s (%.0fx), identical: %s'
+                  % (args.check_pairs, metric, subtract_mean, ref_s, new_s, ref_s / new_s, same))
+
+    e1, e2, issame = make_pairs(args.nrof_pairs, args.dim, rng)
+    (tpr, fpr, accuracy), roc_s = timed(lambda: verification.calculate_roc(thresholds, e1, e2, issame, args.nrof_folds))
+    (val, val_std, far), val_s = timed(lambda: verification.calculate_val(val_thresholds, e1, e2, issame, 1e-3, args.nrof_folds))
+    print('%d pairs: ROC %.2f s, VAL %.2f s, accuracy %.4f, VAL@FAR=%.4f: %.4f' %
+          (args.nrof_pairs, roc_s, val_s, np.mean(accuracy), far, val))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--check_pairs', type=int,
+        help='Pairs used to compare against the loops.', default=20000)
+    parser.add_argument('--nrof_pairs', type=int,
+        help='Pairs used to time the vectorized evaluation.', default=1000000)
+    parser.add_argument('--dim', type=int,
+        help='Embedding size.', default=128)
+    parser.add_argument('--nrof_folds', type=int,
+        help='Number of folds.', default=10)
+    parser.add_argument('--seed', type=int,
+        help='Random seed.', default=666)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
@@ -0,0 +1,111 @@
+"""Cached dataset manifest vs the previous os.listdir walk of facenet.get_dataset.
+
+Creates --nrof_classes class directories of --images_per_class small files
+and times, including the list of image paths of every class:
+
+- walk: os.listdir of the dataset and of every class directory, as
+  get_dataset and get_image_paths did on every run
+- build: first dataset_manifest.open_manifest (full scandir + write)
+- unchanged: open_manifest when nothing changed (loads it and stats the
+  class directories)
+- one class changed: open_manifest after adding an image to one class
+- manifest file: loading the .npz directly, without touching the dataset
+
+and checks that all of them list the same images.
+"""
+from __future__ import print_function
+
+import argparse
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+DATASET_MANIFEST_PY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'attendance', 'facenet', 'src',
+                                                   'dataset_manifest.py'))
+
+
+def load_dataset_manifest():
+    # facenet.py importa TensorFlow; se carga solo dataset_manifest.py
+    spec = importlib.util.spec_from_file_location('dataset_manifest', DATASET_MANIFEST_PY)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class ImageClass():
+    def __init__(self, name, image_paths):
+        self.name = name
+        self.image_paths = image_paths
+
+
+def reference_walk(path_exp):
+    """The directory walk of the old facenet.get_dataset / get_image_paths."""
+    classes = [path for path in os.listdir(path_exp) if os.path.isdir(os.path.join(path_exp, path))]
+    classes.sort()
+    dataset = []
+    for class_name in classes:
+        facedir = os.path.join(path_exp, class_name)
+        dataset.append((class_name, [os.path.join(facedir, img) for img in os.listdir(facedir)]))
+    return dataset
+
+
+def as_sets(dataset):
+    return [(name, set(paths)) for name, paths in dataset]
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main(args):
+    module = load_dataset_manifest()
+    work_dir = tempfile.mkdtemp(prefix='bench_manifest_')
+    try:
+        root = os.path.join(work_dir, 'aligned')
+        for c in range(args.nrof_classes):
+            folder = os.path.join(root, 'person_%05d' % c)
+            os.makedirs(folder)
+            for i in range(args.images_per_class):
+                with open(os.path.join(folder, 'person_%05d_%04d.png' % (c, i + 1)), 'wb') as f:
+                    f.write(b'\x89PNG')
+        print('%d classes x %d images' % (args.nrof_classes, args.images_per_class))
+
+        def listed(manifest):
+            return [(cls.name, cls.image_paths) for cls in manifest.dataset(ImageClass)]
+
+        reference, walk_s = timed(lambda: reference_walk(root))
+        print('walk:              %.3f s' % walk_s)
+        dataset, build_s = timed(lambda: listed(module.open_manifest(root)))
+        print('build:             %.3f s, same images: %s' % (build_s, as_sets(dataset) == as_sets(reference)))
+        dataset, open_s = timed(lambda: listed(module.open_manifest(root)))
+        print('unchanged:         %.3f s (%.0fx)' % (open_s, walk_s / open_s))
+
+        with open(os.path.join(root, 'person_00000', 'person_00000_new.png'), 'wb') as f:
+            f.write(b'\x89PNG')
+        dataset, changed_s = timed(lambda: listed(module.open_manifest(root)))
+        print('one class changed: %.3f s (%.0fx), same images: %s'
+              % (changed_s, walk_s / changed_s, as_sets(dataset) == as_sets(reference_walk(root))))
+
+        manifest_file = os.path.join(root, module.MANIFEST_FILE)
+        dataset, load_s = timed(lambda: listed(module.open_manifest(manifest_file)))
+        print('manifest file:     %.3f s (%.0fx)' % (load_s, walk_s / load_s))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nrof_classes', type=int,
+        help='Number of class directories.', default=5000)
+    parser.add_argument('--images_per_class', type=int,
+        help='Files per class directory.', default=40)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
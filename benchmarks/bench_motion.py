@@ -0,0 +1,121 @@
+"""Motion gate on a synthetic kiosk stream.
+
+Simulates a fixed camera looking at a hallway: sensor noise and JPEG
+compression on every frame, slow lighting drift, and now and then a
+"person" (a textured blob) walking through and stopping in front of the
+camera. Each frame goes through the same path as /detect: reduced grayscale
+decode, motion gate, and (only when the gate lets it through) a full decode
+plus detection on the changed regions.
+
+Reports the gating ratio, the mean fraction of the frame handed to the
+detector and the per-frame CPU time with and without the gate. The detector
+is face_recognition's HOG detector when installed, otherwise a fixed-cost
+stand-in proportional to the processed area (--detector_ms per full frame).
+"""
+from __future__ import print_function
+
+import argparse
+import base64
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from attendance import recognition  # noqa: E402
+from attendance.motion import MotionGate  # noqa: E402
+
+
+def make_stream(args):
+    rng = np.random.RandomState(args.seed)
+    hallway = cv2.GaussianBlur(rng.randint(0, 255, (args.height, args.width, 3)).astype(np.uint8), (41, 41), 0)
+    person = rng.randint(20, 90, (args.height // 2, args.width // 5, 3)).astype(np.float32)
+    frames = []
+    for i in range(args.nrof_frames):
+        frame = hallway.astype(np.float32) * (1.0 + 0.02 * np.sin(i / 200.0))
+        # Una persona cruza cada visit_every frames y se queda quieta un rato
+        t = i % args.visit_every
+        if t < args.visit_frames:
+            x = int(min(t, args.visit_frames // 2) / float(args.visit_frames // 2) * (args.width - person.shape[1]) / 2)
+            y = args.height // 4
+            frame[y:y + person.shape[0], x:x + person.shape[1]] = person
+        frame += rng.randn(*frame.shape) * args.noise
+        ok, jpeg = cv2.imencode('.jpg', np.clip(frame, 0, 255).astype(np.uint8))
+        frames.append('data:image/jpeg;base64,' + base64.b64encode(jpeg.tobytes()).decode('ascii'))
+    return frames
+
+
+def make_detector(detector_ms):
+    try:
+        import face_recognition
+        return 'face_recognition HOG', lambda img, regions: recognition.face_locations(img, regions)
+    except ImportError:
+        pass
+
+    def stand_in(img, regions):
+        area = 1.0 if regions is None else sum((b - t) * (r - l) for t, r, b, l in regions) / float(img.shape[0] * img.shape[1])
+        end = time.perf_counter() + detector_ms / 1000.0 * min(area, 1.0)
+        while time.perf_counter() < end:
+            pass
+        return []
+    return 'stand-in (%.0f ms per full frame)' % detector_ms, stand_in
+
+
+def run(frames, detect, gate):
+    start = time.process_time()
+    for data_url in frames:
+        small = recognition.decode_reduced(data_url)
+        regions = None
+        if gate is not None:
+            regions = gate.update(small, recognition.REDUCED_SCALE)
+            if regions == []:
+                continue
+        detect(recognition.decode_data_url(data_url), regions)
+    return 1000.0 * (time.process_time() - start) / len(frames)
+
+
+def main(args):
+    frames = make_stream(args)
+    name, detect = make_detector(args.detector_ms)
+    print('%d frames %dx%d, detector: %s' % (len(frames), args.width, args.height, name))
+
+    base_ms = run(frames, detect, None)
+    gate = MotionGate(threshold=args.threshold, min_area=args.min_area)
+    gated_ms = run(frames, detect, gate)
+    stats = gate.metrics()
+    print('Gating ratio: %.3f (%d of %d frames skipped)' % (stats['gating_ratio'], stats['gated'], stats['frames']))
+    print('Frames with regions: %d, full frames: %d' % (stats['regions'], stats['full']))
+    print('Mean fraction of the frame sent to the detector: %.3f' % stats['mean_processed_area'])
+    print('CPU per frame without gate: %.2f ms' % base_ms)
+    print('CPU per frame with gate:    %.2f ms (%.1fx less)' % (gated_ms, base_ms / gated_ms))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nrof_frames', type=int,
+        help='Frames in the stream.', default=600)
+    parser.add_argument('--width', type=int,
+        help='Frame width.', default=480)
+    parser.add_argument('--height', type=int,
+        help='Frame height.', default=360)
+    parser.add_argument('--visit_every', type=int,
+        help='A person walks in every this many frames.', default=300)
+    parser.add_argument('--visit_frames', type=int,
+        help='Frames the person stays in view.', default=40)
+    parser.add_argument('--noise', type=float,
+        help='Sensor noise standard deviation (gray levels).', default=2.0)
+    parser.add_argument('--threshold', type=int,
+        help='Motion gate pixel threshold.', default=25)
+    parser.add_argument('--min_area', type=float,
+        help='Motion gate minimum changed fraction.', default=0.002)
+    parser.add_argument('--detector_ms', type=float,
+        help='Cost of the stand-in detector on a full frame.', default=60.0)
+    parser.add_argument('--seed', type=int,
+        help='Random seed.', default=666)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
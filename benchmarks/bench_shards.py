@@ -0,0 +1,113 @@
+"""Images/sec reading aligned faces from individual files vs memory-mapped shards.
+
+Writes a synthetic aligned dataset (--nrof_classes directories of
+--images_per_class PNG or JPEG faces of --image_size pixels), packs it with
+shards.write_shards and then reads random batches of --batch_size images:
+
+- files: one open + decode per image (what load_data and the TF input
+  pipeline do), with --nrof_workers threads
+- shards: ShardReader.images, a gather from the memory-mapped uint8 shards
+
+and checks that both return the same pixels.
+"""
+from __future__ import print_function
+
+import argparse
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+SHARDS_PY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'attendance', 'facenet', 'src', 'shards.py'))
+
+
+def load_shards():
+    # facenet.py importa TensorFlow; se carga solo shards.py
+    spec = importlib.util.spec_from_file_location('shards', SHARDS_PY)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_dataset(path, args, rng):
+    paths = []
+    for c in range(args.nrof_classes):
+        folder = os.path.join(path, 'person_%04d' % c)
+        os.makedirs(folder)
+        base = cv2.GaussianBlur(rng.randint(0, 255, (args.image_size, args.image_size, 3)).astype(np.uint8), (9, 9), 0)
+        for i in range(args.images_per_class):
+            img = np.clip(base.astype(np.int16) + rng.randint(-20, 20, base.shape), 0, 255).astype(np.uint8)
+            filename = os.path.join(folder, 'person_%04d_%04d.%s' % (c, i + 1, args.format))
+            cv2.imwrite(filename, img)
+            paths.append(filename)
+    return paths
+
+
+def main(args):
+    shards = load_shards()
+    rng = np.random.RandomState(args.seed)
+    work_dir = tempfile.mkdtemp(prefix='bench_shards_')
+    try:
+        input_dir = os.path.join(work_dir, 'aligned')
+        output_dir = os.path.join(work_dir, 'shards')
+        make_dataset(input_dir, args, rng)
+
+        start = time.perf_counter()
+        nrof_images = shards.write_shards(input_dir, output_dir, args.images_per_shard, args.nrof_workers)
+        print('Packed %d images in %.1f s' % (nrof_images, time.perf_counter() - start))
+
+        reader = shards.ShardReader(output_dir)
+        paths = [os.path.join(input_dir, str(p)) for p in reader.paths]
+        batches = [rng.randint(0, nrof_images, args.batch_size) for _ in range(args.nrof_batches)]
+
+        with ThreadPoolExecutor(args.nrof_workers) as executor:
+            start = time.perf_counter()
+            for batch in batches:
+                from_files = np.stack(list(executor.map(shards.imread, [paths[i] for i in batch])))
+            files_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for batch in batches:
+            from_shards = reader.images(batch)
+        shards_s = time.perf_counter() - start
+
+        diff = np.abs(from_files.astype(np.int16) - from_shards.astype(np.int16)).max()
+        nrof_read = args.batch_size * args.nrof_batches
+        print('files:  %8.0f images/sec (%d threads)' % (nrof_read / files_s, args.nrof_workers))
+        print('shards: %8.0f images/sec (%.0fx)' % (nrof_read / shards_s, files_s / shards_s))
+        print('Max pixel difference: %d' % diff)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nrof_classes', type=int,
+        help='Number of classes.', default=100)
+    parser.add_argument('--images_per_class', type=int,
+        help='Images per class.', default=50)
+    parser.add_argument('--image_size', type=int,
+        help='Aligned face size.', default=182)
+    parser.add_argument('--format', type=str, choices=['png', 'jpg'],
+        help='Image file format.', default='png')
+    parser.add_argument('--images_per_shard', type=int,
+        help='Images per shard file.', default=2000)
+    parser.add_argument('--batch_size', type=int,
+        help='Images per batch.', default=90)
+    parser.add_argument('--nrof_batches', type=int,
+        help='Batches read in each mode.', default=50)
+    parser.add_argument('--nrof_workers', type=int,
+        help='Decoding threads.', default=4)
+    parser.add_argument('--seed', type=int,
+        help='Random seed.', default=666)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
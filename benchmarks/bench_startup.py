@@ -0,0 +1,58 @@
+"""Measures the cost of `import attendance` in a fresh interpreter.
+
+Each run spawns a new Python process, times the import, reports the peak RSS
+and checks that none of the heavy ML modules were pulled in by the web app.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ['tensorflow', 'keras', 'cv2', 'scipy', 'sklearn', 'face_recognition', 'dlib']
+
+CHILD = r'''
+import json, resource, sys, time
+t = time.perf_counter()
+import attendance
+elapsed = time.perf_counter() - t
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+heavy = sorted(m for m in %r if m in sys.modules)
+print(json.dumps({'seconds': elapsed, 'rss_mb': rss_kb / 1024.0, 'heavy': heavy}))
+''' % (HEAVY_MODULES,)
+
+
+def run_once(repo_dir):
+    out = subprocess.check_output([sys.executable, '-c', CHILD], cwd=repo_dir)
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+
+def main(args):
+    repo_dir = os.path.abspath(args.repo_dir)
+    runs = [run_once(repo_dir) for _ in range(args.nrof_runs)]
+    seconds = sorted(r['seconds'] for r in runs)
+    rss = sorted(r['rss_mb'] for r in runs)
+    print('import attendance: median %.3f s (min %.3f, max %.3f) over %d runs' %
+          (seconds[len(seconds) // 2], seconds[0], seconds[-1], len(runs)))
+    print('peak RSS: median %.1f MB' % rss[len(rss) // 2])
+    heavy = runs[-1]['heavy']
+    if heavy:
+        print('FAIL: heavy modules loaded at import time: %s' % ', '.join(heavy))
+        return 1
+    print('OK: no heavy ML modules loaded at import time')
+    return 0
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repo_dir', type=str,
+        help='Directory containing the attendance package.', default=os.path.join(os.path.dirname(__file__), '..'))
+    parser.add_argument('--nrof_runs', type=int,
+        help='Number of fresh interpreters to time.', default=5)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_arguments(sys.argv[1:])))
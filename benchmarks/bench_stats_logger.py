@@ -0,0 +1,131 @@
+"""Appendable stats_logger.StatsLogger vs rewriting the whole stat.h5 every epoch.
+
+Simulates the statistics of a train_softmax run of --max_nrof_epochs epochs
+of --epoch_size steps (six per-step scalars, a 1000 bin prelogits histogram
+and a few scalars per epoch) and times the statistics I/O with:
+
+- rewrite: the previous preallocated arrays, written in full to stat.h5 at
+  the end of every epoch
+- logger: StatsLogger, flushed at the end of every epoch
+
+Prints the time of the first and last epochs, checks that both files hold
+the same statistics and that the logger file can be read while it is open.
+"""
+from __future__ import print_function
+
+import argparse
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+STATS_LOGGER_PY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'attendance', 'facenet', 'src',
+                                               'stats_logger.py'))
+
+STEP_FIELDS = ('loss', 'center_loss', 'reg_loss', 'xent_loss', 'prelogits_norm', 'accuracy')
+EPOCH_FIELDS = ('learning_rate', 'time_train', 'time_validate', 'time_evaluate')
+
+
+def load_stats_logger():
+    # train_softmax.py importa TensorFlow; se carga solo stats_logger.py
+    spec = importlib.util.spec_from_file_location('stats_logger', STATS_LOGGER_PY)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def epoch_values(args, rng):
+    step_values = dict((name, rng.rand(args.epoch_size).astype(np.float32)) for name in STEP_FIELDS)
+    epoch_scalars = dict((name, np.float32(rng.rand())) for name in EPOCH_FIELDS)
+    hist = rng.randint(0, 1000, 1000).astype(np.float32)
+    return step_values, epoch_scalars, hist
+
+
+def reference_run(filename, args, rng):
+    """The preallocated stat dict of the old train_softmax, written in full every epoch."""
+    nrof_steps = args.max_nrof_epochs * args.epoch_size
+    stat = dict((name, np.zeros((nrof_steps,), np.float32)) for name in STEP_FIELDS)
+    stat.update((name, np.zeros((args.max_nrof_epochs,), np.float32)) for name in EPOCH_FIELDS)
+    stat['prelogits_hist'] = np.zeros((args.max_nrof_epochs, 1000), np.float32)
+    times = []
+    for epoch in range(args.max_nrof_epochs):
+        step_values, epoch_scalars, hist = epoch_values(args, rng)
+        start = time.perf_counter()
+        for step in range(args.epoch_size):
+            for name in STEP_FIELDS:
+                stat[name][epoch * args.epoch_size + step] = step_values[name][step]
+        for name in EPOCH_FIELDS:
+            stat[name][epoch] = epoch_scalars[name]
+        stat['prelogits_hist'][epoch, :] += hist
+        with h5py.File(filename, 'w') as f:
+            for key, value in stat.items():
+                f.create_dataset(key, data=value)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def logger_run(module, filename, args, rng):
+    fields = dict((name, ()) for name in STEP_FIELDS + EPOCH_FIELDS)
+    fields['prelogits_hist'] = (1000,)
+    times = []
+    live_ok = True
+    with module.StatsLogger(filename, fields) as stat:
+        for epoch in range(args.max_nrof_epochs):
+            step_values, epoch_scalars, hist = epoch_values(args, rng)
+            start = time.perf_counter()
+            for step in range(args.epoch_size):
+                for name in STEP_FIELDS:
+                    stat.log(name, epoch * args.epoch_size + step, step_values[name][step])
+            for name in EPOCH_FIELDS:
+                stat.log(name, epoch, epoch_scalars[name])
+            stat.log('prelogits_hist', epoch, hist)
+            stat.flush()
+            times.append(time.perf_counter() - start)
+            if epoch == args.max_nrof_epochs // 2:
+                # Lectura mientras el archivo sigue abierto para escritura
+                live = module.read_stats(filename)
+                live_ok = (live['loss'].shape[0] == (epoch + 1) * args.epoch_size and
+                           np.array_equal(live['loss'][-args.epoch_size:], step_values['loss']))
+    return times, live_ok
+
+
+def main(args):
+    module = load_stats_logger()
+    work_dir = tempfile.mkdtemp(prefix='bench_stats_')
+    try:
+        reference_file = os.path.join(work_dir, 'stat_rewrite.h5')
+        logger_file = os.path.join(work_dir, 'stat_logger.h5')
+        print('%d epochs of %d steps' % (args.max_nrof_epochs, args.epoch_size))
+        rewrite_times = reference_run(reference_file, args, np.random.RandomState(args.seed))
+        logger_times, live_ok = logger_run(module, logger_file, args, np.random.RandomState(args.seed))
+        for name, times in (('rewrite', rewrite_times), ('logger', logger_times)):
+            print('%-8s first epoch %.1f ms, last epoch %.1f ms, total %.2f s'
+                  % (name, 1000 * times[0], 1000 * times[-1], sum(times)))
+
+        with h5py.File(reference_file, 'r') as f:
+            reference = dict((name, f[name][()]) for name in f)
+        logged = module.read_stats(logger_file)
+        same = sorted(reference) == sorted(logged) and all(np.array_equal(reference[k], logged[k]) for k in reference)
+        print('same statistics: %s, read while training: %s' % (same, live_ok))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max_nrof_epochs', type=int,
+        help='Number of epochs.', default=200)
+    parser.add_argument('--epoch_size', type=int,
+        help='Number of steps per epoch.', default=1000)
+    parser.add_argument('--seed', type=int,
+        help='Random seed.', default=666)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
@@ -0,0 +1,108 @@
+"""Vectorized triplet selection vs the previous select_triplets loops.
+
+Builds a synthetic batch like train_tripletloss (people_per_batch classes of
+images_per_person embeddings on the unit sphere) and, for both selection
+modes, checks that every anchor-positive pair gets a negative from exactly
+the same candidate set as in the loops, then times one selection per batch.
+"""
+from __future__ import print_function
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+import numpy as np
+
+TRIPLET_SELECTION_PY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'attendance', 'facenet', 'src',
+                                                    'triplet_selection.py'))
+
+
+def load_triplet_selection():
+    # train_tripletloss.py importa TensorFlow; se carga solo triplet_selection.py
+    spec = importlib.util.spec_from_file_location('triplet_selection', TRIPLET_SELECTION_PY)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def reference_candidates(embeddings, nrof_images_per_class, people_per_batch, alpha, mode):
+    """The loops of the old select_triplets, returning every pair's candidate negatives."""
+    emb_start_idx = 0
+    candidates = []
+    for i in range(people_per_batch):
+        nrof_images = int(nrof_images_per_class[i])
+        for j in range(1, nrof_images):
+            a_idx = emb_start_idx + j - 1
+            neg_dists_sqr = np.sum(np.square(embeddings[a_idx] - embeddings), 1)
+            for pair in range(j, nrof_images):
+                p_idx = emb_start_idx + pair
+                pos_dist_sqr = np.sum(np.square(embeddings[a_idx]-embeddings[p_idx]))
+                neg_dists_sqr[emb_start_idx:emb_start_idx+nrof_images] = np.nan
+                if mode == 'facenet':
+                    all_neg = np.where(np.logical_and(neg_dists_sqr-pos_dist_sqr<alpha, pos_dist_sqr<neg_dists_sqr))[0]
+                else:
+                    all_neg = np.where(neg_dists_sqr-pos_dist_sqr<alpha)[0]
+                candidates.append((a_idx, p_idx, set(all_neg.tolist())))
+        emb_start_idx += nrof_images
+    return candidates
+
+
+def make_batch(people_per_batch, images_per_person, dim, spread, rng):
+    centers = rng.randn(people_per_batch, dim)
+    embeddings = np.repeat(centers, images_per_person, axis=0) + spread * rng.randn(people_per_batch * images_per_person, dim)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings, np.full(people_per_batch, images_per_person)
+
+
+def main(args):
+    selection = load_triplet_selection()
+    rng = np.random.RandomState(args.seed)
+    embeddings, num_per_class = make_batch(args.people_per_batch, args.images_per_person, args.dim, args.spread, rng)
+    image_paths = ['img_%05d.png' % i for i in range(embeddings.shape[0])]
+    labels = selection.batch_labels(num_per_class, args.people_per_batch)
+    print('Batch of %d people x %d images, dim %d' % (args.people_per_batch, args.images_per_person, args.dim))
+
+    for mode in selection.SELECTION_MODES:
+        start = time.perf_counter()
+        reference = reference_candidates(embeddings, num_per_class, args.people_per_batch, args.alpha, mode)
+        loop_s = time.perf_counter() - start
+
+        anchors, positives, negatives, nrof_pairs = selection.select_triplet_indices(embeddings, labels, args.alpha, mode, rng)
+        chosen = dict(((a, p), n) for a, p, n in zip(anchors, positives, negatives))
+        # Las distancias se calculan de otra forma: se toleran diferencias en el limite del margen
+        mismatches = sum(1 for a, p, cands in reference if ((a, p) in chosen) != bool(cands)
+                         or ((a, p) in chosen and chosen[(a, p)] not in cands))
+
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            selection.select_triplets(embeddings, num_per_class, image_paths, args.people_per_batch, args.alpha, mode, rng)
+            timings.append(time.perf_counter() - start)
+        vec_s = float(np.median(timings))
+        print('%-7s %d pairs, %d triplets, %d mismatches: loops %.2f s, vectorized %.3f s (%.0fx)'
+              % (mode, nrof_pairs, anchors.shape[0], mismatches, loop_s, vec_s, loop_s / vec_s))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--people_per_batch', type=int,
+        help='Number of people per batch.', default=45)
+    parser.add_argument('--images_per_person', type=int,
+        help='Number of images per person.', default=40)
+    parser.add_argument('--dim', type=int,
+        help='Embedding size.', default=128)
+    parser.add_argument('--spread', type=float,
+        help='Intra-class noise (relative to the class center).', default=0.8)
+    parser.add_argument('--alpha', type=float,
+        help='Triplet loss margin.', default=0.2)
+    parser.add_argument('--repeat', type=int,
+        help='Timing repetitions.', default=10)
+    parser.add_argument('--seed', type=int,
+        help='Random seed.', default=666)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
@@ -0,0 +1,127 @@
+"""Concurrency stress test: many kiosks marking attendance at once.
+
+Each kiosk is a separate process (like separate web workers) that upserts
+attendance rows and commits as fast as it can, while one reader process pages
+through /attendance_list-style queries. Reports throughput and the number of
+"database is locked" errors. Run with --no_tuning to compare against the
+default SQLite settings.
+"""
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def _import_app(db_uri, tuning):
+    os.environ['ATTENDANCE_DATABASE_URI'] = db_uri
+    os.environ['ATTENDANCE_SQLITE_TUNING'] = '1' if tuning else '0'
+    sys.path.insert(0, REPO_DIR)
+    from attendance import app, db
+    from attendance.models import Attendance
+    return app, db, Attendance
+
+
+def kiosk(db_uri, tuning, nrof_students, duration, seed, results):
+    from datetime import datetime, timedelta
+    from sqlalchemy.exc import OperationalError
+
+    app, db, Attendance = _import_app(db_uri, tuning)
+    rng = random.Random(seed)
+    ok = locked = 0
+    base = datetime(2025, 1, 1, 8, 0)
+    end = time.time() + duration
+    with app.app_context():
+        while time.time() < end:
+            # Cada kiosco simula un dia distinto de vez en cuando para forzar inserts
+            when = base + timedelta(days=rng.randrange(30), seconds=rng.randrange(3600))
+            try:
+                Attendance.mark(rng.randint(1, nrof_students), when)
+                db.session.commit()
+                ok += 1
+            except OperationalError as e:
+                db.session.rollback()
+                if 'locked' not in str(e):
+                    raise
+                locked += 1
+    results.put(('write', ok, locked))
+
+
+def reader(db_uri, tuning, duration, results):
+    from sqlalchemy.exc import OperationalError
+
+    app, db, Attendance = _import_app(db_uri, tuning)
+    ok = locked = 0
+    end = time.time() + duration
+    with app.app_context():
+        while time.time() < end:
+            try:
+                (Attendance.query.order_by(Attendance.timestamp.desc(), Attendance.id.desc())
+                 .limit(50).all())
+                db.session.commit()
+                ok += 1
+            except OperationalError as e:
+                db.session.rollback()
+                if 'locked' not in str(e):
+                    raise
+                locked += 1
+    results.put(('read', ok, locked))
+
+
+def main(args):
+    tuning = not args.no_tuning
+    db_uri = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'stress.db')
+    app, db, _ = _import_app(db_uri, tuning)
+    from attendance.models import Class, Student
+    with app.app_context():
+        db.create_all()
+        db.session.add(Class(id=1, classname='Stress'))
+        db.session.execute(db.insert(Student), [
+            {'id': i, 'stuname': 's%d' % i, 'regno': str(i), 'class_id': 1}
+            for i in range(1, args.nrof_students + 1)])
+        db.session.commit()
+        journal_mode = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    procs = [ctx.Process(target=kiosk, args=(db_uri, tuning, args.nrof_students, args.duration, i, results))
+             for i in range(args.nrof_kiosks)]
+    procs.append(ctx.Process(target=reader, args=(db_uri, tuning, args.duration, results)))
+    for p in procs:
+        p.start()
+    stats = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    writes = sum(s[1] for s in stats if s[0] == 'write')
+    reads = sum(s[1] for s in stats if s[0] == 'read')
+    locked = sum(s[2] for s in stats)
+    print('SQLite tuning: %s (journal_mode=%s)' % ('on' if tuning else 'off', journal_mode))
+    print('Kiosks: %d, duration: %.1f s' % (args.nrof_kiosks, args.duration))
+    print('Writes: %d (%.0f/s)' % (writes, writes / args.duration))
+    print('Reads:  %d (%.0f/s)' % (reads, reads / args.duration))
+    print('"database is locked" errors: %d' % locked)
+    return 1 if locked else 0
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nrof_kiosks', type=int,
+        help='Number of concurrent writer processes.', default=16)
+    parser.add_argument('--nrof_students', type=int,
+        help='Number of enrolled students to mark.', default=500)
+    parser.add_argument('--duration', type=float,
+        help='Seconds each kiosk keeps writing.', default=10.0)
+    parser.add_argument('--no_tuning',
+        help='Use the default SQLite settings (no WAL, no busy timeout pragma).', action='store_true')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_arguments(sys.argv[1:])))
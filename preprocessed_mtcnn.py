@@ -1,22 +1,28 @@
 # mtcnn_preprocess.py
 import os
+import sys
 import cv2
 import numpy as np
 from mtcnn import MTCNN
 from PIL import Image
 
+# Como los scripts de facenet/src: importar el paquete attendance arrancaria
+# la aplicacion (Flask, base de datos y manejador de SIGTERM)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'attendance', 'facenet', 'src'))
+from align.landmarks import warp_faces
+
 detector = MTCNN()
 
 RAW_DIR = "data/raw_faces"
 PROCESSED_DIR = "data/processed_faces"
+IMAGE_SIZE = 160
+KEYPOINTS = ('left_eye', 'right_eye', 'nose', 'mouth_left', 'mouth_right')
 
-def align_face(image, left_eye, right_eye):
-    dx, dy = right_eye[0] - left_eye[0], right_eye[1] - left_eye[1]
-    angle = np.degrees(np.arctan2(dy, dx))
-    center = tuple(np.mean([left_eye, right_eye], axis=0).astype(int))
-    rot_mat = cv2.getRotationMatrix2D(center, angle, 1)
-    aligned = cv2.warpAffine(image, rot_mat, (image.shape[1], image.shape[0]))
-    return aligned
+def align_faces(image, detections, image_size=IMAGE_SIZE, margin=0):
+    # Transformacion de similitud desde los 5 puntos de cada cara directamente
+    # a image_size x image_size, sin rotar la imagen completa
+    points = np.array([[det['keypoints'][k] for k in KEYPOINTS] for det in detections], dtype=np.float32)
+    return warp_faces(image, points, image_size, margin)
 
 def preprocess_faces():
     for person in os.listdir(RAW_DIR):
@@ -32,13 +38,8 @@ def preprocess_faces():
             if not detections:
                 continue
 
-            for i, det in enumerate(detections):
-                x, y, w, h = det['box']
-                keypoints = det['keypoints']
-                face = img[y:y+h, x:x+w]
-                face = align_face(face, keypoints['left_eye'], keypoints['right_eye'])
-                face = Image.fromarray(face).resize((160, 160))
-                face.save(os.path.join(output_dir, f"{person}_{i}.jpg"))
+            for i, face in enumerate(align_faces(img, detections)):
+                Image.fromarray(face).save(os.path.join(output_dir, f"{person}_{i}.jpg"))
 
         print(f"✅ Procesadas imágenes para {person}")
 